@@ -5,4 +5,19 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import wifi_manager.core as core
+import wifi_manager.migrations as migrations
 import wifi_manager.rest as rest
+import wifi_manager.writer as writer
+import wifi_manager.supervisor as supervisor
+import wifi_manager.core_async as core_async
+import wifi_manager.helper as helper
+import wifi_manager.command as command
+import wifi_manager.limits as limits
+import wifi_manager.generations as generations
+import wifi_manager.signals as signals
+import wifi_manager.loadtest as loadtest
+import wifi_manager.gateway as gateway
+import wifi_manager.logs as logs
+import wifi_manager.startup as startup
+import wifi_manager.stats as stats
+import wifi_manager.connections as connections
@@ -0,0 +1,4 @@
+#!/bin/bash
+
+cd $(dirname $0)/..
+sudo python test_gateway.py
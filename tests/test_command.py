@@ -0,0 +1,32 @@
+from context import command
+import time
+import unittest
+
+
+class WifiCommandTestCase(unittest.TestCase):
+
+    def test_run(self):
+        code, output, stderr = command.run(['sh', '-c', 'echo foo; echo bar >&2; exit 2'])
+        self.assertEqual(code, 2)
+        self.assertEqual(output, 'foo\n')
+        self.assertEqual(stderr, 'bar\n')
+
+    def test_timeout(self):
+        timeouts = command.counters().get('sh', {}).get('timeouts', 0)
+        start = time.time()
+
+        # the background sleep belongs to the same process group and must be killed too
+        with self.assertRaises(command.CommandTimeout) as cm:
+            command.run(['sh', '-c', 'echo partial >&2; sleep 30 & sleep 30'], timeout=0.5)
+
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(cm.exception.stderr, 'partial\n')
+        self.assertEqual(command.counters()['sh']['timeouts'], timeouts + 1)
+
+    def test_command_name(self):
+        self.assertEqual(command.command_name(['sudo', 'ifup', 'wlan0']), 'ifup')
+        self.assertEqual(command.command_name(['/sbin/iwlist', 'wlan0', 'scan']), 'iwlist')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+from context import connections
+import socket
+import unittest
+
+
+class _Conn(object):
+    def __init__(self, n):
+        self.n = n
+        self.stale = False
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class WifiConnectionsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.opened = []
+
+        def connect():
+            self.opened.append(_Conn(len(self.opened)))
+            return self.opened[-1]
+
+        self.pool = connections.IdlePool(connect, max_idle=1)
+
+    def exchange(self, conn):
+        if conn.stale:
+            raise socket.error("closed by peer")
+        return conn.n
+
+    def test_reuse(self):
+        conn, res = self.pool.exchange(self.exchange, socket.error)
+        self.pool.release(conn)
+        conn, res = self.pool.exchange(self.exchange, socket.error)
+        self.assertEqual(res, 0)
+        self.assertEqual(len(self.opened), 1)
+
+        # one idle connection at most
+        other = self.pool.connect()
+        self.pool.release(conn)
+        self.pool.release(other)
+        self.assertTrue(other.closed)
+
+        self.pool.close()
+        self.assertTrue(conn.closed)
+
+    def test_stale(self):
+        conn, res = self.pool.exchange(self.exchange, socket.error)
+        conn.stale = True
+        self.pool.release(conn)
+
+        # the stale idle connection is replaced once
+        conn, res = self.pool.exchange(self.exchange, socket.error)
+        self.assertEqual(res, 1)
+        self.assertTrue(self.opened[0].closed)
+
+        # a new connection that fails is not retried
+        self.pool.connect = lambda: self.opened[0]
+        self.assertRaises(socket.error, self.pool.exchange, self.exchange, socket.error)
+
+
+if __name__ == '__main__':
+    unittest.main()
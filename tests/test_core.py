@@ -1,7 +1,9 @@
-from context import os, core
+from context import os, core, migrations, stats
+import shutil
 import unittest
 import sqlite3
 import tempfile
+import time
 
 
 class WifiCoreTestCase(unittest.TestCase):
@@ -19,6 +21,7 @@ class WifiCoreTestCase(unittest.TestCase):
         with open(db_source) as f:
             self.db.executescript(f.read())
         self.db.commit()
+        migrations.migrate(self.db)
 
         self.iface = 'wlan0'
         self.gps_inf = -1000.0
@@ -27,6 +30,25 @@ class WifiCoreTestCase(unittest.TestCase):
         os.close(self.db_fd)
         os.unlink(self.db_name)
 
+    def _temp_writer(self):
+        """
+        write the schemes to a temporary file instead of /etc/network/interfaces until the end of the test, with
+        self.iface as the only existing interface
+
+        :return: path of the file
+        """
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+
+        self.addCleanup(setattr, core, 'WRITER', core.WRITER)
+        self.addCleanup(setattr, core, '_iface_exists', core._iface_exists)
+        core.WRITER = core.InterfacesWriter(path, window=0)
+        core._iface_exists = lambda iface: iface == self.iface
+
+        return path
+
     def test_0a_disable(self):
         code = core.disable(self.iface)
         self.assertEqual(code, 0)
@@ -151,6 +173,287 @@ class WifiCoreTestCase(unittest.TestCase):
             self.assertTrue(len(psk) > 0)
             self.assertTrue(len(ssid) > 0)
 
+    def test_migrate(self):
+        self.assertEqual(migrations.version(self.db), migrations.MIGRATIONS[-1][0])
+        self.assertEqual(migrations.migrate(self.db), migrations.MIGRATIONS[-1][0])
+
+        indexes = [i[1] for i in self.db.execute("PRAGMA index_list(networks);").fetchall()]
+        self.assertIn('networks_ssid', indexes)
+
+        columns = [c[1] for c in self.db.execute("PRAGMA table_info(networks);").fetchall()]
+        for c in ('options', 'last_seen', 'last_connected', 'connect_attempts', 'connect_failures'):
+            self.assertIn(c, columns)
+
+        tables = [t[0] for t in self.db.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall()]
+        self.assertIn('changes', tables)
+
+    def test_changes(self):
+        core._save_to_db(self.iface, 'foo', '', self.db, self.gps_inf, self.gps_inf, {'wireless-essid': 'foo'})
+        version = core.changes_version(self.db)
+        self.assertEqual([(c['op'], c['ssid']) for c in core.changes(self.db)], [('save', 'foo')])
+
+        # neither statistics nor unchanged configurations are changes
+        core.StatsRecorder(flush_size=1).record(self.db, self.iface, 'foo', 0, 1.0, 1, True, -50)
+        core._save_to_db(self.iface, 'foo', '', self.db, self.gps_inf, self.gps_inf, {'wireless-essid': 'foo'})
+        self.assertEqual(core.changes_version(self.db), version)
+
+        self._temp_writer()
+
+        core.WRITER.save(core.Scheme(self.iface, 'foo', {'wireless-essid': 'foo'}))
+
+        entries = [{"op": "save", "iface": self.iface, "ssid": "bar", "options": {'wireless-essid': 'bar'}},
+                   {"op": "delete", "iface": self.iface, "ssid": "foo"}]
+        res = core.import_changes(self.db, entries)
+        self.assertEqual((res['saved'], res['deleted']), (1, 1))
+        self.assertGreater(res['version'], version)
+
+        changes = list(core.changes(self.db, version))
+        self.assertEqual([(c['op'], c['ssid']) for c in changes], [('save', 'bar'), ('delete', 'foo')])
+        self.assertEqual(changes[0]['options'], {'wireless-essid': 'bar'})
+        self.assertEqual(changes[-1]['version'], res['version'])
+        self.assertEqual([s.name for s in core.WRITER.all()], ['bar'])
+
+        # invalid entries: nothing is applied
+        entries = [{"op": "delete", "iface": self.iface, "ssid": "bar"}, {"op": "save", "iface": self.iface}]
+        with self.assertRaises(core.WifiException):
+            core.import_changes(self.db, entries)
+        self.assertEqual(core.changes_version(self.db), res['version'])
+
+        # entries that would add hooks or stanzas to the file, or configure a missing interface
+        for entry in ({"iface": self.iface, "ssid": "x", "options": {'up': 'touch /tmp/pwned'}},
+                      {"iface": self.iface, "ssid": "x", "options": {'wireless-essid': 'x\n    pre-up reboot'}},
+                      {"iface": self.iface, "ssid": "x\nauto eth9", "options": {'wireless-essid': 'x'}},
+                      {"iface": self.iface, "ssid": "x y", "options": {'wireless-essid': 'x'}},
+                      {"iface": "eth9 inet", "ssid": "x", "options": {'wireless-essid': 'x'}},
+                      {"iface": "wlan9", "ssid": "x", "options": {'wireless-essid': 'x'}}):
+            entry["op"] = "save"
+            with self.assertRaises(core.WifiException) as cm:
+                core.import_changes(self.db, [entry])
+            self.assertEqual(cm.exception.code, 400)
+        self.assertEqual([s.name for s in core.WRITER.all()], ['bar'])
+
+    def test_stats(self):
+        core._save_to_db(self.iface, 'foo', '', self.db, self.gps_inf, self.gps_inf)
+        recorder = core.StatsRecorder(flush_size=10)
+
+        for duration, success in ((4.0, True), (2.0, True), (60.0, False), (3.0, True)):
+            recorder.record(self.db, self.iface, 'foo', 0, duration, 1, success, -50)
+
+        summary = recorder.summary(self.db)[(self.iface, 'foo')]
+        self.assertEqual(summary['attempts'], 4)
+        self.assertEqual(summary['success_rate'], 0.75)
+        self.assertEqual(summary['median_time'], 3.0)
+
+        attempts, failures = self.db.execute("SELECT connect_attempts, connect_failures FROM networks;").fetchone()
+        self.assertEqual((attempts, failures), (4, 1))
+
+        # only the most recent attempts of each network are kept
+        for i in range(stats.HISTORY):
+            recorder.record(self.db, self.iface, 'foo', i + 1, 1.0, 1, True, -50)
+        recorder.flush(self.db)
+        count, oldest = self.db.execute("SELECT COUNT(*), MIN(started) FROM connections;").fetchone()
+        self.assertEqual((count, oldest), (stats.HISTORY, 1))
+        self.assertEqual(recorder.summary(self.db)[(self.iface, 'foo')]['success_rate'], 1.0)
+
+        # buffered attempts are written on close, e.g. at exit
+        recorder.record(self.db, self.iface, 'foo', 100, 1.0, 1, False, -50)
+        self.assertEqual(recorder.close(self.db_name), 1)
+        self.assertEqual(recorder.close(self.db_name), 0)
+        self.assertEqual(self.db.execute("SELECT MAX(started) FROM connections;").fetchone()[0], 100)
+
+        fast = core._rank(self.iface, {"signal": -60, "address": "00:00:00:00:00:01"},
+                          {"success_rate": 1.0, "median_time": 2.0})
+        slow = core._rank(self.iface, {"signal": -55, "address": "00:00:00:00:00:02"},
+                          {"success_rate": 0.5, "median_time": 30.0})
+        self.assertGreater(fast, slow)
+
+    def test_cell_groups(self):
+        cells = [{"ssid": "foo", "signal": -50, "frequency": "2.412 GHz", "address": "00:00:00:00:01:01"},
+                 {"ssid": "foo", "signal": -58, "frequency": "5.18 GHz", "address": "00:00:00:00:01:02"},
+                 {"ssid": "bar", "signal": -40, "frequency": "2.437 GHz", "address": "00:00:00:00:01:03"},
+                 {"ssid": "bar", "signal": -60, "frequency": "5.2 GHz", "address": "00:00:00:00:01:04"}]
+
+        groups = core.cell_groups(self.iface, cells)
+        self.assertEqual([g["address"] for g in groups], ["00:00:00:00:01:03", "00:00:00:00:01:02"])
+        self.assertEqual([g["count"] for g in groups], [2, 2])
+        self.assertEqual(groups[0]["bands"], ["2.4", "5"])
+
+        scheme = core.Scheme(self.iface, 'foo', {'wpa-ssid': 'foo', 'wpa-psk': 'bar'})
+        pinned = core._pinned(scheme, "00:00:00:00:01:02")
+        self.assertEqual(pinned.options['wpa-bssid'], "00:00:00:00:01:02")
+        self.assertNotIn('wpa-bssid', scheme.options)
+
+        scheme = core.Scheme(self.iface, 'foo', {'wireless-essid': 'foo', 'wireless-channel': 'auto'})
+        self.assertEqual(core._pinned(scheme, "00:00:00:00:01:02").options['wireless-ap'], "00:00:00:00:01:02")
+
+    def test_scan_all(self):
+        def fake_cell_all(iface):
+            if iface == 'slow0':
+                time.sleep(1)
+            if iface == 'down0':
+                raise core.WifiException("Network is down", 404)
+            return [{"ssid": iface, "signal": -50}]
+
+        cell_all = core.cell_all
+        core.cell_all = fake_cell_all
+
+        try:
+            res = core.scan_all(['fast0', 'slow0', 'down0'], timeout=0.2)
+        finally:
+            core.cell_all = cell_all
+
+        self.assertEqual(res['cells'], [{"ssid": 'fast0', "signal": -50, "iface": 'fast0'}])
+        self.assertEqual(res['errors']['slow0']['code'], 504)
+        self.assertEqual(res['errors']['down0']['code'], 404)
+
+    def test_wireless_interfaces(self):
+        path = tempfile.mkdtemp()
+        for iface in ('wlan1', 'eth0', 'wlan0'):
+            os.mkdir(os.path.join(path, iface))
+        for iface in ('wlan1', 'wlan0'):
+            os.mkdir(os.path.join(path, iface, 'wireless'))
+        sys_net, core.SYS_NET = core.SYS_NET, path
+
+        try:
+            # listed whether they have an address or not
+            self.assertEqual(core.wireless_interfaces(), ['wlan0', 'wlan1'])
+            self.assertTrue(core._iface_exists('eth0'))
+            self.assertFalse(core._iface_exists('eth1'))
+
+            core.SYS_NET = os.path.join(path, 'missing')
+            self.assertEqual(core.wireless_interfaces(), [])
+        finally:
+            core.SYS_NET = sys_net
+            shutil.rmtree(path)
+
+    def test_connect_any(self):
+        class FakeCell(object):
+            encrypted = False
+            signal = -50
+
+        self._temp_writer()
+        disabled = []
+
+        def fake_activate(iface, ssid, scheme, cancel=None):
+            if iface == 'slow0':
+                cancel.wait(2)
+            return True, 1, None
+
+        saved = core._network_in_range, core._activate, core.disable
+        core._network_in_range = lambda iface, ssid: FakeCell()
+        core._activate = fake_activate
+        core.disable = disabled.append
+
+        try:
+            for iface in ('fast0', 'slow0'):
+                core.WRITER.save(core.Scheme(iface, 'foo', {'wireless-essid': 'foo'}))
+
+            winner = core.connect_any(['slow0', 'fast0'], 'foo', None, self.db)
+            self.assertEqual(winner, 'fast0')
+
+            for i in range(20):
+                if disabled:
+                    break
+                time.sleep(0.1)
+            self.assertEqual(disabled, ['slow0'])
+
+            rows = self.db.execute("SELECT iface FROM networks WHERE ssid='foo';").fetchall()
+            self.assertEqual(rows, [('fast0',)])
+
+            # another race won by the other interface: one row per interface, the latest location is kept
+            core.WRITER.save(core.Scheme('next0', 'foo', {'wireless-essid': 'foo'}))
+            self.assertEqual(core.connect_any(['next0'], 'foo', None, self.db, lat=1.0, lng=2.0), 'next0')
+            core._save_to_db('fast0', 'foo', '', self.db, self.gps_inf, self.gps_inf)
+            self.assertEqual(core.get_last_location('foo', self.db), (1.0, 2.0))
+            rows = self.db.execute("SELECT iface, lat FROM networks WHERE ssid='foo' ORDER BY iface;").fetchall()
+            self.assertEqual(rows, [('fast0', 1.0), ('next0', 1.0)])
+        finally:
+            core._network_in_range, core._activate, core.disable = saved
+
+    def test_connect_associated(self):
+        self._temp_writer()
+        associated = core._associated
+        core._associated = lambda iface, ssid, bssid=None: ssid in ('foo', 'bar')
+
+        try:
+            # associated, but not stored: no shortcut
+            with self.assertRaises(core.WifiException) as cm:
+                core.connect('fast0', 'bar', None, self.db)
+            self.assertEqual(cm.exception.code, 404)
+            with self.assertRaises(core.WifiException) as cm:
+                core.connect_any(['fast0', 'slow0'], 'bar', None, self.db)
+            self.assertEqual(cm.exception.code, 404)
+
+            core.WRITER.save(core.Scheme('fast0', 'foo', {'wireless-essid': 'foo'}))
+            self.assertIsNone(core.connect('fast0', 'foo', None, self.db))
+            self.assertEqual(core.connect_any(['fast0'], 'foo', None, self.db), 'fast0')
+        finally:
+            core._associated = associated
+
+    def test_ifstate(self):
+        fd, path = tempfile.mkstemp()
+        os.write(fd, 'fast0=fast0-foo\nlo=lo\n')
+        os.close(fd)
+        with open(path + '.fast1', 'w') as f:
+            f.write('fast1-bar\n')
+
+        sys_net = tempfile.mkdtemp()
+        for iface, operstate in (('fast0', 'up'), ('fast1', 'up'), ('down0', 'down'), ('stale0', 'up')):
+            os.mkdir(os.path.join(sys_net, iface))
+            with open(os.path.join(sys_net, iface, 'operstate'), 'w') as f:
+                f.write(operstate + '\n')
+
+        calls = []
+        saved = core.IFSTATE, core.SYS_NET, core._ifupdown
+        core.IFSTATE, core.SYS_NET = path, sys_net
+        core._ifupdown = lambda command, iface: calls.append((command, iface)) or (0, '')
+
+        try:
+            self.assertEqual(core._ifstate(), {'fast0': 'fast0-foo', 'lo': 'lo'})
+            self.assertTrue(core._configured('fast1'))
+            self.assertFalse(core._configured('down0'))
+
+            # nothing to do: the state of ifupdown and the link agree
+            self.assertEqual(core.enable('fast0'), 0)
+            self.assertEqual(core.enable('fast1'), 0)
+            self.assertEqual(core.disable('down0'), 0)
+            self.assertEqual(calls, [])
+            self.assertFalse(core._associated('fast0', 'foo'))
+            self.assertFalse(core._associated('fast0', 'foo', core.BSSID_BEST))
+
+            # stale state or unknown link: ifup and ifdown run
+            core.disable('stale0')
+            core.enable('down0')
+            core.enable('nolink0')
+            self.assertEqual(calls, [('ifdown', 'stale0'), ('ifup', 'down0'), ('ifup', 'nolink0')])
+
+            core.IFSTATE = path + '.missing'
+            self.assertIsNone(core._ifstate())
+            self.assertIsNone(core._configured('fast0'))
+        finally:
+            core.IFSTATE, core.SYS_NET, core._ifupdown = saved
+            os.unlink(path)
+            os.unlink(path + '.fast1')
+            shutil.rmtree(sys_net)
+
+    def test_store_db(self):
+        self._temp_writer()
+        store = core.STORE
+        core.STORE = core.STORE_DB
+
+        try:
+            core._save_to_db(self.iface, 'foo', '', self.db, self.gps_inf, self.gps_inf, {'wireless-essid': 'foo'})
+            self.assertEqual(core.render(self.db), 1)
+            self.assertEqual(core.render(self.db), 0)
+            self.assertEqual(core.scheme_all(self.db)[0]['name'], 'foo')
+            self.assertIsNotNone(core.WRITER.find(self.iface, 'foo'))
+
+            total, deleted = core.delete_all(self.db)
+            self.assertEqual((total, deleted), (1, 1))
+            self.assertEqual(core.WRITER.all(), [])
+        finally:
+            core.STORE = store
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,156 @@
+from context import core, core_async, migrations
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import trollius as asyncio
+import unittest
+
+_SCAN = """wlan0     Scan completed :
+          Cell 01 - Address: 00:00:00:00:01:01
+                    Channel:6
+                    Frequency:2.437 GHz (Channel 6)
+                    Quality=30/70  Signal level=-80 dBm
+                    Encryption key:off
+                    ESSID:"foo"
+          Cell 02 - Address: 00:00:00:00:01:02
+                    Channel:11
+                    Frequency:2.462 GHz (Channel 11)
+                    Quality=60/70  Signal level=-50 dBm
+                    Encryption key:off
+                    ESSID:"foo"
+"""
+
+
+class _RadioHelper(object):
+    """
+    stand-in for the privileged helper, answering like a radio in range of two access points of network foo
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def call(self, op, **params):
+        self.calls.append((op, threading.current_thread().name))
+
+        if op == 'scan':
+            return {"code": 0, "output": _SCAN}
+        if op == 'activate':
+            return {"code": 0, "output": 'bound to 10.0.0.2 -- renewal in 300 seconds.\n'}
+
+        return {"code": 0, "output": ''}
+
+
+class WifiCoreAsyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.iface = 'wlan0'
+
+        # the radio operations go through a stand-in helper
+        self.helper = _RadioHelper()
+        self.saved = core.HELPER, core.WRITER, core.STORE
+        core.HELPER = self.helper
+        core.STORE = core.STORE_FILE
+
+        self.path = tempfile.mkstemp()[1]
+        core.WRITER = core.InterfacesWriter(self.path, window=0)
+
+        dir_name = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.db_fd, self.db_name = tempfile.mkstemp()
+        self.db = sqlite3.connect(self.db_name)
+        with open(os.path.join(dir_name, 'wifi_manager/schema/schema.sql')) as f:
+            self.db.executescript(f.read())
+        migrations.migrate(self.db)
+
+    def tearDown(self):
+        self.loop.close()
+        core.HELPER, core.WRITER, core.STORE = self.saved
+        self.db.close()
+        os.close(self.db_fd)
+        os.unlink(self.db_name)
+        os.unlink(self.path)
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_run(self):
+        code, output = self.run_async(core_async._run('sh', '-c', 'echo foo >&2; exit 3'))
+        self.assertEqual(code, 3)
+        self.assertEqual(output, 'foo\n')
+
+    def test_run_concurrent(self):
+        start = time.time()
+        tasks = [core_async._run('sleep', '0.5') for i in range(4)]
+        results = self.run_async(asyncio.gather(*tasks))
+        self.assertEqual([r[0] for r in results], [0] * 4)
+        self.assertLess(time.time() - start, 1.5)
+
+    def test_enable(self):
+        code = self.run_async(core_async.enable(self.iface))
+        self.assertEqual(code, 0)
+        self.assertEqual(self.helper.calls[0][0], 'ifup')
+
+    def test_scan(self):
+        cells = self.run_async(core_async.cell_all(self.iface))
+        self.assertEqual([c["signal"] for c in cells], [-50, -80])
+        self.assertEqual(self.helper.calls[0][0], 'scan')
+
+    def test_status(self):
+        wireless = core.Wireless
+        core.Wireless = lambda iface: type('Wireless', (object,), {'getEssid': lambda self: 'foo'})()
+        try:
+            status = self.run_async(core_async.status(self.iface))
+        finally:
+            core.Wireless = wireless
+        self.assertEqual(status, 'foo')
+
+    def test_activate_retry(self):
+        runs = []
+
+        @asyncio.coroutine
+        def fake_run(*args):
+            runs.append(args[1] if args[0] == 'sudo' else args[0])
+            if len(runs) == 1:
+                raise asyncio.Return(1, 'ifdown: interface busy\n')
+            raise asyncio.Return(0, 'bound to 10.0.0.2 -- renewal in 300 seconds.\n')
+
+        scheme = core.Scheme(self.iface, 'foo', {'wireless-essid': 'foo'})
+        saved = core_async._run, core.RETRY_AFTER
+        core_async._run, core.RETRY_AFTER, core.HELPER = fake_run, 0, None
+        try:
+            # a failed ifdown is retried, like in core
+            res = self.run_async(core_async._activate(self.iface, 'foo', scheme))
+        finally:
+            core_async._run, core.RETRY_AFTER = saved
+        self.assertEqual(res, (True, 2, None))
+        self.assertEqual(runs, ['/sbin/ifdown', 'ifup', '/sbin/ifdown', '/sbin/ifup'])
+
+    def test_stderr(self):
+        self.helper.call = lambda op, **params: {"code": 1, "output": 'ifup: unknown interface\n'}
+
+        with self.assertRaises(core.WifiException) as cm:
+            self.run_async(core_async.enable(self.iface))
+        self.assertEqual(cm.exception.stderr, 'ifup: unknown interface\n')
+
+    def test_connect(self):
+        self.run_async(core_async.connect(self.iface, 'foo', None, self.db))
+
+        # the helper is called outside of the loop thread
+        self.assertEqual([op for op, thread in self.helper.calls], ['scan', 'activate'])
+        self.assertNotIn(threading.current_thread().name, [thread for op, thread in self.helper.calls])
+
+        self.assertIsNotNone(core.WRITER.find(self.iface, 'foo'))
+        core.STATS.flush(self.db)
+        signal = self.db.execute("SELECT signal FROM connections WHERE ssid='foo';").fetchone()[0]
+        self.assertEqual(signal, -50)
+
+        with self.assertRaises(core.WifiException) as cm:
+            self.run_async(core_async.connect(self.iface, 'bar', None, self.db))
+        self.assertEqual(cm.exception.code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
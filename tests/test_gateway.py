@@ -0,0 +1,184 @@
+from binascii import hexlify
+from flask import Flask, json, jsonify, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+from context import gateway, rest
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+
+class _KeepAliveHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+
+def _stand_in(api_key):
+    """
+    a local stand-in for a downstream instance, answering a few requests of the REST API
+
+    :param api_key: api key of the instance
+    :return: the Flask app
+    """
+
+    app = Flask(__name__)
+    app.imported = []
+
+    @app.before_request
+    def check_api_key():
+        if request.headers.get('X-Api-Key') != api_key:
+            return jsonify(message='unauthorized: wrong or missing api key', code=401)
+
+    @app.route('/networks')
+    def networks():
+        return jsonify(message={"port": request.environ['REMOTE_PORT'], "args": request.args.to_dict()}, code=200)
+
+    @app.route('/networks/import', methods=['POST'])
+    def network_import():
+        app.imported.append(request.get_data())
+        return jsonify(message={"applied": len(request.get_data().splitlines())}, code=200)
+
+    @app.route('/pause')
+    def pause():
+        time.sleep(0.3)
+        return jsonify(message='done', code=200)
+
+    @app.route('/slow')
+    def slow():
+        time.sleep(1)
+        return jsonify(message='late', code=200)
+
+    return app
+
+
+class WifiGatewayTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = []
+        self.devices = []
+        self.stand_ins = []
+
+        for i in range(2):
+            api_key = hexlify(os.urandom(8)).decode()
+            app = _stand_in(api_key)
+            server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=_KeepAliveHandler)
+            threading.Thread(target=server.serve_forever).start()
+
+            self.servers.append(server)
+            self.stand_ins.append(app)
+            self.devices.append({"name": "dev{}".format(i), "url": "http://127.0.0.1:{}".format(server.server_port),
+                                 "api_key": api_key})
+
+        # a port nobody listens on
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        self.dead = {"name": "dead", "url": "http://127.0.0.1:{}".format(s.getsockname()[1]), "api_key": "x"}
+        s.close()
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+        rest.app.config.pop('GATEWAY', None)
+
+    def test_keep_alive(self):
+        client = gateway.DeviceClient(self.devices[0]["url"], self.devices[0]["api_key"])
+
+        status, content_type, data = client.request('GET', '/networks')
+        self.assertEqual(status, 200)
+        port = json.loads(data)['message']['port']
+
+        status, content_type, data = client.request('GET', '/networks')
+        self.assertEqual(json.loads(data)['message']['port'], port)
+
+        client.close()
+
+    def test_fanout(self):
+        gw = gateway.Gateway(timeout=0.5)
+
+        res = gw.fanout(self.devices + [self.dead], 'GET', '/networks?gps=1')
+        self.assertEqual(res['succeeded'], 2)
+        self.assertEqual(res['failed'], 1)
+        self.assertEqual(res['results']['dev0']['code'], 200)
+        self.assertEqual(res['results']['dev1']['message']['args'], {"gps": "1"})
+        self.assertEqual(res['results']['dead']['code'], 502)
+
+        # the slow device doesn't hold back the aggregated response
+        start = time.time()
+        res = gw.fanout(self.devices, 'GET', '/slow')
+        self.assertLess(time.time() - start, 0.9)
+        self.assertEqual(res['results']['dev0']['code'], 504)
+        self.assertEqual(res['failed'], 2)
+
+        # wrong api key: reported with HTTP status 200 and code 401 in the body
+        res = gw.fanout([dict(self.devices[0], api_key='wrong')], 'GET', '/networks')
+        self.assertEqual(res['results']['dev0']['message'], 'unauthorized: wrong or missing api key')
+        self.assertEqual(res['results']['dev0']['code'], 401)
+        self.assertEqual(res['failed'], 1)
+        self.assertEqual(res['succeeded'], 0)
+
+    def test_fanout_queued(self):
+        # one worker: the second device waits for the first, its timeout starts with its own request
+        gw = gateway.Gateway(timeout=0.5, workers=1)
+
+        res = gw.fanout(self.devices, 'GET', '/pause')
+        self.assertEqual(res['succeeded'], 2)
+        self.assertEqual([r['message'] for r in res['results'].values()], ['done', 'done'])
+
+    def test_rest(self):
+        dir_name = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        rest.app.config['DB_PATH'] = os.path.join(dir_name, 'wifi_manager/schema')
+        rest.app.config['DB_SOURCE'] = os.path.join(rest.app.config['DB_PATH'], 'schema.sql')
+        db_fd, rest.app.config['DB_INSTANCE'] = tempfile.mkstemp()
+        rest.app.testing = True
+        rest.app.API_KEY = hexlify(os.urandom(20)).decode()
+        headers = {'X-Api-Key': rest.app.API_KEY}
+        app = rest.app.test_client()
+
+        try:
+            rest.init_db()
+            resp = json.loads(app.get('/gateway/devices', headers=headers).get_data())
+            self.assertEqual(resp['code'], 404)
+
+            rest.app.config['GATEWAY'] = True
+            rest.init_db()
+
+            for d in self.devices:
+                resp = app.post('/gateway/devices/{}'.format(d['name']), headers=headers,
+                                data=json.dumps({"url": d['url'], "api_key": d['api_key']}))
+                self.assertEqual(resp.status_code, 201)
+                self.assertEqual(json.loads(resp.get_data())['code'], 201)
+
+            resp = app.post('/gateway/devices/bad', headers=headers, data=json.dumps({"url": "ftp://x"}))
+            self.assertEqual(json.loads(resp.get_data())['code'], 400)
+
+            resp = json.loads(app.get('/gateway/devices', headers=headers).get_data())
+            self.assertEqual(resp['message'], [{"name": d['name'], "url": d['url']} for d in self.devices])
+
+            resp = json.loads(app.get('/gateway/fanout/networks?devices=dev1&gps=1', headers=headers).get_data())
+            self.assertEqual(resp['message']['results'].keys(), ['dev1'])
+            self.assertEqual(resp['message']['results']['dev1']['message']['args'], {"gps": "1"})
+
+            changes = '{"op": "save"}\n{"op": "delete"}\n'
+            resp = json.loads(app.post('/gateway/fanout/networks/import', headers=headers, data=changes,
+                                       content_type='application/x-ndjson').get_data())
+            self.assertEqual(resp['message']['succeeded'], 2)
+            self.assertEqual(resp['message']['results']['dev0']['message'], {"applied": 2})
+            self.assertEqual(self.stand_ins[1].imported, [changes])
+
+            resp = json.loads(app.get('/gateway/fanout/networks?devices=nope', headers=headers).get_data())
+            self.assertEqual(resp['code'], 404)
+
+            resp = json.loads(app.delete('/gateway/devices/dev0', headers=headers).get_data())
+            self.assertEqual(resp['code'], 200)
+            resp = json.loads(app.delete('/gateway/devices/dev0', headers=headers).get_data())
+            self.assertEqual(resp['code'], 404)
+        finally:
+            os.close(db_fd)
+            os.unlink(rest.app.config['DB_INSTANCE'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+from context import generations
+import unittest
+
+
+def cell(address, signal, ssid='foo', channel=1):
+    return {"address": address, "signal": signal, "ssid": ssid, "channel": channel, "frequency": '2.412 GHz',
+            "encrypted": False, "mode": 'Master', "bitrates": []}
+
+
+class WifiGenerationsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.history = generations.ScanHistory(size=3, threshold=5)
+
+    def test_delta(self):
+        g1 = self.history.add('wlan0', [cell('a', -50), cell('b', -60), cell('c', -70)])
+        g2 = self.history.add('wlan0', [cell('a', -52), cell('b', -70), cell('d', -40), cell('c', -70, channel=6)])
+        self.assertGreater(g2, g1)
+
+        res = self.history.delta('wlan0', g1)
+        self.assertEqual(res['generation'], g2)
+        self.assertFalse(res['full'])
+        self.assertEqual([c['address'] for c in res['added']], ['d'])
+        self.assertEqual([c['address'] for c in res['changed']], ['c', 'b'])
+        self.assertEqual(res['removed'], [])
+
+        res = self.history.delta('wlan0', g1, threshold=1)
+        self.assertEqual([c['address'] for c in res['changed']], ['a', 'c', 'b'])
+
+        res = self.history.delta('wlan0', g2)
+        self.assertEqual((res['added'], res['changed'], res['removed']), ([], [], []))
+
+    def test_removed(self):
+        g1 = self.history.add('wlan0', [cell('a', -50), cell('b', -60)])
+        self.history.add('wlan0', [cell('b', -60)])
+
+        res = self.history.delta('wlan0', g1)
+        self.assertEqual(res['removed'], ['a'])
+
+    def test_full(self):
+        g1 = self.history.add('wlan0', [cell('a', -50)])
+        for i in range(3):
+            self.history.add('wlan0', [cell('a', -50), cell('b', -60)])
+
+        # evicted from the history
+        res = self.history.delta('wlan0', g1)
+        self.assertTrue(res['full'])
+        self.assertEqual([c['address'] for c in res['added']], ['a', 'b'])
+
+        res = self.history.delta('wlan0', 0)
+        self.assertTrue(res['full'])
+
+        res = self.history.delta('wlan1', 0)
+        self.assertEqual(res['generation'], 0)
+        self.assertEqual(res['added'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
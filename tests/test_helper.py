@@ -0,0 +1,86 @@
+from context import os, helper, writer
+import shutil
+import tempfile
+import threading
+import unittest
+
+
+class WifiHelperTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        self.socket = os.path.join(self.dir_name, 'helper.sock')
+        self.interfaces = os.path.join(self.dir_name, 'interfaces')
+        self.start_server()
+        self.client = helper.HelperClient(self.socket, timeout=5)
+
+    def tearDown(self):
+        self.client.close()
+        self.stop_server()
+        shutil.rmtree(self.dir_name)
+
+    def start_server(self):
+        self.server = helper.HelperServer(self.socket, self.interfaces)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop_server(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_ping(self):
+        for i in range(3):
+            self.assertEqual(self.client.call('ping')['code'], 0)
+
+    def test_errors(self):
+        self.assertRaises(helper.HelperError, self.client.call, 'foo')
+        self.assertRaises(helper.HelperError, self.client.call, 'ifup', iface='wlan0; reboot')
+        self.assertRaises(helper.HelperError, self.client.call, 'activate', iface='wlan0', args=['--force'])
+        self.assertEqual(self.client.call('ping')['code'], 0)
+
+    def test_activate_args(self):
+        for name, args in (('foo', ['wlan0=wlan0-foo', '-o', 'up=touch /tmp/pwned']),
+                           ('foo', ['wlan0=wlan0-foo', '-o', 'pre-up=reboot']),
+                           ('foo', ['wlan0=wlan0-foo', '--force', 'wireless-essid=foo']),
+                           ('foo', ['wlan1=wlan1-foo', '-o', 'wireless-essid=foo']),
+                           ('foo', ['wlan0=wlan0-bar', '-o', 'wireless-essid=foo']),
+                           ('foo bar', ['wlan0=wlan0-foo bar', '-o', 'wireless-essid=foo']),
+                           (None, ['wlan0=wlan0-None'])):
+            self.assertRaises(helper.HelperError, self.client.call, 'activate', iface='wlan0', name=name, args=args)
+
+    def test_apply(self):
+        with open(self.interfaces, 'w') as f:
+            f.write('auto lo\niface lo inet loopback\n')
+
+        self.client.apply([('save', writer.Stanza('wlan0', 'foo', {'wireless-essid': 'foo'}))])
+        with open(self.interfaces) as f:
+            self.assertEqual(f.read(), 'auto lo\niface lo inet loopback\n\niface wlan0-foo inet dhcp\n'
+                                       '    wireless-essid foo\n')
+
+        self.client.apply([('delete', ('wlan0', 'foo'))])
+        with open(self.interfaces) as f:
+            content = f.read()
+        self.assertNotIn('wlan0-foo', content)
+
+        # neither raw content nor hooks or extra stanzas reach the file
+        self.assertRaises(helper.HelperError, self.client.call, 'write', content='iface eth9 inet static\n')
+        for edits in ([{"op": "save", "iface": "wlan0", "ssid": "foo", "options": {"up": "touch /tmp/pwned"}}],
+                      [{"op": "save", "iface": "wlan0", "ssid": "foo",
+                        "options": {"wireless-essid": "foo\nauto eth9\niface eth9 inet static"}}],
+                      [{"op": "save", "iface": "wlan0", "ssid": "foo\n    pre-up reboot", "options": {}}],
+                      [{"op": "delete", "iface": "wlan0 inet", "ssid": "foo"}]):
+            self.assertRaises(helper.HelperError, self.client.call, 'apply', edits=edits)
+
+        with open(self.interfaces) as f:
+            self.assertEqual(f.read(), content)
+
+    def test_reconnect(self):
+        self.assertEqual(self.client.call('ping')['code'], 0)
+        self.stop_server()
+        self.start_server()
+        self.assertEqual(self.client.call('ping')['code'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+from context import limits
+import threading
+import time
+import unittest
+
+
+class WifiLimitsTestCase(unittest.TestCase):
+
+    def test_token_bucket(self):
+        bucket = limits.TokenBucket(rate=10, burst=2)
+        self.assertEqual(bucket.take(), 0)
+        self.assertEqual(bucket.take(), 0)
+        self.assertGreater(bucket.take(), 0)
+        time.sleep(0.15)
+        self.assertEqual(bucket.take(), 0)
+
+    def test_rate_per_key(self):
+        pool = limits.Pool('test', concurrency=10, queue_timeout=0, rate=0.01, burst=1)
+        pool.acquire('a')
+        pool.acquire('b')
+        self.assertRaises(limits.Rejected, pool.acquire, 'a')
+
+    def test_concurrency(self):
+        pool = limits.Pool('test', concurrency=1, queue_timeout=0.1, rate=100, burst=100)
+        pool.acquire('a')
+        self.assertRaises(limits.Rejected, pool.acquire, 'a')
+
+        threading.Timer(0.05, pool.release).start()
+        pool.acquire('a')
+        pool.release()
+
+    def test_retry_after(self):
+        self.assertEqual(limits.retry_after(0.2), '1')
+        self.assertEqual(limits.retry_after(2.5), '3')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+from context import loadtest
+from wifi.scan import Cell, cells_re
+import unittest
+
+
+class WifiLoadtestTestCase(unittest.TestCase):
+
+    def test_parse_mix(self):
+        self.assertEqual(loadtest.parse_mix('status=4,scan'), [('status', 4), ('scan', 1)])
+        self.assertRaises(ValueError, loadtest.parse_mix, 'foo=1')
+
+    def test_summarize(self):
+        self.assertEqual(loadtest.percentile(range(1, 101), 50), 50)
+        self.assertEqual(loadtest.percentile(range(1, 101), 99), 99)
+        self.assertIsNone(loadtest.percentile([], 50))
+
+        results = [[('status', 200, 0.001), ('scan', 429, 0.002)], [('status', None, 0.003)]]
+        summary = loadtest.summarize(results, 2.0)
+        self.assertEqual(summary['all']['requests'], 3)
+        self.assertEqual(summary['all']['rps'], 1.5)
+        self.assertEqual(summary['status']['codes'], {'200': 1, 'None': 1})
+        self.assertEqual(summary['status']['p99'], 3.0)
+        self.assertIn('status', loadtest.report(summary))
+
+    def test_simulated_radio(self):
+        radio = loadtest.SimulatedRadio(['sim0'], cells=4, scan_latency=0, connect_latency=0)
+
+        code, output, stderr = radio.run(['/sbin/iwlist', 'sim0', 'scan'])
+        cells = [Cell.from_string(c) for c in cells_re.split(output)[1:]]
+        self.assertEqual([c.ssid for c in cells], ['sim-0', 'sim-1', 'sim-2', 'sim-3'])
+        self.assertEqual(cells[1].frequency, '5.18 GHz')
+
+        self.assertEqual(radio.run(['/sbin/iwlist', 'wlan9', 'scan'])[0], 1)
+
+        code, output, stderr = radio.run(['/sbin/ifup', 'sim0=sim0-sim-2', '-o', 'wireless-essid=sim-2'])
+        self.assertEqual(code, 0)
+        self.assertIn('bound to', output)
+        self.assertEqual(radio.wireless('sim0').getEssid(), 'sim-2')
+        self.assertEqual(radio.wireless('sim0').getAPaddr(), cells[2].address)
+
+        radio.run(['sudo', 'ifdown', 'sim0'])
+        self.assertEqual(radio.wireless('sim0').getEssid(), '')
+        self.assertRaises(IOError, radio.wireless, 'wlan9')
+
+
+if __name__ == '__main__':
+    unittest.main()
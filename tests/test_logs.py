@@ -0,0 +1,117 @@
+from context import logs
+from Queue import Queue
+from StringIO import StringIO
+import json
+import logging
+import threading
+import time
+import unittest
+
+
+class _SlowStream(StringIO):
+    """
+    a stream as slow as a serial console
+    """
+
+    def write(self, s):
+        time.sleep(0.05)
+        StringIO.write(self, s)
+
+
+class WifiLogsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('test_logs')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        for h in list(self.logger.handlers):
+            self.logger.removeHandler(h)
+        logs.set_request_id(None)
+
+    def _listen(self, stream, queue_size):
+        queue = Queue(queue_size)
+        target = logging.StreamHandler(stream)
+        target.setFormatter(logs.JsonFormatter())
+
+        handler = logs.QueueHandler(queue)
+        handler.addFilter(logs.ContextFilter())
+        self.logger.addHandler(handler)
+
+        listener = logs.QueueListener(queue, target)
+        listener.start()
+
+        return handler, listener
+
+    def test_json(self):
+        stream = StringIO()
+        handler, listener = self._listen(stream, 10)
+
+        logs.set_request_id('abc')
+        self.logger.info("connected to %s", "foo", extra={"iface": "wlan0", "elapsed": 1.5})
+        logs.set_request_id(None)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            self.logger.exception("failed")
+        listener.stop()
+
+        first, second = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(first["message"], "connected to foo")
+        self.assertEqual(first["level"], "INFO")
+        self.assertEqual(first["request_id"], "abc")
+        self.assertEqual(first["iface"], "wlan0")
+        self.assertEqual(first["elapsed"], 1.5)
+        self.assertNotIn("request_id", second)
+        self.assertIn("ValueError: boom", second["exception"])
+
+    def test_request_id_per_thread(self):
+        logs.set_request_id('main')
+        seen = []
+        t = threading.Thread(target=lambda: seen.append(logs.request_id()))
+        t.start()
+        t.join()
+
+        self.assertEqual(seen, [None])
+        self.assertEqual(logs.request_id(), 'main')
+
+    def test_slow_stream(self):
+        stream = _SlowStream()
+        handler, listener = self._listen(stream, 5)
+
+        start = time.time()
+        for i in range(50):
+            self.logger.info("retrying %d", i)
+        self.assertLess(time.time() - start, 0.05)
+        self.assertGreater(handler.dropped, 0)
+
+        # the handler reports the dropped records when it closes
+        dropped = handler.dropped
+        handler.close()
+        listener.stop(timeout=5)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines) - 1 + dropped, 50)
+        self.assertEqual(json.loads(lines[0])["message"], "retrying 0")
+        self.assertEqual(json.loads(lines[-1])["dropped"], dropped)
+        self.assertEqual(json.loads(lines[-1])["level"], "WARNING")
+
+    def test_setup(self):
+        stream = StringIO()
+        root = logging.getLogger()
+        handlers, level = list(root.handlers), root.level
+
+        try:
+            listener = logs.setup(logging.INFO, stream, queue_size=1)
+            handler = [h for h in root.handlers if isinstance(h, logs.QueueHandler)][0]
+            handler.dropped = 3
+            listener.stop()
+            self.assertNotIn(handler, root.handlers)
+        finally:
+            root.handlers, root.level = handlers, level
+
+        self.assertEqual(json.loads(stream.getvalue().splitlines()[-1])["dropped"], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
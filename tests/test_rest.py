@@ -2,6 +2,8 @@ from binascii import hexlify
 from flask import json
 from context import rest
 import os
+import shutil
+import sqlite3
 import unittest
 import tempfile
 
@@ -38,6 +40,29 @@ class WifiRestTestCase(unittest.TestCase):
     def tearDown(self):
         os.close(self.db_fd)
         os.unlink(rest.app.config['DB_INSTANCE'])
+        rest.app.config.pop('LIMITS', None)
+
+        if rest.app.config.pop('PROFILE_DIR', None):
+            shutil.rmtree(self.profile_dir)
+
+    def _temp_writer(self):
+        """
+        write the schemes to a temporary file instead of /etc/network/interfaces until the end of the test, with
+        self.iface as the only existing interface
+
+        :return: path of the file
+        """
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+
+        self.addCleanup(setattr, rest.core, 'WRITER', rest.core.WRITER)
+        self.addCleanup(setattr, rest.core, '_iface_exists', rest.core._iface_exists)
+        rest.core.WRITER = rest.core.InterfacesWriter(path, window=0)
+        rest.core._iface_exists = lambda iface: iface == self.iface
+
+        return path
 
     def test_0a_disable(self):
         resp = self.app.post('/disable/{}'.format(self.iface), headers={'X-Api-Key': rest.app.API_KEY})
@@ -185,16 +210,27 @@ class WifiRestTestCase(unittest.TestCase):
     def test_all_api_key(self):
         self.single_test_api_key('/networks', 'GET')
         self.single_test_api_key('/ifaces', 'GET')
+        self.single_test_api_key('/scan', 'GET')
         self.single_test_api_key('/scan/{}'.format(self.iface), 'GET')
+        self.single_test_api_key('/scan/{}/delta'.format(self.iface), 'GET')
         self.single_test_api_key('/status/{}'.format(self.iface), 'GET')
         self.single_test_api_key('/available/{}'.format(self.iface), 'GET')
         self.single_test_api_key('/location/ssid', 'GET')
+        self.single_test_api_key('/stats', 'GET')
+        self.single_test_api_key('/signal/{}/00:00:00:00:00:01'.format(self.iface), 'GET')
+        self.single_test_api_key('/commands', 'GET')
+        self.single_test_api_key('/profiles', 'GET')
         self.single_test_api_key('/enable/{}'.format(self.iface), 'POST')
         self.single_test_api_key('/disable/{}'.format(self.iface), 'POST')
         self.single_test_api_key('/networks/iface:ssid:{}:{}'.format(self.gps_inf, self.gps_inf), 'POST')
         self.single_test_api_key('/connect/iface:ssid:{}:{}'.format(self.gps_inf, self.gps_inf), 'POST')
         self.single_test_api_key('/networks/iface:ssid', 'DELETE')
         self.single_test_api_key('/networks', 'DELETE')
+        self.single_test_api_key('/networks/changes', 'GET')
+        self.single_test_api_key('/networks/import', 'POST')
+        self.single_test_api_key('/supervisor', 'GET')
+        self.single_test_api_key('/supervisor/{}'.format(self.iface), 'POST')
+        self.single_test_api_key('/batch', 'POST')
 
     def test_networks(self):
         resp = self.app.get('/networks', headers={'X-Api-Key': rest.app.API_KEY})
@@ -213,6 +249,200 @@ class WifiRestTestCase(unittest.TestCase):
         self.assertEquals(resp2_dict['code'], 200)
         self.assertIsInstance(resp2_dict['message'], list)
 
+    def test_scan_all(self):
+        resp = self.app.get('/scan', headers={'X-Api-Key': rest.app.API_KEY})
+        resp_dict = json.loads(resp.get_data())
+        self.assertEquals(resp_dict['code'], 200)
+        self.assertIsInstance(resp_dict['message']['cells'], list)
+        self.assertIsInstance(resp_dict['message']['errors'], dict)
+
+        for c in resp_dict['message']['cells']:
+            self.assertIsInstance(c['iface'], unicode)
+
+    def test_batch(self):
+        operations = [{"op": "networks"}, {"op": "ifaces"}, {"op": "location", "ssid": self.cell},
+                      {"op": "delete", "iface": self.iface, "ssid": self.cell, "test": 1},
+                      {"op": "location"}, {"op": "foo"}, {"op": "commands"}]
+        resp = self.app.post('/batch', data=json.dumps(operations), content_type='application/json',
+                             headers={'X-Api-Key': rest.app.API_KEY})
+        resp_dict = json.loads(resp.get_data())
+        self.assertEquals(resp_dict['code'], 200)
+
+        results = resp_dict['message']
+        self.assertEquals(len(results), len(operations))
+        self.assertEquals(results[0]['code'], 200)
+        self.assertIsInstance(results[0]['message'], list)
+        self.assertIsInstance(results[1]['message'], list)
+        self.assertEquals(results[2]['message'], '{},{}'.format(self.gps_inf, self.gps_inf))
+        self.assertEquals(results[3]['code'], 404)
+        self.assertEquals(results[3]['message'], self.netnotfound.format(self.cell))
+        self.assertEquals(results[4]['code'], 400)
+        self.assertEquals(results[5]['code'], 400)
+        self.assertIsInstance(results[6]['message'], dict)
+
+        resp = self.app.post('/batch', data='{}', headers={'X-Api-Key': rest.app.API_KEY})
+        self.assertEquals(resp.status_code, 400)
+
+    def test_batch_errors(self):
+        operations = [{"op": "location", "ssid": self.cell}, {"op": "status", "iface": "lo"},
+                      {"op": "save", "iface": self.iface, "ssid": self.cell, "lat": "abc"},
+                      {"op": "status", "iface": 5}, {"op": "location", "ssid": ["x"]}, {"op": "commands"}]
+        resp = self.app.post('/batch', data=json.dumps(operations), content_type='application/json',
+                             headers={'X-Api-Key': rest.app.API_KEY})
+        self.assertEquals(resp.status_code, 200)
+
+        results = json.loads(resp.get_data())['message']
+        self.assertEquals([r['code'] for r in results], [200, 500, 400, 400, 400, 200])
+        self.assertIn('lat', results[2]['message'])
+
+    def test_batch_unexpected(self):
+        def fail(ssid, db):
+            raise AssertionError("boom")
+
+        get_last_location, rest.core.get_last_location = rest.core.get_last_location, fail
+        operations = [{"op": "commands"}, {"op": "location", "ssid": self.cell}, {"op": "delete", "iface": self.iface,
+                                                                                 "ssid": self.cell, "test": 1}]
+        try:
+            resp = self.app.post('/batch', data=json.dumps(operations), content_type='application/json',
+                                 headers={'X-Api-Key': rest.app.API_KEY})
+        finally:
+            rest.core.get_last_location = get_last_location
+        self.assertEquals(resp.status_code, 200)
+
+        results = json.loads(resp.get_data())['message']
+        self.assertEquals(len(results), 3)
+        self.assertEquals(results[0]['code'], 200)
+        self.assertEquals(results[1], {"message": "location: boom", "code": 500})
+        self.assertEquals(results[2]['code'], 404)
+
+    def test_encoding(self):
+        db = sqlite3.connect(rest.app.config['DB_INSTANCE'])
+        db.execute("INSERT INTO networks (iface, ssid, lat, lng) VALUES (?, ?, ?, ?);",
+                   (self.iface, self.cell, self.gps_inf, self.gps_inf))
+        db.commit()
+        db.close()
+
+        resp = self.app.get('/networks/gps?layout=columns', headers={'X-Api-Key': rest.app.API_KEY})
+        self.assertEquals(resp.mimetype, 'application/json')
+        resp_dict = json.loads(resp.get_data())
+        self.assertEquals(resp_dict['code'], 200)
+        self.assertEquals(resp_dict['message']['columns'], ['iface', 'lat', 'lng', 'passkey', 'ssid'])
+        self.assertEquals(resp_dict['message']['rows'], [[self.iface, self.gps_inf, self.gps_inf, None, self.cell]])
+
+        if rest.encoding.msgpack is None:
+            return
+
+        resp = self.app.get('/networks/gps', headers={'X-Api-Key': rest.app.API_KEY, 'Accept': 'application/msgpack'})
+        self.assertEquals(resp.mimetype, 'application/msgpack')
+        resp_dict = rest.encoding.msgpack.unpackb(resp.get_data(), raw=False)
+        self.assertEquals(resp_dict['code'], 200)
+        self.assertEquals(resp_dict['message'][0]['ssid'], self.cell)
+
+    def test_signal(self):
+        resp = self.app.get('/signal/{}/00:00:00:00:00:01'.format(self.iface), headers={'X-Api-Key': rest.app.API_KEY})
+        resp_dict = json.loads(resp.get_data())
+        self.assertEquals(resp_dict['code'], 404)
+
+    def test_request_id(self):
+        resp = self.app.get('/networks', headers={'X-Api-Key': rest.app.API_KEY, 'X-Request-Id': 'abc-1'})
+        self.assertEquals(resp.headers['X-Request-Id'], 'abc-1')
+
+        resp = self.app.get('/networks', headers={'X-Api-Key': rest.app.API_KEY, 'X-Request-Id': 'a b c'})
+        self.assertNotEquals(resp.headers['X-Request-Id'], 'a b c')
+        self.assertEquals(len(resp.headers['X-Request-Id']), 16)
+
+    def test_profile(self):
+        resp = self.app.get('/profiles', headers={'X-Api-Key': rest.app.API_KEY})
+        self.assertEquals(resp.status_code, 404)
+
+        self.profile_dir = tempfile.mkdtemp()
+        rest.app.config['PROFILE_DIR'] = self.profile_dir
+        rest.app.config['PROFILE_MAX'] = 2
+        rest.init_db()
+
+        resp = self.app.get('/networks', headers={'X-Profile': '1'})
+        self.assertNotIn('X-Profile-Id', resp.headers)
+
+        for i in range(3):
+            resp = self.app.get('/networks', headers={'X-Api-Key': rest.app.API_KEY, 'X-Profile': '1'})
+            self.assertEquals(resp.status_code, 200)
+        name = resp.headers['X-Profile-Id']
+
+        resp = self.app.get('/profiles', headers={'X-Api-Key': rest.app.API_KEY})
+        resp_dict = json.loads(resp.get_data())
+        self.assertEquals(len(resp_dict['message']), 2)
+        self.assertEquals(resp_dict['message'][0]['name'], name)
+
+        resp = self.app.get('/profiles/{}?format=text'.format(name), headers={'X-Api-Key': rest.app.API_KEY})
+        self.assertEquals(resp.status_code, 200)
+        self.assertIn('function calls', resp.get_data())
+
+        resp = self.app.get('/profiles/{}'.format(name), headers={'X-Api-Key': rest.app.API_KEY})
+        self.assertEquals(resp.status_code, 200)
+        resp.close()
+
+        resp = self.app.get('/profiles/..%2Fschema.prof', headers={'X-Api-Key': rest.app.API_KEY})
+        self.assertEquals(resp.status_code, 404)
+
+    def test_changes(self):
+        self._temp_writer()
+
+        changes = [{"op": "save", "iface": self.iface, "ssid": self.cell, "options": {"wireless-essid": self.cell}},
+                   {"op": "save", "iface": self.iface, "ssid": "bar", "options": {"wireless-essid": "bar"}}]
+        resp = self.app.post('/networks/import', data='\n'.join(json.dumps(c) for c in changes),
+                             headers={'X-Api-Key': rest.app.API_KEY})
+        resp_dict = json.loads(resp.get_data())
+        self.assertEquals(resp_dict['code'], 200)
+        self.assertEquals(resp_dict['message']['saved'], 2)
+        version = resp_dict['message']['version']
+
+        resp = self.app.get('/networks/changes?since={}'.format(version - 1),
+                            headers={'X-Api-Key': rest.app.API_KEY})
+        self.assertEquals(resp.mimetype, 'application/x-ndjson')
+        self.assertEquals(resp.headers['X-Changes-Version'], str(version))
+        lines = [json.loads(line) for line in resp.get_data().splitlines()]
+        self.assertEquals([(c['op'], c['ssid'], c['version']) for c in lines], [('save', 'bar', version)])
+
+        resp = self.app.post('/networks/import', data='foo', headers={'X-Api-Key': rest.app.API_KEY})
+        self.assertEquals(resp.status_code, 400)
+
+    def test_import_hostile(self):
+        path = self._temp_writer()
+
+        changes = [{"op": "save", "iface": self.iface, "ssid": "bar", "options": {"wireless-essid": "bar"}}]
+        self.app.post('/networks/import', data=json.dumps(changes), headers={'X-Api-Key': rest.app.API_KEY})
+        with open(path) as f:
+            content = f.read()
+
+        hostile = [
+            {"op": "save", "iface": self.iface, "ssid": "foo", "options": {"up": "touch /tmp/pwned"}},
+            {"op": "save", "iface": self.iface, "ssid": "foo",
+             "options": {"wireless-essid": "foo\n\nauto eth9\niface eth9 inet static\n    pre-up reboot"}},
+            {"op": "save", "iface": self.iface, "ssid": "foo inet static\n    pre-up reboot",
+             "options": {"wireless-essid": "foo"}},
+        ]
+        for entry in hostile:
+            resp = self.app.post('/networks/import', data=json.dumps([changes[0], entry]),
+                                 headers={'X-Api-Key': rest.app.API_KEY})
+            self.assertEquals(resp.status_code, 400)
+            self.assertEquals(json.loads(resp.get_data())['code'], 400)
+
+        with open(path) as f:
+            self.assertEquals(f.read(), content)
+
+    def test_rate_limit(self):
+        rest.app.config['LIMITS'] = {'scan': {'rate': 0.01, 'burst': 1}}
+        rest.init_db()
+
+        resp = self.app.get('/scan', headers={'X-Api-Key': rest.app.API_KEY})
+        self.assertEquals(resp.status_code, 200)
+
+        resp = self.app.get('/scan', headers={'X-Api-Key': rest.app.API_KEY})
+        resp_dict = json.loads(resp.get_data())
+        self.assertEquals(resp.status_code, 429)
+        self.assertEquals(resp_dict['code'], 429)
+        self.assertTrue(int(resp.headers['Retry-After']) > 0)
+
     def test_status(self):
         resp = self.app.get('/status/{}'.format(self.iface), headers={'X-Api-Key': rest.app.API_KEY})
         resp_dict = json.loads(resp.get_data())
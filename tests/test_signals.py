@@ -0,0 +1,43 @@
+from context import signals
+import unittest
+
+
+def cell(address, signal, quality='50/70'):
+    return {"address": address, "signal": signal, "quality": quality}
+
+
+class WifiSignalsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.history = signals.SignalHistory(size=4, max_bssids=2, alpha=0.5)
+
+    def test_smoothed(self):
+        self.assertIsNone(self.history.smoothed('wlan0', 'A'))
+
+        self.history.add('wlan0', [cell('A', -60)])
+        self.history.add('wlan0', [cell('a', -40)])
+        self.history.add('wlan0', [cell('A', -80)])
+        self.assertEqual(self.history.smoothed('wlan0', 'a'), -65.0)
+        self.assertIsNone(self.history.smoothed('wlan1', 'a'))
+
+    def test_ring(self):
+        for i in range(6):
+            self.history.add('wlan0', [cell('a', -50 - i, '{}/70'.format(i))], t=i)
+
+        res = self.history.get('wlan0', 'a')
+        self.assertEqual([s['time'] for s in res['samples']], [2, 3, 4, 5])
+        self.assertEqual([s['signal'] for s in res['samples']], [-52, -53, -54, -55])
+        self.assertEqual([s['quality'] for s in res['samples']], [2, 3, 4, 5])
+
+    def test_eviction(self):
+        self.history.add('wlan0', [cell('a', -50), cell('b', -60)])
+        self.history.add('wlan0', [cell('a', -50)])
+        self.history.add('wlan0', [cell('c', -70)])
+
+        self.assertIsNotNone(self.history.get('wlan0', 'a'))
+        self.assertIsNone(self.history.get('wlan0', 'b'))
+        self.assertIsNotNone(self.history.get('wlan0', 'c'))
+
+
+if __name__ == '__main__':
+    unittest.main()
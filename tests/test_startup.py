@@ -0,0 +1,50 @@
+from context import startup
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+
+class WifiStartupTestCase(unittest.TestCase):
+
+    def test_lazy_module(self):
+        sys.modules.pop('colorsys', None)
+        startup.TIMINGS["imports"].pop('colorsys', None)
+
+        colorsys = startup.LazyModule('colorsys')
+        self.assertNotIn('colorsys', sys.modules)
+        self.assertNotIn('colorsys', startup.timings()["imports"])
+
+        rgb_to_hsv = startup.LazyAttribute(colorsys, 'rgb_to_hsv')
+        self.assertEqual(rgb_to_hsv(1.0, 0.0, 0.0), (0.0, 1.0, 1.0))
+        self.assertIn('colorsys', sys.modules)
+        self.assertIn('colorsys', startup.timings()["imports"])
+        self.assertEqual(colorsys.ONE_THIRD, 1.0 / 3.0)
+
+    def test_core_imports_no_radio_library(self):
+        # in a new interpreter, the modules imported by the tests are not loaded yet
+        package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        code = ("import sys; import wifi_manager.rest; "
+                "print(sorted(m for m in sys.modules if m.split('.')[0] in ('wifi', 'pythonwifi') and sys.modules[m]))")
+        out = subprocess.check_output([sys.executable, '-c', code], cwd=package)
+        self.assertEqual(out.strip(), '[]')
+
+    def test_warm_up(self):
+        done = []
+
+        def fail():
+            raise IOError("no such device")
+
+        t = startup.warm_up([('test_fail', fail), ('test_step', lambda: done.append(time.time()))])
+        t.join(5)
+
+        self.assertEqual(len(done), 1)
+        phases = startup.timings()["phases"]
+        self.assertIn('test_fail', phases)
+        self.assertIn('test_step', phases)
+        self.assertIn('warm_up', phases)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+from context import core, limits, loadtest, migrations, supervisor
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+
+class WifiSupervisorTestCase(unittest.TestCase):
+    """
+        Radio operations are replaced so that roaming decisions can be checked without a wireless interface
+    """
+
+    def setUp(self):
+        self.iface = 'wlan0'
+        self.ssid = ''
+        self.cells = []
+        self.connected = []
+
+        self.core_functions = core.status, core.cached_cells, core.rank, core.reconnect
+        core.status = lambda iface: self.ssid
+        core.cached_cells = lambda iface, max_age: self.cells
+        core.rank = lambda iface, scanned, db=None: sorted(scanned, key=lambda c: c["signal"], reverse=True)
+        core.reconnect = lambda iface, ssid, db, signal=None: self.connected.append(ssid)
+
+        self.supervisor = supervisor.Supervisor(self.iface, ':memory:', margin=10, hold=2)
+
+    def tearDown(self):
+        core.status, core.cached_cells, core.rank, core.reconnect = self.core_functions
+
+    def test_reconnect_on_loss(self):
+        self.cells = [{"ssid": "foo", "signal": -70, "address": "00:00:00:00:00:01"},
+                      {"ssid": "bar", "signal": -60, "address": "00:00:00:00:00:02"}]
+        self.assertEqual(self.supervisor.check(None), "bar")
+        self.assertEqual(self.connected, ["bar"])
+
+    def test_no_roam_within_margin(self):
+        self.ssid = "foo"
+        self.cells = [{"ssid": "bar", "signal": -62, "address": "00:00:00:00:00:02"},
+                      {"ssid": "foo", "signal": -70, "address": "00:00:00:00:00:01"}]
+        for i in range(3):
+            self.assertIsNone(self.supervisor.check(None))
+        self.assertEqual(self.connected, [])
+
+    def test_roam_after_hold(self):
+        self.ssid = "foo"
+        self.cells = [{"ssid": "bar", "signal": -50, "address": "00:00:00:00:00:02"},
+                      {"ssid": "foo", "signal": -70, "address": "00:00:00:00:00:01"}]
+        self.assertIsNone(self.supervisor.check(None))
+        self.assertEqual(self.supervisor.check(None), "bar")
+        self.assertEqual(self.connected, ["bar"])
+
+    def test_fallback(self):
+        self.cells = [{"ssid": "foo", "signal": -50, "address": "00:00:00:00:00:01"},
+                      {"ssid": "bar", "signal": -60, "address": "00:00:00:00:00:02"}]
+        failing = set(["foo"])
+
+        def fake_reconnect(iface, ssid, db, signal=None):
+            if ssid in failing:
+                raise core.WifiException("scheme {}: not found".format(ssid), 404)
+            self.connected.append(ssid)
+
+        core.reconnect = fake_reconnect
+
+        # the best network fails, the next one is tried
+        self.assertEqual(self.supervisor.check(None), "bar")
+        self.assertEqual(self.connected, ["bar"])
+
+        self.ssid = ''
+        failing.add("bar")
+        with self.assertRaises(core.WifiException) as cm:
+            self.supervisor.check(None)
+        self.assertEqual(cm.exception.code, 404)
+        self.assertIn("bar", cm.exception.message)
+        self.assertGreater(self.supervisor._retry_at, 0)
+
+    def test_two_ifaces(self):
+        core.status, core.cached_cells, core.rank, core.reconnect = self.core_functions
+        saved = core._run, core.Wireless, core.wireless_interfaces, core.WRITER
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        radio = loadtest.SimulatedRadio(['sim0', 'sim1'], cells=4, scan_latency=0, connect_latency=0)
+        radio.install()
+        core.WRITER = core.InterfacesWriter(path, window=0)
+
+        dir_name = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        db = sqlite3.connect(':memory:')
+        with open(os.path.join(dir_name, 'wifi_manager/schema/schema.sql')) as f:
+            db.executescript(f.read())
+        migrations.migrate(db)
+
+        try:
+            # each network is stored for one interface only, the stronger one for the other interface
+            core.WRITER.save(core.Scheme('sim0', 'sim-0', {'wireless-essid': 'sim-0'}))
+            core.WRITER.save(core.Scheme('sim1', 'sim-1', {'wireless-essid': 'sim-1'}))
+
+            self.assertEqual(core.available('sim1', db), 'sim-1')
+            self.assertEqual(supervisor.Supervisor('sim1', ':memory:').check(db), 'sim-1')
+            self.assertEqual(radio.wireless('sim1').getEssid(), 'sim-1')
+            self.assertEqual(radio.wireless('sim0').getEssid(), '')
+        finally:
+            core._run, core.Wireless, core.wireless_interfaces, core.WRITER = saved
+            db.close()
+            os.unlink(path)
+
+    def test_radio_slot(self):
+        pools = {"scan": limits.Pool('scan', concurrency=1, queue_timeout=0.1, rate=1, burst=1),
+                 "radio": limits.Pool('radio', concurrency=1, queue_timeout=0.1, rate=1, burst=1)}
+        self.supervisor = supervisor.Supervisor(self.iface, ':memory:', pools=pools)
+        self.cells = [{"ssid": "bar", "signal": -60, "address": "00:00:00:00:00:02"}]
+
+        # a client request holds the radio: no reconnection meanwhile
+        pools["radio"].acquire('client')
+        self.assertRaises(limits.Rejected, self.supervisor.check, None)
+        self.assertEqual(self.connected, [])
+
+        threading.Timer(0.05, pools["radio"].release).start()
+        self.assertEqual(self.supervisor.check(None), "bar")
+        self.assertEqual(self.connected, ["bar"])
+
+        # the supervisor is not rate limited, and releases the slots
+        self.assertEqual(self.supervisor.check(None), "bar")
+        pools["radio"].acquire('other')
+        pools["scan"].acquire('other')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+from context import os, writer
+from wifi import Scheme
+import threading
+import unittest
+import tempfile
+
+
+class WifiWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.fd, self.path = tempfile.mkstemp()
+        with os.fdopen(self.fd, 'w') as f:
+            f.write("auto lo\niface lo inet loopback\n\niface wlan0-foo inet dhcp\n    wireless-essid foo\n")
+
+        self.writer = writer.InterfacesWriter(self.path, window=0.05)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def test_find(self):
+        scheme = self.writer.find('wlan0', 'foo')
+        self.assertEqual(scheme.options['wireless-essid'], 'foo')
+        self.assertIsNone(self.writer.find('wlan0', 'bar'))
+
+    def test_save_delete(self):
+        self.writer.save(Scheme('wlan0', 'bar', {'wireless-essid': 'bar'}))
+        self.assertIsNotNone(self.writer.find('wlan0', 'bar'))
+        self.assertIn("iface wlan0-bar inet dhcp", self.read())
+
+        self.writer.delete('wlan0', 'foo')
+        content = self.read()
+        self.assertNotIn("wlan0-foo", content)
+        self.assertIn("iface lo inet loopback", content)
+        self.assertEqual([(s.interface, s.name) for s in self.writer.all()], [('wlan0', 'bar')])
+
+    def test_save_replaces(self):
+        self.writer.save(Scheme('wlan0', 'foo', {'wireless-essid': 'baz'}))
+        content = self.read()
+        self.assertEqual(content.count("iface wlan0-foo inet dhcp"), 1)
+        self.assertEqual(self.writer.find('wlan0', 'foo').options['wireless-essid'], 'baz')
+
+    def test_remote(self):
+        sent = []
+
+        def remote(ops):
+            sent.extend(ops)
+            with open(self.path, 'w') as f:
+                f.write(writer.edit(self.read(), ops))
+
+        self.writer.remote = remote
+        self.writer.save(Scheme('wlan0', 'bar', {'wireless-essid': 'bar'}))
+        self.assertEqual([(op, s.name) for op, s in sent], [('save', 'bar')])
+        self.assertIsNotNone(self.writer.find('wlan0', 'bar'))
+
+    def test_check_scheme(self):
+        writer.check_scheme('wlan0', 'foo', {'wpa-ssid': 'foo', 'wpa-psk': 'bar', 'wireless-channel': 'auto'})
+        for iface, ssid, options in (('wlan0', 'foo', {'up': 'reboot'}),
+                                     ('wlan0', 'foo', {'wireless-essid': 'foo\n    post-up reboot'}),
+                                     ('wlan0', 'foo bar', {}),
+                                     ('wlan0 inet', 'foo', {}),
+                                     ('wlan0', 'foo', None)):
+            self.assertRaises(ValueError, writer.check_scheme, iface, ssid, options)
+
+    def test_sync(self):
+        schemes = [Scheme('wlan0', 'foo', {'wireless-essid': 'foo'}), Scheme('wlan1', 'bar', {'wireless-essid': 'bar'})]
+        self.assertEqual(self.writer.sync(schemes), 1)
+        self.assertEqual(self.writer.sync(schemes), 0)
+        self.assertEqual(self.writer.sync(schemes[1:]), 1)
+        self.assertIsNone(self.writer.find('wlan0', 'foo'))
+        self.assertIn("iface lo inet loopback", self.read())
+
+    def test_external_change(self):
+        with open(self.path, 'a') as f:
+            f.write("\niface wlan1-ext inet dhcp\n    wireless-essid ext\n    wireless-channel auto\n")
+        self.assertIsNotNone(self.writer.find('wlan1', 'ext'))
+
+    def test_coalesce(self):
+        writes = []
+        replace = self.writer._replace
+
+        def counting_replace(content):
+            writes.append(content)
+            replace(content)
+
+        self.writer._replace = counting_replace
+
+        threads = [threading.Thread(target=self.writer.save, args=(Scheme('wlan0', 'n{}'.format(i)),))
+                   for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(self.writer.all()), 6)
+        self.assertTrue(len(writes) < 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
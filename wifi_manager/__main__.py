@@ -1,16 +1,69 @@
-from __future__ import print_function
 from binascii import hexlify
-from rest import app, init_db
+import atexit
+import logging
+import logs
 import os
+import startup
 
-app.API_KEY = hexlify(os.urandom(20)).decode()
-print('api key is: {}'.format(app.API_KEY))
+# logs are written as JSON lines to stderr by a background thread, so that a slow console never stalls requests
+LOG_LEVEL = logging.INFO
+atexit.register(logs.setup(LOG_LEVEL).stop)
+
+with startup.timed('imports'):
+    from rest import app, init_db
+    from werkzeug.serving import WSGIRequestHandler
+    import core
 
 app.config['DB_PATH'] = os.path.join(os.getcwd(), 'wifi_manager/schema')
 app.config['DB_SOURCE'] = os.path.join(app.config['DB_PATH'], 'schema.sql')
 app.config['DB_INSTANCE'] = os.path.join(app.config['DB_PATH'], 'schema.db')
 
+# the api key is written next to the database, to a file readable by the owner only, rather than to the console
+app.config['API_KEY_FILE'] = os.path.join(os.path.dirname(app.config['DB_INSTANCE']), 'api_key')
+app.API_KEY = hexlify(os.urandom(20)).decode()
+with os.fdopen(os.open(app.config['API_KEY_FILE'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+    # the mode only applies to a new file
+    os.fchmod(f.fileno(), 0o600)
+    f.write(app.API_KEY + '\n')
+logging.getLogger(__name__).info('api key written to %s', app.config['API_KEY_FILE'])
+
 app.config['DEBUG'] = False
 
-init_db()
-app.run(host='0.0.0.0')
+# 'file': /etc/network/interfaces is the source of truth
+# 'db': the sqlite database is the source of truth and /etc/network/interfaces is generated from it
+app.config['STORE'] = 'file'
+
+# unix socket of the privileged helper (wifi_manager/helper.py); None runs privileged operations through sudo
+app.config['HELPER_SOCKET'] = None
+
+# admission control of expensive endpoints, overriding limits.POOLS, e.g. {'scan': {'concurrency': 1, ...}}
+app.config['LIMITS'] = {}
+
+# directory of request profiles: requests with the X-Profile: 1 header are profiled, see GET /profiles;
+# None disables profiling
+app.config['PROFILE_DIR'] = None
+app.config['PROFILE_MAX'] = 20
+
+# gateway mode: fan requests out to the instances registered with POST /gateway/devices/<name>, see
+# /gateway/fanout/<path>; GATEWAY_TIMEOUT is the default number of seconds each instance has to answer
+app.config['GATEWAY'] = False
+app.config['GATEWAY_TIMEOUT'] = 10
+
+# keep connections open between requests, e.g. those of a gateway
+WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+
+# import the radio libraries, parse /etc/network/interfaces and scan in the background after the start, while
+# requests are already served; timings are listed by GET /startup
+app.config['WARM_UP'] = False
+
+with startup.timed('init_db'):
+    init_db()
+
+# connection attempts are written in batches, the last ones when the service stops
+atexit.register(core.STATS.close, app.config['DB_INSTANCE'])
+
+if app.config['WARM_UP']:
+    core.warm_up()
+
+# serve requests in threads, so that cheap requests don't wait behind radio operations
+app.run(host='0.0.0.0', threaded=True)
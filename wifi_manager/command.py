@@ -0,0 +1,136 @@
+import os
+import signal
+import subprocess
+import threading
+
+# seconds an external command may run before its process group is killed
+TIMEOUTS = {
+    'ifup': 40,  # includes the DHCP negotiation
+    'ifdown': 15,
+    'iwlist': 15
+}
+DEFAULT_TIMEOUT = 30
+KILL_GRACE = 2  # seconds between SIGTERM and SIGKILL
+
+_LOCK = threading.Lock()
+_RUNS = {}
+_TIMEOUTS = {}
+
+
+class CommandTimeout(Exception):
+    def __init__(self, name, timeout, output, stderr):
+        super(CommandTimeout, self).__init__("{}: timed out after {} seconds".format(name, timeout))
+        self.message = "{}: timed out after {} seconds".format(name, timeout)
+        self.name = name
+        self.timeout = timeout
+        self.output = output
+        self.stderr = stderr
+
+
+def run(args, timeout=None):
+    """
+    run an external command in its own process group, killing the whole group if it takes too long
+
+    :param args: command and arguments
+    :param timeout: timeout in seconds, by default the one configured in TIMEOUTS for the command
+    :return: tuple with exit code, stdout and stderr
+    """
+
+    name = command_name(args)
+    if timeout is None:
+        timeout = TIMEOUTS.get(name, DEFAULT_TIMEOUT)
+
+    record(name)
+
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               preexec_fn=os.setsid, close_fds=True)
+    expired = threading.Event()
+    timers = []
+
+    def kill():
+        expired.set()
+        _signal_group(process, signal.SIGTERM)
+        _start_timer(timers, KILL_GRACE, _signal_group, process, signal.SIGKILL)
+
+    _start_timer(timers, timeout, kill)
+
+    try:
+        output, stderr = process.communicate()
+    finally:
+        for t in list(timers):
+            t.cancel()
+
+    output = output.decode('utf-8', 'replace')
+    stderr = stderr.decode('utf-8', 'replace')
+
+    if expired.is_set():
+        record(name, timed_out=True)
+        raise CommandTimeout(name, timeout, output, stderr)
+
+    return process.returncode, output, stderr
+
+
+def counters():
+    """
+    return the number of runs and timeouts of each command
+
+    :return: dictionary keyed by command name
+    """
+
+    with _LOCK:
+        return dict((name, {"runs": runs, "timeouts": _TIMEOUTS.get(name, 0)}) for name, runs in _RUNS.items())
+
+
+def command_name(args):
+    """
+    name a command for timeouts and counters, skipping sudo
+
+    :param args: command and arguments
+    :return: the command name
+    """
+
+    if os.path.basename(args[0]) == 'sudo' and len(args) > 1:
+        args = args[1:]
+
+    return os.path.basename(args[0])
+
+
+def record(name, timed_out=False):
+    """
+    count a run of a command, or its timeout
+
+    :param name: the command name
+    :param timed_out: if True, count a timeout instead of a run
+    :return:
+    """
+
+    counter = _TIMEOUTS if timed_out else _RUNS
+
+    with _LOCK:
+        counter[name] = counter.get(name, 0) + 1
+
+
+def _start_timer(timers, delay, function, *args):
+    timer = threading.Timer(delay, function, args)
+    timer.daemon = True
+    timers.append(timer)
+    timer.start()
+
+
+def _signal_group(process, sig):
+    """
+    send a signal to the process group of a command, if it is still running
+
+    :param process: the process object
+    :param sig: the signal
+    :return:
+    """
+
+    if process.returncode is not None:
+        return
+
+    try:
+        os.killpg(process.pid, sig)
+    except OSError:
+        # the group is gone already
+        pass
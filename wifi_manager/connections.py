@@ -0,0 +1,75 @@
+import threading
+
+MAX_IDLE = 4  # idle connections kept open by default
+
+
+class IdlePool(object):
+    """
+    keep the connections of a client open between requests, for the helper and the gateway clients
+    """
+
+    def __init__(self, connect, max_idle=MAX_IDLE):
+        self.connect = connect
+        self.max_idle = max_idle
+
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def exchange(self, function, errors):
+        """
+        run an exchange on an idle connection, or on a new one; an idle connection may have been closed by the peer
+        in the meantime (e.g. after a restart), the exchange is then retried once on a new connection
+
+        :param function: the exchange, called with the connection
+        :param errors: exception classes of a failed exchange
+        :return: tuple with the connection, to release or close once done, and the result of the exchange
+        """
+
+        conn, reused = self._acquire()
+        try:
+            try:
+                return conn, function(conn)
+            except errors:
+                conn.close()
+                if not reused:
+                    raise
+                conn = self.connect()
+                return conn, function(conn)
+        except Exception:
+            conn.close()
+            raise
+
+    def release(self, conn):
+        """
+        keep a connection open for the next exchange, unless enough are idle already
+
+        :param conn: the connection
+        :return:
+        """
+
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+
+        conn.close()
+
+    def close(self):
+        """
+        close idle connections
+
+        :return:
+        """
+
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for conn in idle:
+            conn.close()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+
+        return self.connect(), False
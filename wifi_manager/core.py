@@ -1,36 +1,94 @@
-from __future__ import print_function
-from wifi import Cell, Scheme
-from wifi.exceptions import ConnectionError, InterfaceError
-from pythonwifi.iwlibs import Wireless
+from helper import HelperClient, HelperError
+from command import CommandTimeout
+from generations import ScanHistory
+from signals import SignalHistory
+import command
+import logs
+from stats import StatsRecorder
+from writer import InterfacesWriter, check_scheme
+from multiprocessing import TimeoutError
+from Queue import Empty, Queue
+from multiprocessing.pool import ThreadPool
 import array
 import fcntl
+import json
+import logging
+import os
 import socket
+import startup
 import struct
 import sys
-import subprocess
-import sched
+import threading
 import time
 
-SCHEDULER = sched.scheduler(time.time, time.sleep)
+logger = logging.getLogger(__name__)
+
+# the radio libraries are imported on first use, not when the service starts
+_exceptions = startup.LazyModule('wifi.exceptions')
+_scan = startup.LazyModule('wifi.scan')
+Cell = startup.LazyAttribute(_scan, 'Cell')
+cells_re = startup.LazyAttribute(_scan, 'cells_re')
+Scheme = startup.LazyAttribute(startup.LazyModule('wifi'), 'Scheme')
+Wireless = startup.LazyAttribute(startup.LazyModule('pythonwifi.iwlibs'), 'Wireless')
+RADIO_MODULES = ('wifi', 'wifi.exceptions', 'wifi.scan', 'wifi.scheme', 'pythonwifi.iwlibs')
+
 RETRY_AFTER = 3  # seconds
 TIMEOUT = 60  # seconds
 GPS_INF = -1000.0
+WRITER = InterfacesWriter()
+STATS = StatsRecorder()
+
+# ranking of candidate networks: signal level (dBm), adjusted by connection history
+RANK_SUCCESS_WEIGHT = 20.0  # dBm gained by a network that always connects over one that connects half of the times
+RANK_TIME_WEIGHT = 1.0  # dBm lost per second of median time to connect
+
+# latest scan of each interface, as (time, cells), and recent scans numbered by generation
+SCANS = {}
+SCAN_HISTORY = ScanHistory()
+SIGNALS = SignalHistory()  # signal samples of each BSSID, smoothed for ranking
+
+# choice of the access point of a network broadcast by several ones
+FIVE_GHZ_MARGIN = 10  # dB, a 5 GHz access point is preferred unless a 2.4 GHz one is stronger by more than this
+BSSID_BEST = 'best'  # pin a connection to the best access point, see connect
+SCAN_TIMEOUT = 20  # seconds
+SCAN_WORKERS = 4
+_SCAN_POOL = []
+_SCAN_POOL_LOCK = threading.Lock()
+
+STORE_FILE = 'file'  # schemes read from /etc/network/interfaces, mirrored in the database
+STORE_DB = 'db'  # schemes read from the database, /etc/network/interfaces generated from it
+STORE = STORE_FILE
+
+# privileged helper running ifup, ifdown, iwlist and file writes, if configured (see use_helper)
+HELPER = None
+
+# network interfaces known to the kernel, configured or not; wireless ones have a wireless subdirectory
+SYS_NET = '/sys/class/net'
+
+# interfaces configured by ifup, used to skip requests that would not change anything (see ifup(8)); newer versions of
+# ifupdown keep one IFSTATE.<iface> file per interface instead
+IFSTATE = '/run/network/ifstate'
 
 
 class WifiException(Exception):
-    def __init__(self, message, code):
+    def __init__(self, message, code, stderr=None):
         super(WifiException, self).__init__(message)
         self.message = message
         self.code = code
+        self.stderr = stderr
 
 
-def scheme_all():
+def scheme_all(db=None):
     """
     return all schemes stored in /etc/network/interfaces
 
+    :param db: sqlite3 database handle, required when the database is the source of truth
     :return: list of schemes as json string
     """
-    schemes = Scheme.all()
+    if STORE == STORE_DB:
+        schemes = _db_schemes(db)
+    else:
+        schemes = WRITER.all()
     res = []
 
     for s in schemes:
@@ -109,20 +167,120 @@ def cell_all(iface):
     :return: list of cells as json string
     """
 
-    try:
-        cells = Cell.all(iface)
-    except InterfaceError as e:
-        raise WifiException(e.message, 404)
+    cells = _scan_cells(iface)
 
-    cells.sort(key=lambda cell: cell.signal, reverse=True)
+    return _scan_result(iface, cells)
 
-    res = []
+
+def cell_groups(iface, cells):
+    """
+    group scanned cells by network name, keeping the best access point of each network
+
+    :param iface: network interface
+    :param cells: list of cells as returned by cell_all
+    :return: list of the best cell of each network, sorted by signal, with the number of access points
+        ("count") and the bands they use ("bands")
+    """
+
+    groups = {}
     for c in cells:
-        res.append(_cell_to_dict(c))
+        groups.setdefault(c["ssid"], []).append(c)
+
+    res = []
+    for members in groups.values():
+        best = dict(max(members, key=lambda c: _band_score(iface, c)))
+        best["count"] = len(members)
+        best["bands"] = sorted(set(_band(c) for c in members))
+        res.append(best)
+
+    res.sort(key=lambda c: c["signal"], reverse=True)
 
     return res
 
 
+def cell_delta(iface, since, threshold=None):
+    """
+    scan a network interface and return the cells that changed since an earlier scan
+
+    :param iface: network interface
+    :param since: generation of the earlier scan, 0 for all cells
+    :param threshold: signal change in dBm above which a cell is reported as changed
+    :return: dictionary with the generation of the scan, the added, changed and removed cells
+    """
+
+    cell_all(iface)
+
+    return SCAN_HISTORY.delta(iface, since, threshold)
+
+
+def wireless_interfaces():
+    """
+    list wireless network interfaces, including the ones without an address (e.g. not connected yet)
+
+    :return: list of network interfaces, sorted by name
+    """
+
+    try:
+        names = os.listdir(SYS_NET)
+    except OSError:
+        return []
+
+    return sorted(iface for iface in names if os.path.isdir(os.path.join(SYS_NET, iface, 'wireless')))
+
+
+def scan_all(ifaces=None, timeout=SCAN_TIMEOUT):
+    """
+    scan several network interfaces in parallel
+
+    :param ifaces: list of network interfaces, all wireless interfaces if None
+    :param timeout: maximum time to wait for each interface, in seconds
+    :return: dictionary with the cells of all interfaces, sorted by signal, and the errors of each interface
+    """
+
+    if ifaces is None:
+        ifaces = wireless_interfaces()
+
+    pool = _scan_pool()
+    pending = [(iface, pool.apply_async(cell_all, (iface,))) for iface in ifaces]
+
+    # scans run at the same time, so they share the same deadline
+    deadline = time.time() + timeout
+    cells = []
+    errors = {}
+
+    for iface, result in pending:
+        try:
+            for c in result.get(max(deadline - time.time(), 0)):
+                c = dict(c)
+                c["iface"] = iface
+                cells.append(c)
+        except TimeoutError:
+            errors[iface] = {"message": "scan {}: timed out".format(iface), "code": 504}
+        except WifiException as e:
+            errors[iface] = {"message": e.message, "code": e.code}
+
+    cells.sort(key=lambda cell: cell["signal"], reverse=True)
+
+    return {"cells": cells, "errors": errors}
+
+
+def cached_cells(iface, max_age):
+    """
+    return the latest scan of a network interface, scanning again if it is older than max_age
+
+    :param iface: network interface
+    :param max_age: maximum age of the scan, in seconds
+    :return: list of cells as json string
+    """
+
+    scan = SCANS.get(iface)
+
+    if scan is None or time.time() - scan[0] > max_age:
+        return cell_all(iface)
+
+    return scan[1]
+
+
 def status(iface):
     """
     retrieve the network the interface is connected to
@@ -136,44 +294,94 @@ def status(iface):
     return ssid
 
 
-def available(iface):
+def available(iface, db=None):
     """
     return the best available Wi-Fi network, if any
 
     :param iface:
+    :param db: sqlite3 database handle, required when the database is the source of truth
     :return: the network name
     """
 
-    scanned = cell_all(iface)
-    stored = scheme_all()
+    candidates = rank(iface, cell_all(iface), db)
 
-    for sc in scanned:
-        for st in stored:
-            st_name = st["name"]
-            if sc["ssid"] == st_name:
-                return st_name
+    if not candidates:
+        return ''
 
-    return ''
+    return candidates[0]["ssid"]
+
+
+def rank(iface, scanned, db=None):
+    """
+    rank the scanned cells of the networks stored for an interface, best first
+
+    :param iface: network interface
+    :param scanned: list of cells as returned by cell_all
+    :param db: sqlite3 database handle, used for connection history
+    :return: list of cells of stored networks
+    """
+
+    names = set(st["name"] for st in scheme_all(db) if st["interface"] == iface)
+    candidates = [sc for sc in scanned if sc["ssid"] in names]
+
+    history = STATS.summary(db, iface=iface) if db is not None and candidates else {}
+    candidates.sort(key=lambda sc: _rank(iface, sc, history.get((iface, sc["ssid"]))), reverse=True)
+
+    return candidates
+
+
+def smoothed_signal(iface, cell):
+    """
+    return the signal of a scanned cell, smoothed over the recent scans
+
+    :param iface: network interface
+    :param cell: the cell as dictionary
+    :return: the signal in dBm
+    """
+
+    signal = SIGNALS.smoothed(iface, cell["address"])
+
+    return signal if signal is not None else cell["signal"]
+
+
+def network_stats(db, iface=None, ssid=None):
+    """
+    return connection statistics of stored networks
+
+    :param db: sqlite3 database handle
+    :param iface: if set, restrict to this network interface
+    :param ssid: if set, restrict to this network name
+    :return: list of statistics, one entry per network
+    """
+
+    res = []
+
+    for (s_iface, s_ssid), s in sorted(STATS.summary(db, iface, ssid).items()):
+        s = dict(s)
+        s["iface"] = s_iface
+        s["ssid"] = s_ssid
+        res.append(s)
+
+    return res
 
 
 def get_last_location(ssid, db):
     """
     fetch last known location from sqlite3 database
 
+    a network stored for several interfaces has one row per interface: the most recently seen known location wins
+
     :param ssid: network name
     :param db: sqlite3 database handle
     :return: matching latitude and longitude
     """
 
-    cursor = db.execute("SELECT lat,lng FROM networks WHERE ssid=?;", (ssid,))
-    matches = cursor.fetchall()
-
-    if len(matches) > 1:
-        raise AssertionError("query resulted in multiple row matches instead of one")
+    query = "SELECT lat,lng FROM networks WHERE ssid=? ORDER BY (lat=? OR lng=?), last_seen DESC LIMIT 1;"
+    match = db.execute(query, (ssid, GPS_INF, GPS_INF)).fetchone()
 
-    if len(matches) == 1:
-        lat = matches[0][0]
-        lng = matches[0][1]
+    if match is not None:
+        lat = match[0]
+        lng = match[1]
     else:
         lat = GPS_INF
         lng = GPS_INF
@@ -181,34 +389,44 @@ def get_last_location(ssid, db):
     return lat, lng
 
 
-def enable(iface):
+def enable(iface, force=False):
     """
     enable a network interface
 
     :param iface: network interface
+    :param force: run ifup even if the interface is configured already
     :return: exit code
     """
 
-    code = subprocess.call(["sudo", "ifup", iface])
+    # skipped only when both the state of ifupdown and the link say the interface is up
+    if not force and _configured(iface) and _link_up(iface):
+        return 0
+
+    code, stderr = _ifupdown("ifup", iface)
 
     if code != 0:
-        raise WifiException("error enabling {}".format(iface), 500)
+        raise WifiException("error enabling {}".format(iface), 500, stderr)
 
     return code
 
 
-def disable(iface):
+def disable(iface, force=False):
     """
     disconnect a network interface
 
     :param iface: network interface
+    :param force: run ifdown even if the interface is not configured
     :return: exit code
     """
 
-    code = subprocess.call(["sudo", "ifdown", iface])
+    # skipped only when both the state of ifupdown and the link say the interface is down
+    if not force and _configured(iface) is False and _link_up(iface) is False:
+        return 0
+
+    code, stderr = _ifupdown("ifdown", iface)
 
     if code != 0:
-        raise WifiException("error disabling {}".format(iface), 500)
+        raise WifiException("error disabling {}".format(iface), 500, stderr)
 
     return code
 
@@ -225,19 +443,67 @@ def save(iface, ssid, passkey, db, lat=GPS_INF, lng=GPS_INF):
     :return: the scheme just created
     """
 
-    cell = _network_in_range(iface, ssid)
-    scheme = Scheme.find(iface, ssid)
+    scheme, cell = _save(iface, ssid, passkey, db, lat, lng)
+
+    return scheme
+
+
+def _save(iface, ssid, passkey, db, lat, lng, bssid=None):
+    """
+    store a network scheme
+
+    :param iface: network interface
+    :param ssid: network name
+    :param passkey: authentication passphrase
+    :param db: sqlite3 database handle
+    :param lat: latitude
+    :param lng: longitude
+    :param bssid: if set, the access point that must be in range, or BSSID_BEST
+    :return: tuple with the scheme and the cell in range
+    """
+
+    cell = _network_in_range(iface, ssid, bssid)
+    scheme = _store(iface, ssid, cell, passkey, db, lat, lng)
+
+    return scheme, cell
+
+
+def _store(iface, ssid, cell, passkey, db, lat, lng):
+    """
+    store the network scheme of a cell in range
+
+    :param iface: network interface
+    :param ssid: network name
+    :param cell: cell object matching the arguments
+    :param passkey: authentication passphrase
+    :param db: sqlite3 database handle
+    :param lat: latitude
+    :param lng: longitude
+    :return: the scheme
+    """
+
+    if STORE == STORE_DB:
+        scheme = _db_scheme_find(iface, ssid, db)
+        if not scheme:
+            scheme = _new_scheme(iface, ssid, cell, passkey)
+
+        _save_to_db(iface, ssid, _get_hashed_passkey(scheme, cell), db, lat, lng, scheme.options)
+        render(db)
+
+        return scheme
+
+    scheme = WRITER.find(iface, ssid)
 
     # save scheme to file only if it does not exists
     if not scheme:
         scheme = _save_to_file(iface, ssid, cell, passkey)
 
-    _save_to_db(iface, ssid, _get_hashed_passkey(scheme, cell), db, lat, lng)
+    _save_to_db(iface, ssid, _get_hashed_passkey(scheme, cell), db, lat, lng, scheme.options)
 
     return scheme
 
 
-def connect(iface, ssid, passkey, db, lat=GPS_INF, lng=GPS_INF):
+def connect(iface, ssid, passkey, db, lat=GPS_INF, lng=GPS_INF, bssid=None, force=False):
     """
     connect to a network
 
@@ -247,48 +513,245 @@ def connect(iface, ssid, passkey, db, lat=GPS_INF, lng=GPS_INF):
     :param db: sqlite3 database handle
     :param lat: latitude
     :param lng: longitude
+    :param bssid: if set, connect to this access point only, or to the best one if BSSID_BEST
+    :param force: reconnect even if the interface is connected to the network already
     :return: status code
     """
 
-    def countdown_retry():
-        """
-        delay new connection attempt
-        """
+    if not force and _associated(iface, ssid, bssid):
+        # connected already, but only to a stored network: its scheme must exist for enable and reconnect
+        _scheme_find(iface, ssid, db)
+        _update_location(iface, ssid, db, lat, lng)
+        return
+
+    scheme, cell = _save(iface, ssid, passkey, db, lat, lng, bssid)
+
+    if bssid:
+        scheme = _pinned(scheme, cell.address)
+
+    _connect(iface, ssid, scheme, db, cell.signal)
+
+
+def reconnect(iface, ssid, db, signal=None):
+    """
+    connect to a stored network, without scanning for it first
+
+    :param iface: network interface
+    :param ssid: network name
+    :param db: sqlite3 database handle
+    :param signal: signal level of the network, if known
+    :return:
+    """
 
-        def countdown_print(s):
-            print("retrying connection in {}".format(s))
+    scheme = _scheme_find(iface, ssid, db)
 
-        def do_nothing():
-            pass
+    _connect(iface, ssid, scheme, db, signal)
+
+
+def connect_any(ifaces, ssid, passkey, db, lat=GPS_INF, lng=GPS_INF, force=False):
+    """
+    connect to a network on whichever of several interfaces associates first
+
+    attempts run in parallel; as soon as one succeeds, the others are cancelled, and the interfaces that
+    connected anyway are disabled again
+
+    :param ifaces: list of network interfaces
+    :param ssid: network name
+    :param passkey: authentication passkey
+    :param db: sqlite3 database handle
+    :param lat: latitude
+    :param lng: longitude
+    :param force: connect even if one of the interfaces is connected to the network already
+    :return: the network interface that connected
+    """
+
+    # database lookups stay in the calling thread, sqlite3 handles can't be shared
+    existing = {}
+    for iface in ifaces:
+        existing[iface] = _db_scheme_find(iface, ssid, db) if STORE == STORE_DB else WRITER.find(iface, ssid)
+
+    if not force:
+        for iface in ifaces:
+            if _associated(iface, ssid):
+                if existing[iface] is None:
+                    raise WifiException("scheme {}: not found".format(ssid), 404)
+                _update_location(iface, ssid, db, lat, lng)
+                return iface
+
+    cancel = threading.Event()
+    lock = threading.Lock()
+    results = Queue()
+
+    rid = logs.request_id()
+
+    def attempt(iface):
+        logs.set_request_id(rid)
+        created = None
+        connected = False
+        try:
+            cell = _network_in_range(iface, ssid)
+            scheme = existing[iface]
+            if scheme is None:
+                scheme = created = _new_scheme(iface, ssid, cell, passkey)
+                WRITER.save(scheme)
+
+            start = time.time()
+            connected, attempts, message = _activate(iface, ssid, scheme, cancel)
+
+            with lock:
+                won = connected and not cancel.is_set()
+                if won:
+                    cancel.set()
+
+            if won:
+                results.put((iface, (scheme, cell, start, attempts), None))
+                return
+
+            error = WifiException(message or "connection {}:{}: cancelled".format(iface, ssid), 500)
+            results.put((iface, (scheme, cell, start, attempts), error))
+        except WifiException as e:
+            results.put((iface, None, e))
+
+        # roll back the losing attempt
+        try:
+            if connected:
+                disable(iface)
+            if created is not None:
+                WRITER.delete(iface, ssid)
+        except WifiException as e:
+            logger.warning("connection %s:%s: rollback failed: %s", iface, ssid, e.message)
+
+    for iface in ifaces:
+        t = threading.Thread(target=attempt, args=(iface,), name='connect-{}'.format(iface))
+        t.daemon = True
+        t.start()
+
+    errors = []
+    for _ in ifaces:
+        try:
+            iface, res, error = results.get(True, TIMEOUT + SCAN_TIMEOUT)
+        except Empty:
+            cancel.set()
+            raise WifiException("connection {}: timed out".format(ssid), 504)
 
-        sec = 0
-        while sec < RETRY_AFTER:
-            SCHEDULER.enter(sec, 1, countdown_print, (RETRY_AFTER - sec,))
-            sec += 1
+        if res is not None:
+            scheme, cell, start, attempts = res
+            if error is None or not cancel.is_set():
+                STATS.record(db, iface, ssid, start, time.time() - start, attempts, error is None, cell.signal)
 
-        SCHEDULER.enter(sec, 1, do_nothing, ())
-        SCHEDULER.run()
+        if error is None:
+            _save_to_db(iface, ssid, _get_hashed_passkey(scheme, cell), db, lat, lng, scheme.options)
+            if STORE == STORE_DB:
+                render(db)
 
-    scheme = save(iface, ssid, passkey, db, lat, lng)
+            db.execute("UPDATE networks SET last_connected=? WHERE iface=? AND ssid=?;", (time.time(), iface, ssid))
+            db.commit()
+            return iface
+
+        errors.append((iface, error))
+
+    codes = set(e.code for _, e in errors)
+    code = codes.pop() if len(codes) == 1 else 500
+    raise WifiException("; ".join("{}: {}".format(iface, e.message) for iface, e in errors), code)
+
+
+def _connect(iface, ssid, scheme, db, signal):
+    """
+    activate a scheme, retrying until TIMEOUT
+
+    :param iface: network interface
+    :param ssid: network name
+    :param scheme: the scheme to activate
+    :param db: sqlite3 database handle
+    :param signal: signal level of the network, recorded in the connection history
+    :return:
+    """
+
+    start = time.time()
+    attempts = 0
+    connected = False
+    try:
+        connected, attempts, message = _activate(iface, ssid, scheme)
+
+        if not connected:
+            # failed to connect
+            raise WifiException(message, 500)
+
+        db.execute("UPDATE networks SET last_connected=? WHERE iface=? AND ssid=?;", (time.time(), iface, ssid))
+        db.commit()
+    finally:
+        STATS.record(db, iface, ssid, start, time.time() - start, attempts, connected, signal)
+
+
+def _activate(iface, ssid, scheme, cancel=None):
+    """
+    activate a scheme, retrying until TIMEOUT or until cancelled
+
+    :param iface: network interface
+    :param ssid: network name
+    :param scheme: the scheme to activate
+    :param cancel: event that stops retrying when set
+    :return: tuple with the connection outcome, the number of attempts and the last error message
+    """
 
     # try to connect (at least once)
     start = time.time()
     elapsed = 0
+    attempts = 0
+    message = None
     while elapsed < TIMEOUT:
+        if cancel is not None and cancel.is_set():
+            break
+
+        attempts += 1
         try:
-            scheme.activate()
-            elapsed = time.time() - start
-            print("connected to {} in {} seconds".format(ssid, elapsed))
-            return
+            _activate_scheme(scheme)
+            _log_connected(iface, ssid, start, attempts)
+            return True, attempts, None
 
-        except ConnectionError as e:
-            print("failed")
+        except _exceptions.ConnectionError as e:
+            message = _log_attempt_failed(iface, ssid, attempts, e)
             enable(iface)
-            countdown_retry()
+            if cancel is None:
+                time.sleep(RETRY_AFTER)
+            elif cancel.wait(RETRY_AFTER):
+                break
             elapsed = time.time() - start
 
-    # failed to connect
-    raise WifiException(e.message, 500)
+    return False, attempts, message
+
+
+def _log_connected(iface, ssid, start, attempts):
+    """
+    log a successful activation
+
+    :param iface: network interface
+    :param ssid: network name
+    :param start: time the first attempt started
+    :param attempts: number of attempts
+    :return:
+    """
+
+    elapsed = time.time() - start
+    logger.info("connection %s:%s: connected in %.1f seconds", iface, ssid, elapsed,
+                extra={"iface": iface, "ssid": ssid, "elapsed": round(elapsed, 3), "attempts": attempts})
+
+
+def _log_attempt_failed(iface, ssid, attempts, e):
+    """
+    log a failed activation attempt, before retrying
+
+    :param iface: network interface
+    :param ssid: network name
+    :param attempts: number of attempts so far
+    :param e: the ConnectionError
+    :return: the error message
+    """
+
+    logger.warning("connection %s:%s: attempt %d failed, retrying in %d seconds: %s", iface, ssid, attempts,
+                   RETRY_AFTER, e.message, extra={"iface": iface, "ssid": ssid, "attempts": attempts})
+
+    return e.message
 
 
 def delete(iface, ssid, db, db_only=False):
@@ -302,18 +765,21 @@ def delete(iface, ssid, db, db_only=False):
     :return:
     """
 
-    scheme = _scheme_find(iface, ssid)
+    scheme = _scheme_find(iface, ssid, db)
 
     iface = scheme.interface
     ssid = scheme.name
 
-    if not db_only:
-        scheme.delete()
+    if not db_only and STORE != STORE_DB:
+        WRITER.delete(iface, ssid)
 
     # update database
     db.execute("DELETE FROM networks WHERE iface=? AND ssid=?;", (iface, ssid))
     db.commit()
 
+    if not db_only and STORE == STORE_DB:
+        render(db)
+
 
 def delete_all(db, db_only=False):
     """
@@ -324,28 +790,198 @@ def delete_all(db, db_only=False):
     :return: tuple with the total number of schemes and the number of deleted schemes
     """
 
-    schemes = Scheme.all()
+    if STORE == STORE_DB:
+        schemes = _db_schemes(db)
+        total = len(schemes)
+
+        cursor = db.execute("DELETE FROM networks;")
+        db.commit()
+        deleted = max(cursor.rowcount, 0)
+
+        if not db_only:
+            render(db)
+
+        return total, deleted
+
+    schemes = WRITER.all()
     total = 0
     deleted = 0
 
     for s in schemes:
         total += 1
-        delete(s.interface, s.name, db, db_only)
+        delete(s.interface, s.name, db, db_only=True)
         deleted += 1
 
+    # rewrite /etc/network/interfaces once for all schemes
+    if not db_only:
+        WRITER.apply([('delete', (s.interface, s.name)) for s in schemes])
+
     return total, deleted
 
 
-def _scheme_find(iface, ssid):
+def changes(db, since=0):
+    """
+    list the changes of the stored networks after a version, oldest first
+
+    only the latest change of each network is kept, so that replaying the changes after a version gives the
+    current state of all networks that changed since then
+
+    :param db: sqlite3 database handle
+    :param since: version of the last change already known, 0 for all networks
+    :return: generator of changes as dictionaries
+    """
+
+    query = "SELECT version, op, iface, ssid, passkey, lat, lng, options, changed FROM changes WHERE version>? " \
+            "ORDER BY version;"
+
+    for m in db.execute(query, (since,)):
+        yield {
+            "version": m[0],
+            "op": m[1],
+            "iface": m[2],
+            "ssid": m[3],
+            "passkey": m[4],
+            "lat": m[5],
+            "lng": m[6],
+            "options": json.loads(m[7]) if m[7] is not None else None,
+            "changed": m[8]
+        }
+
+
+def changes_version(db):
+    """
+    return the version of the latest change of the stored networks
+
+    :param db: sqlite3 database handle
+    :return: the version, 0 if nothing changed yet
+    """
+
+    return db.execute("SELECT COALESCE(MAX(version), 0) FROM changes;").fetchone()[0]
+
+
+def import_changes(db, entries):
+    """
+    apply a set of changes, as returned by changes, in one transaction and with one rewrite of
+    /etc/network/interfaces
+
+    :param db: sqlite3 database handle
+    :param entries: list of changes as dictionaries, with op ('save' or 'delete'), iface and ssid, and for
+        'save' the scheme options, and optionally passkey, lat and lng
+    :return: dictionary with the number of saved and deleted networks, and the version after the import
+    """
+
+    ops = []
+    for e in entries:
+        if not isinstance(e, dict) or e.get("op") not in ('save', 'delete'):
+            raise WifiException("import: op must be save or delete", 400)
+
+        if not isinstance(e.get("iface"), basestring) or not isinstance(e.get("ssid"), basestring):
+            raise WifiException("import: iface and ssid required", 400)
+
+        # the entries end up in /etc/network/interfaces, which is run as root by ifup
+        try:
+            check_scheme(e["iface"], e["ssid"], e.get("options", {}) if e["op"] == 'save' else {})
+        except ValueError as error:
+            raise WifiException("import {}:{}: {}".format(e["iface"], e["ssid"], error), 400)
+
+        if e["op"] == 'delete':
+            ops.append(('delete', (e["iface"], e["ssid"])))
+        elif not e.get("options"):
+            raise WifiException("import {}:{}: options required".format(e["iface"], e["ssid"]), 400)
+        elif not _iface_exists(e["iface"]):
+            raise WifiException("import {}:{}: no such interface".format(e["iface"], e["ssid"]), 400)
+        else:
+            ops.append(('save', Scheme(e["iface"], e["ssid"], e["options"])))
+
+    saved = 0
+    deleted = 0
+    try:
+        for e in entries:
+            if e["op"] == 'delete':
+                cursor = db.execute("DELETE FROM networks WHERE iface=? AND ssid=?;", (e["iface"], e["ssid"]))
+                deleted += max(cursor.rowcount, 0)
+                continue
+
+            options = e["options"]
+            passkey = e.get("passkey", options.get('wpa-psk', options.get('wireless-key', '')))
+            row = (passkey, e.get("lat", GPS_INF), e.get("lng", GPS_INF), json.dumps(options), e["iface"], e["ssid"])
+
+            query = "UPDATE networks SET passkey=?, lat=?, lng=?, options=? WHERE iface=? AND ssid=?;"
+            if db.execute(query, row).rowcount == 0:
+                query = "INSERT INTO networks(passkey, lat, lng, options, iface, ssid) VALUES (?, ?, ?, ?, ?, ?);"
+                db.execute(query, row)
+            saved += 1
+
+        # rewrite the file before committing, so that a failed write leaves the database unchanged
+        if STORE == STORE_DB:
+            render(db)
+        elif ops:
+            WRITER.apply(ops)
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return {"saved": saved, "deleted": deleted, "version": changes_version(db)}
+
+
+def render(db):
+    """
+    regenerate /etc/network/interfaces from the schemes stored in the database
+
+    only the stanzas that differ from the file are rewritten, and the file is left untouched when nothing changed
+
+    :param db: sqlite3 database handle
+    :return: the number of stanzas added, replaced or removed
+    """
+
+    return WRITER.sync(_db_schemes(db))
+
+
+def adopt(db):
+    """
+    copy the schemes stored in /etc/network/interfaces into the database, so that it can become the source of truth
+
+    :param db: sqlite3 database handle
+    :return: the number of adopted schemes
+    """
+
+    adopted = 0
+
+    for s in WRITER.all():
+        cursor = db.execute("SELECT options FROM networks WHERE iface=? AND ssid=?;", (s.interface, s.name))
+        match = cursor.fetchone()
+
+        if match is None:
+            passkey = s.options.get('wpa-psk', s.options.get('wireless-key', ''))
+            query = "INSERT INTO networks(iface, ssid, passkey, lat, lng, options) VALUES (?, ?, ?, ?, ?, ?);"
+            db.execute(query, (s.interface, s.name, passkey, GPS_INF, GPS_INF, json.dumps(s.options)))
+            adopted += 1
+        elif match[0] is None:
+            query = "UPDATE networks SET options=? WHERE iface=? AND ssid=?;"
+            db.execute(query, (json.dumps(s.options), s.interface, s.name))
+            adopted += 1
+
+    db.commit()
+
+    return adopted
+
+
+def _scheme_find(iface, ssid, db=None):
     """
     find a connection scheme for deletion
 
     :param iface: network interface
     :param ssid: network name
+    :param db: sqlite3 database handle, required when the database is the source of truth
     :return: the scheme that matches the arguments
     """
 
-    scheme = Scheme.find(iface, ssid)
+    if STORE == STORE_DB:
+        scheme = _db_scheme_find(iface, ssid, db)
+    else:
+        scheme = WRITER.find(iface, ssid)
 
     if scheme is None:
         # scheme doesn't exist, raise exception
@@ -354,22 +990,376 @@ def _scheme_find(iface, ssid):
     return scheme
 
 
-def _cell_find(iface, ssid):
+def warm_up():
+    """
+    import the radio libraries, parse /etc/network/interfaces and scan the wireless interfaces in the background,
+    so that the first requests after a start don't pay for them
+
+    :return: the warm-up thread
+    """
+
+    return startup.warm_up([
+        ('import_radio', lambda: [startup.load(m) for m in RADIO_MODULES]),
+        ('parse_interfaces', WRITER.all),
+        ('scan', scan_all),
+    ])
+
+
+def use_helper(path):
+    """
+    run privileged operations through the helper listening on the given unix socket, instead of sudo
+
+    :param path: unix socket path of the helper
+    :return:
+    """
+
+    global HELPER
+
+    HELPER = HelperClient(path)
+    WRITER.remote = HELPER.apply
+
+
+def _helper_call(op, **params):
+    """
+    send a request to the privileged helper
+
+    :param op: operation name
+    :param params: operation parameters
+    :return: the response as dictionary
+    """
+
+    try:
+        res = HELPER.call(op, **params)
+    except HelperError as e:
+        raise WifiException("helper {}: {}".format(op, e.message), 500)
+    except (socket.error, ValueError) as e:
+        raise WifiException("helper {}: unavailable ({})".format(op, e), 503)
+
+    if res.get("timed_out"):
+        raise WifiException("helper {}: {}".format(op, res["message"]), 504, res["output"])
+
+    return res
+
+
+def _run(args):
+    """
+    run an external command with the timeout configured for it
+
+    :param args: command and arguments
+    :return: tuple with exit code, stdout and stderr
+    """
+
+    try:
+        return command.run(args)
+    except CommandTimeout as e:
+        raise WifiException(e.message, 504, e.stderr)
+
+
+def _scan_cells(iface):
+    """
+    scan a network interface
+
+    :param iface: network interface
+    :return: list of cell objects
+    """
+
+    if HELPER is None:
+        code, output, stderr = _run(['/sbin/iwlist', iface, 'scan'])
+        output += stderr
+    else:
+        res = _helper_call('scan', iface=iface)
+        code, output = res["code"], res["output"]
+
+    if code != 0:
+        raise WifiException(output.strip(), 404, output)
+
+    return [Cell.from_string(c) for c in cells_re.split(output)[1:]]
+
+
+def _ifupdown(command, iface):
+    """
+    run ifup or ifdown on a network interface
+
+    :param command: 'ifup' or 'ifdown'
+    :param iface: network interface
+    :return: tuple with exit code and error output
+    """
+
+    if HELPER is None:
+        code, output, stderr = _run(["sudo", command, iface])
+        return code, stderr
+
+    res = _helper_call(command, iface=iface)
+    return res["code"], res["output"]
+
+
+def _activate_scheme(scheme):
+    """
+    connect to the network configured in a scheme
+
+    :param scheme: the scheme object
+    :return: the connection object
+    """
+
+    if HELPER is None:
+        # same steps as Scheme.activate, with timeouts
+        code, output, stderr = _run(['/sbin/ifdown', scheme.interface])
+        if code == 0:
+            code, output, stderr = _run(['/sbin/ifup'] + scheme.as_args())
+        output += stderr
+    else:
+        res = _helper_call('activate', iface=scheme.interface, name=scheme.name, args=scheme.as_args())
+        code, output = res["code"], res["output"]
+
+    return _activation_result(scheme, code, output)
+
+
+def _activation_result(scheme, code, output):
+    """
+    check the outcome of ifdown and ifup on a scheme
+
+    :param scheme: the scheme object
+    :param code: exit code of ifdown, or of ifup if ifdown succeeded
+    :param output: output of the commands, stderr included
+    :return: the connection object
+    """
+
+    if code != 0:
+        raise _exceptions.ConnectionError(output.strip())
+
+    return scheme.parse_ifup_output(output)
+
+
+def _scan_pool():
+    """
+    get the thread pool running interface scans, creating it on first use
+
+    :return: the thread pool
+    """
+
+    with _SCAN_POOL_LOCK:
+        if not _SCAN_POOL:
+            _SCAN_POOL.append(ThreadPool(SCAN_WORKERS))
+
+    return _SCAN_POOL[0]
+
+
+def _cell_find(iface, ssid, bssid=None, cells=None):
     """
     look up cell by network interface and ssid
 
     :param iface: network interface
     :param ssid: network name
-    :return: the first cell that matches the arguments
+    :param bssid: if set, the access point of the cell, or BSSID_BEST
+    :param cells: the scanned cell objects, the interface is scanned if None
+    :return: the best cell that matches the arguments
     """
 
-    cells = Cell.where(iface, lambda c: c.ssid.lower() == ssid.lower())
+    if cells is None:
+        cells = _scan_cells(iface)
+
+    cells = [c for c in cells if c.ssid.lower() == ssid.lower()]
+
+    if bssid and bssid != BSSID_BEST:
+        cells = [c for c in cells if c.address.lower() == bssid.lower()]
+
+    cells.sort(key=lambda c: _band_score(iface, _cell_to_dict(c)), reverse=True)
+
     # if the cell doesn't exist, cell[0] will raise an IndexError
     cell = cells[0]
 
     return cell
 
 
+def _associated(iface, ssid, bssid=None):
+    """
+    find whether an interface is connected to a network already
+
+    :param iface: network interface
+    :param ssid: network name
+    :param bssid: if set, the access point the interface must be associated with; never matches BSSID_BEST,
+        which requires a scan
+    :return: True if connected
+    """
+
+    if bssid == BSSID_BEST:
+        return False
+
+    try:
+        wifi = Wireless(iface)
+        if wifi.getEssid() != ssid:
+            return False
+        if bssid and wifi.getAPaddr().lower() != bssid.lower():
+            return False
+    except IOError:
+        # not a wireless interface
+        return False
+
+    # associated, but possibly not configured by ifup yet (e.g. while an earlier ifup waits for DHCP)
+    return _configured(iface) is not False
+
+
+def _iface_exists(iface):
+    """
+    find whether a network interface exists, configured or not
+
+    :param iface: network interface
+    :return: True if the interface exists
+    """
+
+    return os.path.isdir(os.path.join(SYS_NET, iface))
+
+
+def _configured(iface):
+    """
+    find whether ifup configured a network interface, from the state of ifupdown: the per-interface
+    ifstate.<iface> files of newer versions, or the IFSTATE file of older ones
+
+    :param iface: network interface
+    :return: True or False, or None if unknown
+    """
+
+    try:
+        with open('{}.{}'.format(IFSTATE, iface)) as f:
+            if f.read().strip():
+                return True
+    except IOError:
+        pass
+
+    state = _ifstate()
+    if state is None:
+        return None
+
+    return iface in state
+
+
+def _link_up(iface):
+    """
+    read the operational state of a network interface
+
+    :param iface: network interface
+    :return: True if the link is up, False if it is down, None if unknown
+    """
+
+    try:
+        with open(os.path.join(SYS_NET, iface, 'operstate')) as f:
+            state = f.read().strip()
+    except IOError:
+        return None
+
+    return {'up': True, 'down': False}.get(state)
+
+
+def _ifstate():
+    """
+    read the interfaces configured by ifup
+
+    :return: dictionary with the logical interface of each configured interface, or None if unknown
+    """
+
+    try:
+        with open(IFSTATE) as f:
+            entries = f.read().split()
+    except IOError:
+        return None
+
+    res = {}
+    for e in entries:
+        phys, _, logical = e.partition('=')
+        res[phys] = logical or phys
+
+    return res
+
+
+def _update_location(iface, ssid, db, lat, lng):
+    """
+    update the location of a stored network, if known
+
+    :param iface: network interface
+    :param ssid: network name
+    :param db: sqlite3 database handle
+    :param lat: latitude
+    :param lng: longitude
+    :return:
+    """
+
+    if lat == GPS_INF or lng == GPS_INF:
+        return
+
+    db.execute("UPDATE networks SET lat=?, lng=?, last_seen=? WHERE iface=? AND ssid=?;",
+               (lat, lng, time.time(), iface, ssid))
+    db.commit()
+
+
+def _band(cell):
+    """
+    find the band of a cell
+
+    :param cell: the cell as dictionary
+    :return: "5" or "2.4" (GHz)
+    """
+
+    try:
+        return "5" if float(str(cell.get("frequency")).split()[0]) >= 5 else "2.4"
+    except ValueError:
+        return "2.4"
+
+
+def _band_score(iface, cell):
+    """
+    score an access point by smoothed signal, preferring 5 GHz
+
+    :param iface: network interface
+    :param cell: the cell as dictionary
+    :return: the score, higher is better
+    """
+
+    score = smoothed_signal(iface, cell)
+
+    if _band(cell) == "5":
+        score += FIVE_GHZ_MARGIN
+
+    return score
+
+
+def _pinned(scheme, bssid):
+    """
+    copy a scheme, restricted to an access point
+
+    :param scheme: the scheme object
+    :param bssid: the access point address
+    :return: the new scheme object
+    """
+
+    wpa = any(k.startswith('wpa-') for k in scheme.options)
+    options = dict(scheme.options)
+    options['wpa-bssid' if wpa else 'wireless-ap'] = bssid
+
+    return Scheme(scheme.interface, scheme.name, options)
+
+
+def _scan_result(iface, cells):
+    """
+    sort scanned cells by signal, convert them to dictionaries and remember them as the latest scan
+
+    :param iface: network interface
+    :param cells: list of cell objects
+    :return: list of cells as json string
+    """
+
+    cells = sorted(cells, key=lambda cell: cell.signal, reverse=True)
+
+    res = []
+    for c in cells:
+        res.append(_cell_to_dict(c))
+
+    SCANS[iface] = (time.time(), res)
+    SCAN_HISTORY.add(iface, res)
+    SIGNALS.add(iface, res)
+
+    return res
+
+
 def _cell_to_dict(cell):
     """
     convert a cell object to dictionary
@@ -432,20 +1422,73 @@ def _db_to_dict(match):
     return match_dict
 
 
-def _network_in_range(iface, ssid):
+def _db_schemes(db):
+    """
+    build scheme objects from the network configurations stored in the database
+
+    :param db: sqlite3 database handle
+    :return: list of schemes
+    """
+
+    cursor = db.execute("SELECT iface, ssid, options FROM networks WHERE options IS NOT NULL;")
+
+    return [Scheme(m[0], m[1], json.loads(m[2])) for m in cursor.fetchall()]
+
+
+def _db_scheme_find(iface, ssid, db):
+    """
+    look up a scheme in the database by network interface and ssid
+
+    :param iface: network interface
+    :param ssid: network name
+    :param db: sqlite3 database handle
+    :return: the matching scheme or None
+    """
+
+    query = "SELECT iface, ssid, options FROM networks WHERE iface=? AND ssid=? AND options IS NOT NULL;"
+    match = db.execute(query, (iface, ssid)).fetchone()
+
+    if match is None:
+        return None
+
+    return Scheme(match[0], match[1], json.loads(match[2]))
+
+
+def _rank(iface, cell, history):
+    """
+    score a candidate network by smoothed signal level and connection history
+
+    :param iface: network interface
+    :param cell: the cell as dictionary
+    :param history: connection statistics of the network, or None if it never connected
+    :return: the score, higher is better
+    """
+
+    score = smoothed_signal(iface, cell)
+
+    if history:
+        score += RANK_SUCCESS_WEIGHT * (history["success_rate"] - 0.5) * 2
+        if history["median_time"] is not None:
+            score -= RANK_TIME_WEIGHT * history["median_time"]
+
+    return score
+
+
+def _network_in_range(iface, ssid, bssid=None):
     """
     find whether the given network is in range
 
     :param iface: network interface
     :param ssid: network name
+    :param bssid: if set, the access point that must be in range, or BSSID_BEST
     :return: cell object matching the arguments
     """
 
     try:
-        cell = _cell_find(iface, ssid)
+        cell = _cell_find(iface, ssid, bssid)
     except IndexError:
         raise WifiException("cell {}: not found".format(ssid), 404)
-    except InterfaceError as e:
+    except _exceptions.InterfaceError as e:
         raise WifiException(e.message, 404)
 
     return cell
@@ -462,13 +1505,27 @@ def _save_to_file(iface, ssid, cell, passkey):
     :return:
     """
 
+    scheme = _new_scheme(iface, ssid, cell, passkey)
+    WRITER.save(scheme)
+    return scheme
+
+
+def _new_scheme(iface, ssid, cell, passkey):
+    """
+    create the connection scheme for a cell
+
+    :param iface: network interface
+    :param ssid: network name
+    :param cell: cell object matching the arguments
+    :param passkey: authentication passphrase
+    :return: the scheme object
+    """
+
     # check if passkey is required
     if cell.encrypted and passkey is None:
         raise WifiException("ssid {}: passkey required".format(ssid), 400)
 
-    scheme = Scheme.for_cell(iface, ssid, cell, passkey)
-    scheme.save()
-    return scheme
+    return Scheme.for_cell(iface, ssid, cell, passkey)
 
 
 def _get_hashed_passkey(scheme, cell):
@@ -493,7 +1550,7 @@ def _get_hashed_passkey(scheme, cell):
     return passkey
 
 
-def _save_to_db(iface, ssid, passkey, db, lat, lng):
+def _save_to_db(iface, ssid, passkey, db, lat, lng, options=None):
     """
     store new network scheme in sqlite3 database, or update an existing one
 
@@ -503,6 +1560,7 @@ def _save_to_db(iface, ssid, passkey, db, lat, lng):
     :param db: sqlite3 database handle
     :param lat: latitude
     :param lng: longitude
+    :param options: scheme options, as written to /etc/network/interfaces
     :return:
     """
 
@@ -510,7 +1568,15 @@ def _save_to_db(iface, ssid, passkey, db, lat, lng):
     if lat == GPS_INF or lng == GPS_INF:
         lat, lng = get_last_location(ssid, db)
 
-    # save
-    query = "INSERT or REPLACE INTO networks(iface, ssid, passkey, lat, lng) VALUES (?, ?, ?, ?, ?);"
-    db.execute(query, (iface, ssid, passkey, lat, lng))
+    options = json.dumps(options) if options is not None else None
+    now = time.time()
+
+    # update in place, so that timestamps and connection statistics are preserved
+    query = "UPDATE networks SET passkey=?, lat=?, lng=?, options=?, last_seen=? WHERE iface=? AND ssid=?;"
+    cursor = db.execute(query, (passkey, lat, lng, options, now, iface, ssid))
+
+    if cursor.rowcount == 0:
+        query = "INSERT INTO networks(iface, ssid, passkey, lat, lng, options, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?);"
+        db.execute(query, (iface, ssid, passkey, lat, lng, options, now))
+
     db.commit()
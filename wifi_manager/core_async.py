@@ -0,0 +1,287 @@
+from core import Cell, WifiException, cells_re
+import command
+import core
+import functools
+import logging
+import os
+import signal
+import startup
+import subprocess
+import time
+import trollius as asyncio
+from trollius import From, Return
+
+logger = logging.getLogger(__name__)
+
+_exceptions = startup.LazyModule('wifi.exceptions')  # imported on first use, like in core
+
+# asyncio variant of the core API, for driving many interfaces from a single event loop
+#
+# radio operations run as asyncio subprocesses, or through the privileged helper in the default executor when
+# core.HELPER is set, and retries wait on asyncio timers, so that no call blocks the loop while a scan or a DHCP
+# negotiation is in progress; /etc/network/interfaces is updated in the executor too, while database updates
+# are short and stay in the loop thread, sqlite3 handles can't be shared between threads
+
+
+@asyncio.coroutine
+def cell_all(iface):
+    """
+    return all cells available on the given network interface, sorted by signal
+
+    :param iface: network interface
+    :return: list of cells as json string
+    """
+
+    cells = yield From(_scan(iface))
+
+    raise Return(core._scan_result(iface, cells))
+
+
+@asyncio.coroutine
+def status(iface):
+    """
+    retrieve the network the interface is connected to
+
+    :param iface: network interface
+    :return: the network ssid or the empty string
+    """
+
+    # a single ioctl, it doesn't block
+    raise Return(core.status(iface))
+
+
+@asyncio.coroutine
+def enable(iface):
+    """
+    enable a network interface
+
+    :param iface: network interface
+    :return: exit code
+    """
+
+    code, output = yield From(_ifupdown('ifup', iface))
+
+    if code != 0:
+        raise WifiException("error enabling {}".format(iface), 500, output)
+
+    raise Return(code)
+
+
+@asyncio.coroutine
+def disable(iface):
+    """
+    disconnect a network interface
+
+    :param iface: network interface
+    :return: exit code
+    """
+
+    code, output = yield From(_ifupdown('ifdown', iface))
+
+    if code != 0:
+        raise WifiException("error disabling {}".format(iface), 500, output)
+
+    raise Return(code)
+
+
+@asyncio.coroutine
+def connect(iface, ssid, passkey, db, lat=core.GPS_INF, lng=core.GPS_INF):
+    """
+    connect to a network
+
+    :param iface: network interface
+    :param ssid: network name
+    :param passkey: authentication passkey
+    :param db: sqlite3 database handle
+    :param lat: latitude
+    :param lng: longitude
+    :return:
+    """
+
+    cells = yield From(_scan(iface))
+
+    try:
+        cell = core._cell_find(iface, ssid, cells=cells)
+    except IndexError:
+        raise WifiException("cell {}: not found".format(ssid), 404)
+
+    scheme = yield From(_store(iface, ssid, cell, passkey, db, lat, lng))
+
+    start = time.time()
+    attempts = 0
+    connected = False
+    try:
+        connected, attempts, message = yield From(_activate(iface, ssid, scheme))
+
+        if not connected:
+            # failed to connect
+            raise WifiException(message, 500)
+
+        db.execute("UPDATE networks SET last_connected=? WHERE iface=? AND ssid=?;", (time.time(), iface, ssid))
+        db.commit()
+    finally:
+        core.STATS.record(db, iface, ssid, start, time.time() - start, attempts, connected, cell.signal)
+
+
+@asyncio.coroutine
+def _activate(iface, ssid, scheme):
+    """
+    activate a scheme, retrying until core.TIMEOUT
+
+    :param iface: network interface
+    :param ssid: network name
+    :param scheme: the scheme to activate
+    :return: tuple with the connection outcome, the number of attempts and the last error message
+    """
+
+    # try to connect (at least once)
+    start = time.time()
+    elapsed = 0
+    attempts = 0
+    message = None
+    while elapsed < core.TIMEOUT:
+        attempts += 1
+
+        # same steps as core._activate_scheme: a failed ifdown fails the attempt, which is retried
+        if core.HELPER is None:
+            code, output = yield From(_run('/sbin/ifdown', iface))
+            if code == 0:
+                code, output = yield From(_run('/sbin/ifup', *scheme.as_args()))
+        else:
+            code, output = yield From(_helper('activate', iface=iface, name=scheme.name, args=scheme.as_args()))
+
+        try:
+            core._activation_result(scheme, code, output)
+        except _exceptions.ConnectionError as e:
+            message = core._log_attempt_failed(iface, ssid, attempts, e)
+            yield From(enable(iface))
+            yield From(asyncio.sleep(core.RETRY_AFTER))
+            elapsed = time.time() - start
+            continue
+
+        core._log_connected(iface, ssid, start, attempts)
+        raise Return(True, attempts, None)
+
+    raise Return(False, attempts, message)
+
+
+@asyncio.coroutine
+def _scan(iface):
+    """
+    scan a network interface with iwlist
+
+    :param iface: network interface
+    :return: list of cell objects
+    """
+
+    if core.HELPER is None:
+        code, output = yield From(_run('/sbin/iwlist', iface, 'scan'))
+    else:
+        code, output = yield From(_helper('scan', iface=iface))
+
+    if code != 0:
+        raise WifiException(output.strip(), 404, output)
+
+    raise Return([Cell.from_string(c) for c in cells_re.split(output)[1:]])
+
+
+@asyncio.coroutine
+def _store(iface, ssid, cell, passkey, db, lat, lng):
+    """
+    store the network scheme of a cell in range, like core._store
+
+    :param iface: network interface
+    :param ssid: network name
+    :param cell: cell object matching the arguments
+    :param passkey: authentication passphrase
+    :param db: sqlite3 database handle
+    :param lat: latitude
+    :param lng: longitude
+    :return: the scheme
+    """
+
+    loop = asyncio.get_event_loop()
+
+    if core.STORE == core.STORE_DB:
+        scheme = core._db_scheme_find(iface, ssid, db)
+        if not scheme:
+            scheme = core._new_scheme(iface, ssid, cell, passkey)
+
+        core._save_to_db(iface, ssid, core._get_hashed_passkey(scheme, cell), db, lat, lng, scheme.options)
+        yield From(loop.run_in_executor(None, core.WRITER.sync, core._db_schemes(db)))
+
+        raise Return(scheme)
+
+    scheme = yield From(loop.run_in_executor(None, core.WRITER.find, iface, ssid))
+
+    # save scheme to file only if it does not exists
+    if not scheme:
+        scheme = core._new_scheme(iface, ssid, cell, passkey)
+        yield From(loop.run_in_executor(None, core.WRITER.save, scheme))
+
+    core._save_to_db(iface, ssid, core._get_hashed_passkey(scheme, cell), db, lat, lng, scheme.options)
+
+    raise Return(scheme)
+
+
+@asyncio.coroutine
+def _ifupdown(command, iface):
+    """
+    run ifup or ifdown on a network interface
+
+    :param command: 'ifup' or 'ifdown'
+    :param iface: network interface
+    :return: tuple with the exit code and the output
+    """
+
+    if core.HELPER is None:
+        res = yield From(_run("sudo", command, iface))
+    else:
+        res = yield From(_helper(command, iface=iface))
+
+    raise Return(res)
+
+
+@asyncio.coroutine
+def _helper(op, **params):
+    """
+    send a request to the privileged helper, in the default executor since the helper connections block
+
+    :param op: operation name
+    :param params: operation parameters
+    :return: tuple with the exit code and the output
+    """
+
+    loop = asyncio.get_event_loop()
+    res = yield From(loop.run_in_executor(None, functools.partial(core._helper_call, op, **params)))
+
+    raise Return(res["code"], res["output"])
+
+
+@asyncio.coroutine
+def _run(*args):
+    """
+    run a command without blocking the event loop
+
+    :param args: command and arguments
+    :return: tuple with the exit code and the output, stderr included
+    """
+
+    name = command.command_name(args)
+    timeout = command.TIMEOUTS.get(name, command.DEFAULT_TIMEOUT)
+    command.record(name)
+
+    process = yield From(asyncio.create_subprocess_exec(*args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                                        preexec_fn=os.setsid))
+    try:
+        output, _ = yield From(asyncio.wait_for(process.communicate(), timeout))
+    except asyncio.TimeoutError:
+        command.record(name, timed_out=True)
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        yield From(process.wait())
+        raise WifiException("{}: timed out after {} seconds".format(name, timeout), 504)
+
+    raise Return(process.returncode, output.decode('utf-8'))
@@ -0,0 +1,53 @@
+try:
+    import msgpack
+except ImportError:
+    # optional: without it, responses are always JSON
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+_MSGPACK_TYPES = (MSGPACK, 'application/x-msgpack')
+
+
+def negotiate(accept):
+    """
+    choose the response encoding from the Accept header
+
+    :param accept: accepted mimetypes, as werkzeug MIMEAccept
+    :return: JSON or MSGPACK
+    """
+
+    if msgpack is None:
+        return JSON
+
+    best = accept.best_match((JSON,) + _MSGPACK_TYPES, default=JSON)
+
+    return MSGPACK if best in _MSGPACK_TYPES else JSON
+
+
+def encode(obj, mimetype):
+    """
+    encode a response body
+
+    :param obj: the response as dictionary
+    :param mimetype: JSON or MSGPACK
+    :return: the encoded response
+    """
+
+    if mimetype == MSGPACK:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    raise ValueError("unsupported encoding {}".format(mimetype))
+
+
+def columns(rows):
+    """
+    convert a list of dictionaries to columnar layout, with field names sent once
+
+    :param rows: list of dictionaries
+    :return: dictionary with the sorted field names and the list of rows as lists of values
+    """
+
+    names = sorted(set(name for row in rows for name in row))
+
+    return {"columns": names, "rows": [[row.get(name) for name in names] for row in rows]}
@@ -0,0 +1,267 @@
+from connections import IdlePool
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+import httplib
+import json
+import logs
+import socket
+import threading
+import time
+import urlparse
+
+DEVICE_TIMEOUT = 10  # seconds a device has to answer a fanned out request
+FANOUT_WORKERS = 16  # devices called at the same time
+MAX_IDLE = 4  # idle keep-alive connections kept per device
+
+
+class DeviceClient(object):
+    """
+    send requests to a downstream instance, keeping connections open between requests
+    """
+
+    def __init__(self, url, api_key, timeout=DEVICE_TIMEOUT):
+        parsed = urlparse.urlparse(url)
+
+        self.url = url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.netloc = parsed.netloc
+        self.prefix = parsed.path.rstrip('/')
+        self.https = parsed.scheme == 'https'
+
+        self._pool = IdlePool(self._connect, MAX_IDLE)
+
+    def request(self, method, path, body=None, content_type=None, request_id=None):
+        """
+        send a request
+
+        :param method: HTTP method
+        :param path: path and query string, relative to the instance url
+        :param body: request body
+        :param content_type: content type of the body
+        :param request_id: correlation id, passed on to the instance
+        :return: tuple with the status code, the content type and the response body
+        """
+
+        headers = {'X-Api-Key': self.api_key}
+        if content_type:
+            headers['Content-Type'] = content_type
+        if request_id:
+            headers['X-Request-Id'] = request_id
+
+        conn, (resp, data) = self._pool.exchange(lambda c: self._exchange(c, method, path, body, headers),
+                                                 (httplib.HTTPException, socket.error))
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self._pool.release(conn)
+
+        return resp.status, resp.getheader('content-type', ''), data
+
+    def close(self):
+        """
+        close idle connections
+
+        :return:
+        """
+
+        self._pool.close()
+
+    def _exchange(self, conn, method, path, body, headers):
+        conn.request(method, self.prefix + path, body, headers)
+        resp = conn.getresponse()
+
+        return resp, resp.read()
+
+    def _connect(self):
+        if self.https:
+            return httplib.HTTPSConnection(self.netloc, timeout=self.timeout)
+
+        return httplib.HTTPConnection(self.netloc, timeout=self.timeout)
+
+
+class Gateway(object):
+    """
+    fan requests out to registered downstream instances in parallel, and aggregate their responses
+    """
+
+    def __init__(self, timeout=DEVICE_TIMEOUT, workers=FANOUT_WORKERS):
+        self.timeout = timeout
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._pool = None
+
+    def fanout(self, devices, method, path, body=None, content_type=None, timeout=None):
+        """
+        send the same request to several instances
+
+        :param devices: list of devices as dictionaries with name, url and api_key
+        :param method: HTTP method
+        :param path: path and query string
+        :param body: request body
+        :param content_type: content type of the body
+        :param timeout: seconds each device has to answer, by default self.timeout
+        :return: dictionary with the result of each device by name ("code", "message", "elapsed" in ms), and the
+            number of devices that "succeeded" (code 2xx) and "failed"
+        """
+
+        if timeout is None:
+            timeout = self.timeout
+
+        pool = self._get_pool()
+        rid = logs.request_id()
+        pending = []
+        for d in devices:
+            client = self._client(d, timeout)
+            job = _Job()
+            args = (job, client, method, path, body, content_type, rid)
+            pending.append((d["name"], job, pool.apply_async(_call, args)))
+
+        # each device has timeout seconds from the start of its request; with more devices than workers, requests
+        # wait for a free worker first, at most for as many rounds of timeout as there are devices per worker
+        start_by = time.time() + timeout * (len(devices) // self.workers + 1)
+        results = {}
+        for name, job, res in pending:
+            try:
+                if not job.started.wait(max(0, start_by - time.time())):
+                    raise TimeoutError()
+                results[name] = res.get(max(0, job.start + timeout - time.time()))
+            except TimeoutError:
+                results[name] = {"code": 504, "message": "{}: timed out after {} seconds".format(name, timeout)}
+
+        succeeded = sum(1 for r in results.values() if 200 <= r["code"] < 300)
+
+        return {"results": results, "succeeded": succeeded, "failed": len(results) - succeeded}
+
+    def forget(self, name):
+        """
+        close the connections to a device
+
+        :param name: device name
+        :return:
+        """
+
+        with self._lock:
+            client = self._clients.pop(name, None)
+
+        if client is not None:
+            client.close()
+
+    def _client(self, device, timeout):
+        with self._lock:
+            client = self._clients.get(device["name"])
+            if client is None or (client.url, client.api_key, client.timeout) != \
+                    (device["url"], device["api_key"], timeout):
+                if client is not None:
+                    client.close()
+                client = self._clients[device["name"]] = DeviceClient(device["url"], device["api_key"], timeout)
+
+            return client
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+
+            return self._pool
+
+
+class _Job(object):
+    """
+    a request sent to one device, with the time it started
+    """
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.start = None
+
+
+def device_all(db, names=None):
+    """
+    list the registered downstream instances
+
+    :param db: sqlite3 database handle
+    :param names: if set, only these devices
+    :return: list of devices as dictionaries with name, url and api_key
+    """
+
+    cursor = db.execute("SELECT name, url, api_key FROM devices ORDER BY name;")
+    devices = [{"name": m[0], "url": m[1], "api_key": m[2]} for m in cursor.fetchall()]
+
+    if names is not None:
+        devices = [d for d in devices if d["name"] in names]
+
+    return devices
+
+
+def device_save(db, name, url, api_key):
+    """
+    register a downstream instance, or update it
+
+    :param db: sqlite3 database handle
+    :param name: device name
+    :param url: base url of the instance, e.g. http://10.0.0.2:5000
+    :param api_key: api key of the instance
+    :return:
+    """
+
+    db.execute("INSERT OR REPLACE INTO devices(name, url, api_key) VALUES (?, ?, ?);", (name, url, api_key))
+    db.commit()
+
+
+def device_delete(db, name):
+    """
+    unregister a downstream instance
+
+    :param db: sqlite3 database handle
+    :param name: device name
+    :return: True if the device was registered
+    """
+
+    cursor = db.execute("DELETE FROM devices WHERE name=?;", (name,))
+    db.commit()
+
+    return cursor.rowcount > 0
+
+
+def _call(job, client, method, path, body, content_type, rid):
+    """
+    send a request to a device and decode its response
+
+    :param job: the _Job, marked as started
+    :param client: the DeviceClient
+    :param method: HTTP method
+    :param path: path and query string
+    :param body: request body
+    :param content_type: content type of the body
+    :param rid: correlation id of the request
+    :return: dictionary with the code, the decoded response and the elapsed time in ms; the code is the one of
+        the JSON response, since the API reports errors with HTTP status 200, otherwise the HTTP status
+    """
+
+    start = job.start = time.time()
+    job.started.set()
+    try:
+        status, resp_type, data = client.request(method, path, body, content_type, rid)
+    except (httplib.HTTPException, socket.error) as e:
+        return {"code": 502, "message": str(e) or e.__class__.__name__,
+                "elapsed": round((time.time() - start) * 1000, 1)}
+
+    code = status
+    try:
+        if resp_type.startswith('application/json'):
+            resp = json.loads(data)
+            message = resp.get("message")
+            if isinstance(resp.get("code"), int):
+                code = resp["code"]
+        elif resp_type.startswith('application/x-ndjson'):
+            message = [json.loads(line) for line in data.splitlines() if line.strip()]
+        else:
+            message = data.decode('utf-8', 'replace')
+    except (ValueError, AttributeError):
+        message = data.decode('utf-8', 'replace')
+
+    return {"code": code, "message": message, "elapsed": round((time.time() - start) * 1000, 1)}
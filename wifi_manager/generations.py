@@ -0,0 +1,101 @@
+from collections import deque
+import threading
+import time
+
+HISTORY = 16  # scans kept per interface
+SIGNAL_THRESHOLD = 5  # dBm, smaller signal changes are not reported
+
+# fields compared to find changed cells, besides the signal
+_FIELDS = ('ssid', 'frequency', 'channel', 'encrypted', 'encryption_type', 'mode', 'bitrates')
+
+
+class ScanHistory(object):
+    """
+    number the scans of each interface and compute what changed between two of them
+
+    Generations increase across all interfaces and start from the current time in milliseconds, so that the
+    generations of a previous run of the service are not mistaken for recent ones.
+    """
+
+    def __init__(self, size=HISTORY, threshold=SIGNAL_THRESHOLD):
+        self.size = size
+        self.threshold = threshold
+
+        self._lock = threading.Lock()
+        self._generation = int(time.time() * 1000)
+        self._scans = {}
+
+    def add(self, iface, cells):
+        """
+        record a scan
+
+        :param iface: network interface
+        :param cells: list of cells as dictionaries
+        :return: the generation of the scan
+        """
+
+        by_address = dict((c['address'], c) for c in cells)
+
+        with self._lock:
+            self._generation += 1
+            scans = self._scans.setdefault(iface, deque(maxlen=self.size))
+            scans.append((self._generation, by_address))
+
+            return self._generation
+
+    def delta(self, iface, since, threshold=None):
+        """
+        compare the latest scan of an interface with an earlier one
+
+        :param iface: network interface
+        :param since: generation of the earlier scan, as returned by add
+        :param threshold: signal change in dBm above which a cell is reported as changed, by default self.threshold
+        :return: dictionary with the latest generation, the added and changed cells, and the addresses of the
+            removed cells; if the earlier scan is no longer known, all cells are reported as added and "full" is set
+        """
+
+        if threshold is None:
+            threshold = self.threshold
+
+        with self._lock:
+            scans = self._scans.get(iface)
+            if not scans:
+                return {"generation": 0, "full": True, "added": [], "changed": [], "removed": []}
+
+            generation, current = scans[-1]
+            previous = None
+            for g, cells in scans:
+                if g == since:
+                    previous = cells
+                    break
+
+        if previous is None:
+            return {"generation": generation, "full": True, "added": _sorted(current.values()), "changed": [],
+                    "removed": []}
+
+        added = [c for a, c in current.items() if a not in previous]
+        removed = [a for a in previous if a not in current]
+        changed = [c for a, c in current.items() if a in previous and _changed(previous[a], c, threshold)]
+
+        return {"generation": generation, "full": False, "added": _sorted(added), "changed": _sorted(changed),
+                "removed": sorted(removed)}
+
+
+def _changed(old, new, threshold):
+    """
+    whether a cell changed materially between two scans
+
+    :param old: the cell in the earlier scan
+    :param new: the cell in the latest scan
+    :param threshold: signal change in dBm above which the cell changed
+    :return: True if the cell changed
+    """
+
+    if abs(new['signal'] - old['signal']) >= threshold:
+        return True
+
+    return any(old.get(f) != new.get(f) for f in _FIELDS)
+
+
+def _sorted(cells):
+    return sorted(cells, key=lambda cell: cell['signal'], reverse=True)
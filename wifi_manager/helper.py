@@ -0,0 +1,312 @@
+from __future__ import print_function
+from command import CommandTimeout
+from connections import IdlePool
+from writer import IFACE_RE, Stanza, atomic_write, check_scheme, edit
+import command
+import SocketServer
+import argparse
+import grp
+import json
+import os
+import socket
+import threading
+
+SOCKET_PATH = '/var/run/wifi-manager.sock'
+INTERFACES = '/etc/network/interfaces'
+IFUP = '/sbin/ifup'
+IFDOWN = '/sbin/ifdown'
+IWLIST = '/sbin/iwlist'
+MAX_IDLE = 4  # idle connections kept open by a client
+
+
+class HelperError(Exception):
+    def __init__(self, message):
+        super(HelperError, self).__init__(message)
+        self.message = message
+
+
+class HelperServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    long-lived privileged process running radio and configuration operations for the service
+
+    Clients send one JSON object per line, {"op": <operation>, ...}, and receive one JSON object per line,
+    {"code": <exit code>, "output": <stdout and stderr>} or {"error": <message>}; commands that exceed their
+    timeout are killed and reported with "timed_out" and "message". Connections stay open across requests.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path=SOCKET_PATH, interfaces=INTERFACES, group=None, mode=0o660):
+        if os.path.exists(path):
+            os.unlink(path)
+
+        SocketServer.UnixStreamServer.__init__(self, path, _HelperHandler)
+
+        self.path = path
+        self.interfaces = interfaces
+        self._write_lock = threading.Lock()
+
+        os.chmod(path, mode)
+        if group is not None:
+            os.chown(path, -1, grp.getgrnam(group).gr_gid)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def dispatch(self, request):
+        """
+        run a request
+
+        :param request: the request as dictionary
+        :return: the response as dictionary
+        """
+
+        op = request.get('op')
+
+        if op == 'ping':
+            return {"code": 0, "output": ''}
+
+        if op in ('ifup', 'ifdown', 'scan'):
+            iface = _check_iface(request.get('iface'))
+            if op == 'scan':
+                return _run([IWLIST, iface, 'scan'])
+            return _run([IFUP if op == 'ifup' else IFDOWN, iface])
+
+        if op == 'activate':
+            iface = _check_iface(request.get('iface'))
+            args = _check_ifup_args(iface, request.get('name'), request.get('args'))
+
+            # same steps as Scheme.activate
+            res = _run([IFDOWN, iface])
+            if res["code"] != 0:
+                return res
+
+            return _run([IFUP] + args)
+
+        if op == 'apply':
+            # the file is rendered here from validated schemes, never taken as is from the client
+            edits = _check_edits(request.get('edits'))
+
+            with self._write_lock:
+                try:
+                    with open(self.interfaces, 'r') as f:
+                        content = f.read()
+                except IOError:
+                    content = ''
+
+                new_content = edit(content, edits)
+                if new_content != content:
+                    atomic_write(self.interfaces, new_content)
+
+            return {"code": 0, "output": ''}
+
+        raise HelperError("unknown operation {}".format(op))
+
+
+class _HelperHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise HelperError("request must be an object")
+                response = self.server.dispatch(request)
+            except ValueError:
+                response = {"error": "malformed request"}
+            except (HelperError, OSError, IOError) as e:
+                response = {"error": str(e)}
+
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+
+class HelperClient(object):
+    """
+    talk to the privileged helper over its unix socket, keeping connections open between requests
+    """
+
+    def __init__(self, path=SOCKET_PATH, timeout=None):
+        self.path = path
+        self.timeout = timeout
+        self._pool = IdlePool(self._connect, MAX_IDLE)
+
+    def call(self, op, **params):
+        """
+        send a request to the helper and wait for the response
+
+        :param op: operation name
+        :param params: operation parameters
+        :return: the response as dictionary
+        """
+
+        params['op'] = op
+        request = json.dumps(params) + '\n'
+
+        conn, line = self._pool.exchange(lambda c: self._exchange(c, request), socket.error)
+        self._pool.release(conn)
+
+        response = json.loads(line)
+        if 'error' in response:
+            raise HelperError(response['error'])
+
+        return response
+
+    def apply(self, ops):
+        """
+        edit /etc/network/interfaces, as writer.InterfacesWriter.remote
+
+        :param ops: list of ('save', scheme) or ('delete', (iface, ssid)) tuples
+        :return:
+        """
+
+        edits = []
+        for op, arg in ops:
+            if op == 'save':
+                edits.append({"op": op, "iface": arg.interface, "ssid": arg.name, "options": arg.options})
+            else:
+                edits.append({"op": op, "iface": arg[0], "ssid": arg[1]})
+
+        self.call('apply', edits=edits)
+
+    def close(self):
+        """
+        close idle connections
+
+        :return:
+        """
+
+        self._pool.close()
+
+    def _exchange(self, conn, request):
+        conn.sendall(request)
+
+        data = []
+        while True:
+            chunk = conn.recv(4096)
+            if not chunk:
+                raise socket.error("helper closed the connection")
+            data.append(chunk)
+            if chunk.endswith('\n'):
+                return ''.join(data)
+
+    def _connect(self):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.settimeout(self.timeout)
+        conn.connect(self.path)
+        return conn
+
+
+def _check_iface(iface):
+    """
+    validate a network interface name: the helper runs as root, it only accepts the plain names of writer.IFACE_RE
+
+    :param iface: network interface
+    :return: the network interface
+    """
+
+    if not isinstance(iface, basestring) or not IFACE_RE.match(iface):
+        raise HelperError("invalid interface {}".format(iface))
+
+    return str(iface)
+
+
+def _check_ifup_args(iface, name, args):
+    """
+    validate the ifup arguments of a scheme: <iface>=<iface>-<name>, then -o <option>=<value> pairs
+
+    :param iface: network interface
+    :param name: scheme name
+    :param args: the arguments, as returned by Scheme.as_args
+    :return: the arguments
+    """
+
+    if not isinstance(args, list) or not args or not all(isinstance(a, basestring) for a in args):
+        raise HelperError("activate: missing ifup arguments")
+
+    if len(args) % 2 != 1:
+        raise HelperError("activate: invalid ifup arguments")
+
+    options = {}
+    for flag, option in zip(args[1::2], args[2::2]):
+        if flag != '-o' or '=' not in option:
+            raise HelperError("activate: invalid ifup argument {} {}".format(flag, option))
+        key, value = option.split('=', 1)
+        options[key] = value
+
+    try:
+        check_scheme(iface, name, options)
+    except ValueError as e:
+        raise HelperError("activate: {}".format(e))
+
+    if args[0] != "%s=%s-%s" % (iface, iface, name):
+        raise HelperError("activate: invalid ifup argument {}".format(args[0]))
+
+    return [a.encode('utf-8') for a in args]
+
+
+def _check_edits(edits):
+    """
+    validate edits of /etc/network/interfaces
+
+    :param edits: list of {"op": "save", "iface": ..., "ssid": ..., "options": {...}} or
+        {"op": "delete", "iface": ..., "ssid": ...}
+    :return: list of edits for writer.edit
+    """
+
+    if not isinstance(edits, list):
+        raise HelperError("apply: missing edits")
+
+    res = []
+    for e in edits:
+        if not isinstance(e, dict) or e.get('op') not in ('save', 'delete'):
+            raise HelperError("apply: op must be save or delete")
+
+        options = e.get('options') if e['op'] == 'save' else {}
+        try:
+            check_scheme(e.get('iface'), e.get('ssid'), options)
+        except ValueError as error:
+            raise HelperError("apply: {}".format(error))
+
+        iface, ssid = e['iface'].encode('utf-8'), e['ssid'].encode('utf-8')
+        if e['op'] == 'save':
+            options = dict((k.encode('utf-8'), v.encode('utf-8')) for k, v in options.items())
+            res.append(('save', Stanza(iface, ssid, options)))
+        else:
+            res.append(('delete', (iface, ssid)))
+
+    return res
+
+
+def _run(args):
+    """
+    run a command, capturing its output
+
+    :param args: command and arguments
+    :return: dictionary with the exit code and the output, stderr included
+    """
+
+    try:
+        code, output, stderr = command.run(args)
+    except CommandTimeout as e:
+        return {"code": None, "output": e.output + e.stderr, "timed_out": True, "message": e.message}
+
+    return {"code": code, "output": output + stderr}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='privileged helper of the wifi connectivity manager')
+    parser.add_argument('--socket', default=SOCKET_PATH, help='unix socket path')
+    parser.add_argument('--interfaces', default=INTERFACES, help='network interfaces file')
+    parser.add_argument('--group', default=None, help='group allowed to use the socket')
+    args = parser.parse_args()
+
+    server = HelperServer(args.socket, args.interfaces, args.group)
+    print('helper listening on {}'.format(args.socket))
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,4 @@
+#!/bin/bash
+
+cd $(dirname $0)/../..
+sudo python wifi_manager/helper.py "$@"
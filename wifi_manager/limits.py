@@ -0,0 +1,153 @@
+import math
+import threading
+import time
+
+# admission control of expensive endpoints, by pool:
+# - concurrency: requests of the pool running at the same time
+# - queue_timeout: seconds a request waits for a free slot before being rejected
+# - rate, burst: token bucket per (api key, interface), in requests per second
+POOLS = {
+    'scan': {"concurrency": 2, "queue_timeout": 1.0, "rate": 0.5, "burst": 3},
+    'radio': {"concurrency": 1, "queue_timeout": 2.0, "rate": 0.2, "burst": 2}
+}
+MAX_BUCKETS = 1024
+
+
+class Rejected(Exception):
+    def __init__(self, message, retry_after):
+        super(Rejected, self).__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class TokenBucket(object):
+    """
+    allow `rate` requests per second on average, and bursts of up to `burst` requests
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.time()
+
+    def take(self):
+        """
+        take a token if one is available
+
+        :return: 0 if a token was taken, otherwise the number of seconds until the next token
+        """
+
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+
+class Pool(object):
+    """
+    admission control of a group of endpoints: a concurrency limit shared by all clients, and a rate limit
+    per key
+    """
+
+    def __init__(self, name, concurrency, queue_timeout, rate, burst):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_timeout = queue_timeout
+        self.rate = rate
+        self.burst = burst
+
+        self._cond = threading.Condition()
+        self._running = 0
+        self._buckets = {}
+
+    def acquire(self, key):
+        """
+        admit a request, or raise Rejected
+
+        :param key: rate limiting key, e.g. api key and interface; None for the service's own operations (e.g. those
+            of a supervisor), which share the concurrency limit but are not rate limited
+        :return:
+        """
+
+        with self._cond:
+            bucket = None
+            if key is not None:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    if len(self._buckets) >= MAX_BUCKETS:
+                        self._evict()
+                    bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+
+                wait = bucket.take()
+                if wait:
+                    raise Rejected("{}: rate limit exceeded".format(self.name), wait)
+
+            deadline = time.time() + self.queue_timeout
+            while self._running >= self.concurrency:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    # the request didn't run, give its token back
+                    if bucket is not None:
+                        bucket.tokens = min(bucket.burst, bucket.tokens + 1)
+                    raise Rejected("{}: too many concurrent requests".format(self.name), 1)
+                self._cond.wait(remaining)
+
+            self._running += 1
+
+    def release(self):
+        """
+        release the slot of an admitted request
+
+        :return:
+        """
+
+        with self._cond:
+            self._running -= 1
+            self._cond.notify()
+
+    def _evict(self):
+        """
+        forget the buckets that are full again, as they behave like new ones
+
+        :return:
+        """
+
+        now = time.time()
+        for key, bucket in list(self._buckets.items()):
+            if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.burst:
+                del self._buckets[key]
+
+        if len(self._buckets) >= MAX_BUCKETS:
+            self._buckets.clear()
+
+
+def pools(config=None):
+    """
+    create the admission pools
+
+    :param config: dictionary of pool settings by name, overriding POOLS
+    :return: dictionary of pools by name
+    """
+
+    settings = dict(POOLS)
+    for name, s in (config or {}).items():
+        settings[name] = dict(POOLS.get(name, {}), **s)
+
+    return dict((name, Pool(name, **s)) for name, s in settings.items())
+
+
+def retry_after(seconds):
+    """
+    format a Retry-After header value
+
+    :param seconds: seconds to wait
+    :return: whole number of seconds, at least 1
+    """
+
+    return str(max(1, int(math.ceil(seconds))))
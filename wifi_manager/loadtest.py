@@ -0,0 +1,439 @@
+from __future__ import print_function
+from binascii import hexlify
+from rest import app, init_db
+from writer import InterfacesWriter
+import argparse
+import command
+import core
+import httplib
+import json
+import logging
+import logs
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import urlparse
+
+# routes that can be part of the request mix, as (method, path); {iface} and {ssid} are replaced by the
+# interface and network under test
+ROUTES = {
+    'networks': ('GET', '/networks'),
+    'ifaces': ('GET', '/ifaces'),
+    'status': ('GET', '/status/{iface}'),
+    'scan': ('GET', '/scan/{iface}'),
+    'scan_all': ('GET', '/scan'),
+    'delta': ('GET', '/scan/{iface}/delta?since=0'),
+    'available': ('GET', '/available/{iface}'),
+    'stats': ('GET', '/stats'),
+    'location': ('GET', '/location/{ssid}'),
+    'enable': ('POST', '/enable/{iface}'),
+    'connect': ('POST', '/connect/{iface}:{ssid}:-1000.0:-1000.0'),
+}
+DEFAULT_MIX = 'networks=2,status=4,scan=1,available=1,stats=1,location=1'
+PERCENTILES = (50, 95, 99)
+
+
+class SimulatedRadio(object):
+    """
+    stand-in for iwlist, ifup, ifdown and the wireless extensions, so that the whole service runs on any machine
+
+    Scans return `cells` access points whose signal varies between scans, and connections always succeed.
+    """
+
+    def __init__(self, ifaces, cells=20, scan_latency=0.05, connect_latency=0.2, ifstate=None):
+        self.ifaces = list(ifaces)
+        self.cells = cells
+        self.scan_latency = scan_latency
+        self.connect_latency = connect_latency
+        self.ifstate = ifstate
+
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+        self._associated = {}
+        self._configured = set()
+        self._write_ifstate()
+
+    def install(self):
+        """
+        route the radio operations of core to the simulation
+
+        :return:
+        """
+
+        core._run = self.run
+        core.Wireless = self.wireless
+        core.wireless_interfaces = lambda: list(self.ifaces)
+        if self.ifstate is not None:
+            core.IFSTATE = self.ifstate
+
+    def run(self, args):
+        """
+        simulate an external command, with the same signature as core._run
+
+        :param args: command and arguments
+        :return: tuple with exit code, stdout and stderr
+        """
+
+        name = command.command_name(args)
+        command.record(name)
+
+        if args[0] == 'sudo':
+            args = args[1:]
+        iface = args[1].split('=')[0] if len(args) > 1 else None
+
+        if iface not in self.ifaces:
+            return 1, '', '{}: no such interface\n'.format(iface)
+
+        if name == 'iwlist':
+            time.sleep(self.scan_latency)
+            return 0, self._scan(iface), ''
+
+        if name == 'ifdown':
+            with self._lock:
+                self._associated.pop(iface, None)
+                self._configured.discard(iface)
+                self._write_ifstate()
+            return 0, '', ''
+
+        if name == 'ifup':
+            options = dict(o.split('=', 1) for o in args[2:] if o != '-o')
+            ssid = options.get('wpa-ssid', options.get('wireless-essid'))
+            if ssid is not None:
+                time.sleep(self.connect_latency)
+            with self._lock:
+                if ssid is not None:
+                    self._associated[iface] = ssid.strip('"')
+                self._configured.add(iface)
+                self._write_ifstate()
+            return 0, 'bound to 10.0.{}.2 -- renewal in 300 seconds.\n'.format(self.ifaces.index(iface)), ''
+
+        return 1, '', '{}: not simulated\n'.format(name)
+
+    def wireless(self, iface):
+        """
+        simulate pythonwifi.iwlibs.Wireless
+
+        :param iface: network interface
+        :return: object with getEssid and getAPaddr
+        """
+
+        if iface not in self.ifaces:
+            raise IOError(19, 'No such device')
+
+        radio = self
+
+        class _Wireless(object):
+            def getEssid(self):
+                return radio._associated.get(iface, '')
+
+            def getAPaddr(self):
+                ssid = radio._associated.get(iface)
+                return _address(int(ssid.split('-')[-1])) if ssid else '00:00:00:00:00:00'
+
+        return _Wireless()
+
+    def _scan(self, iface):
+        with self._lock:
+            jitter = [self._random.randint(-3, 3) for _ in range(self.cells)]
+
+        lines = ['{}     Scan completed :'.format(iface)]
+        for i in range(self.cells):
+            signal = -40 - 2 * i + jitter[i]
+            channel, frequency = (36, '5.18') if i % 2 else (6, '2.437')
+            lines += [
+                '          Cell {:02d} - Address: {}'.format(i + 1, _address(i)),
+                '                    Channel:{}'.format(channel),
+                '                    Frequency:{} GHz (Channel {})'.format(frequency, channel),
+                '                    Quality={}/70  Signal level={} dBm'.format(max(0, 110 + signal), signal),
+                '                    Encryption key:off',
+                '                    ESSID:"sim-{}"'.format(i),
+                '                    Bit Rates:6 Mb/s; 9 Mb/s; 12 Mb/s; 18 Mb/s; 24 Mb/s',
+                '                    Mode:Master',
+            ]
+
+        return '\n'.join(lines) + '\n'
+
+    def _write_ifstate(self):
+        if self.ifstate is None:
+            return
+
+        with open(self.ifstate, 'w') as f:
+            f.write(''.join('{0}={0}\n'.format(iface) for iface in sorted(self._configured)))
+
+
+class InProcessClient(object):
+    """
+    send requests to the WSGI app in the calling thread, without a network round-trip
+    """
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.client = app.test_client()
+
+    def request(self, method, path):
+        resp = self.client.open(path, method=method, headers={'X-Api-Key': self.api_key})
+        resp.get_data()
+        resp.close()
+        return resp.status_code
+
+
+class HttpClient(object):
+    """
+    send requests to a running service, keeping the connection open when the server allows it
+    """
+
+    def __init__(self, url, api_key, timeout=60):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.prefix = urlparse.urlparse(url).path.rstrip('/')
+        self.netloc = urlparse.urlparse(url).netloc
+        self.conn = None
+
+    def request(self, method, path):
+        if self.conn is None:
+            self.conn = httplib.HTTPConnection(self.netloc, timeout=self.timeout)
+
+        try:
+            self.conn.request(method, self.prefix + path, headers={'X-Api-Key': self.api_key})
+            resp = self.conn.getresponse()
+            resp.read()
+        except Exception:
+            self.conn.close()
+            self.conn = None
+            raise
+
+        if resp.getheader('connection', '').lower() == 'close' or resp.version < 11:
+            self.conn.close()
+            self.conn = None
+
+        return resp.status
+
+
+def parse_mix(mix):
+    """
+    parse a request mix, e.g. "status=4,scan=1"
+
+    :param mix: comma separated route names with optional integer weights
+    :return: list of (route name, weight) tuples
+    """
+
+    res = []
+    for entry in mix.split(','):
+        name, _, weight = entry.strip().partition('=')
+        if name not in ROUTES:
+            raise ValueError("unknown route {}, expected one of {}".format(name, ', '.join(sorted(ROUTES))))
+        res.append((name, int(weight or 1)))
+
+    return res
+
+
+def run(client_factory, mix, concurrency, duration, iface, ssid, seed=None):
+    """
+    send requests from several threads for a given time
+
+    :param client_factory: function returning a new client, called once per thread
+    :param mix: list of (route name, weight) tuples
+    :param concurrency: number of threads
+    :param duration: seconds
+    :param iface: network interface used in the paths
+    :param ssid: network name used in the paths
+    :param seed: random seed of the request mix
+    :return: tuple with the list of (route name, status or None, latency in seconds) of each thread, and the
+        elapsed time
+    """
+
+    names = [name for name, weight in mix for _ in range(weight)]
+    results = [[] for _ in range(concurrency)]
+    start = time.time()
+    deadline = start + duration
+
+    def worker(i):
+        client = client_factory()
+        rnd = random.Random(None if seed is None else seed + i)
+        out = results[i]
+
+        while time.time() < deadline:
+            name = rnd.choice(names)
+            method, path = ROUTES[name]
+
+            t = time.time()
+            try:
+                status = client.request(method, path.format(iface=iface, ssid=ssid))
+            except Exception:
+                status = None
+            out.append((name, status, time.time() - t))
+
+    threads = [threading.Thread(target=worker, args=(i,), name='load-{}'.format(i)) for i in range(concurrency)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+
+    return results, time.time() - start
+
+
+def percentile(values, p):
+    """
+    nearest-rank percentile
+
+    :param values: sorted list of values
+    :param p: percentile, between 0 and 100
+    :return: the percentile, None if there are no values
+    """
+
+    if not values:
+        return None
+
+    return values[max(0, int(-(-len(values) * p // 100)) - 1)]
+
+
+def summarize(results, elapsed):
+    """
+    compute throughput and latency percentiles per route and overall
+
+    :param results: results of each thread, as returned by run
+    :param elapsed: elapsed time, in seconds
+    :return: dictionary keyed by route name, and "all"
+    """
+
+    by_route = {}
+    for out in results:
+        for name, status, latency in out:
+            by_route.setdefault(name, []).append((status, latency))
+            by_route.setdefault('all', []).append((status, latency))
+
+    res = {}
+    for name, samples in by_route.items():
+        latencies = sorted(latency for _, latency in samples)
+        codes = {}
+        for status, _ in samples:
+            codes[str(status)] = codes.get(str(status), 0) + 1
+
+        entry = {"requests": len(samples), "rps": round(len(samples) / elapsed, 1), "codes": codes}
+        for p in PERCENTILES:
+            entry["p{}".format(p)] = round(percentile(latencies, p) * 1000, 2)
+        res[name] = entry
+
+    return res
+
+
+def report(summary):
+    """
+    format a summary as a table
+
+    :param summary: summary as returned by summarize
+    :return: the table as string
+    """
+
+    header = ('route', 'requests', 'rps') + tuple('p{} ms'.format(p) for p in PERCENTILES) + ('status codes',)
+    rows = [header]
+
+    for name in sorted(summary, key=lambda n: (n == 'all', n)):
+        s = summary[name]
+        codes = ' '.join('{}:{}'.format(c, n) for c, n in sorted(s["codes"].items()))
+        rows.append((name, s["requests"], s["rps"]) + tuple(s["p{}".format(p)] for p in PERCENTILES) + (codes,))
+
+    widths = [max(len(str(r[i])) for r in rows) for i in range(len(header) - 1)]
+    lines = ['  '.join(str(v).rjust(w) for v, w in zip(r, widths)) + '  ' + str(r[-1]) for r in rows]
+
+    return '\n'.join(lines)
+
+
+def setup_in_process(path, radio, limits=True):
+    """
+    configure the app on a temporary database and interfaces file, with the simulated radio
+
+    :param path: temporary directory
+    :param radio: the SimulatedRadio
+    :param limits: if False, disable admission control
+    :return: the api key
+    """
+
+    radio.install()
+    core.WRITER = InterfacesWriter(os.path.join(path, 'interfaces'), window=0)
+
+    app.API_KEY = hexlify(os.urandom(20)).decode()
+    app.config['DB_PATH'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema')
+    app.config['DB_SOURCE'] = os.path.join(app.config['DB_PATH'], 'schema.sql')
+    app.config['DB_INSTANCE'] = os.path.join(path, 'load.db')
+    if not limits:
+        app.config['LIMITS'] = dict((name, {"concurrency": 1000, "rate": 1e9, "burst": 1e9})
+                                    for name in ('scan', 'radio'))
+
+    init_db()
+
+    return app.API_KEY
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='load test of the wifi connectivity manager REST API')
+    parser.add_argument('--url', default=None,
+                        help='base url of a running service; by default the app runs in-process, on a simulated radio')
+    parser.add_argument('--api-key', default='', help='api key of the running service')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=10, help='seconds')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help='comma separated routes with weights, from: {}'.format(', '.join(sorted(ROUTES))))
+    parser.add_argument('--iface', default='sim0', help='network interface in the paths')
+    parser.add_argument('--ssid', default='sim-0', help='network name in the paths')
+    parser.add_argument('--cells', type=int, default=20, help='simulated access points')
+    parser.add_argument('--scan-latency', type=float, default=0.05, help='simulated scan time, in seconds')
+    parser.add_argument('--connect-latency', type=float, default=0.2, help='simulated connection time, in seconds')
+    parser.add_argument('--no-limits', action='store_true', help='disable admission control (in-process only)')
+    parser.add_argument('--seed', type=int, default=None, help='random seed of the request mix')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # only warnings, on stderr, so that the report stays readable and --json output parseable
+    listener = logs.setup(logging.WARNING)
+
+    tmp = None
+    try:
+        if args.url:
+            api_key = args.api_key
+            client_factory = lambda: HttpClient(args.url, api_key)
+        else:
+            tmp = tempfile.mkdtemp(prefix='wifi-loadtest-')
+            radio = SimulatedRadio([args.iface], args.cells, args.scan_latency, args.connect_latency,
+                                   os.path.join(tmp, 'ifstate'))
+            api_key = setup_in_process(tmp, radio, not args.no_limits)
+            client_factory = lambda: InProcessClient(api_key)
+
+            # a stored network, so that available, location and connect have something to work on
+            client_factory().request('POST', '/networks/{}:{}:-1000.0:-1000.0'.format(args.iface, args.ssid))
+
+        results, elapsed = run(client_factory, mix, args.concurrency, args.duration, args.iface, args.ssid, args.seed)
+        summary = summarize(results, elapsed)
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp)
+        listener.stop()
+
+    if args.json:
+        print(json.dumps(summary, indent=2, sort_keys=True))
+    else:
+        print(report(summary))
+
+
+def _address(i):
+    """
+    address of the i-th simulated access point
+
+    :param i: index of the access point
+    :return: the address
+    """
+
+    return '02:00:00:00:{:02x}:{:02x}'.format(i // 256 % 256, i % 256)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+from Queue import Full, Queue
+import json
+import logging
+import sys
+import threading
+import time
+
+QUEUE_SIZE = 1000  # records waiting to be written, newer records are dropped when the queue is full
+
+# attributes of every log record, the others were passed with extra= and are written as fields
+_RECORD_ATTRS = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'request_id'}
+
+_context = threading.local()
+
+
+def request_id():
+    """
+    return the correlation id of the current thread
+
+    :return: the id, or None outside of a request
+    """
+
+    return getattr(_context, 'request_id', None)
+
+
+def set_request_id(rid):
+    """
+    set the correlation id of the current thread, written with every record logged by the thread
+
+    :param rid: the id, None to clear it
+    :return:
+    """
+
+    _context.request_id = rid
+
+
+class ContextFilter(logging.Filter):
+    """
+    add the correlation id of the logging thread to the records
+    """
+
+    def filter(self, record):
+        record.request_id = request_id()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    format records as one JSON object per line, with the fields passed with extra=
+    """
+
+    def format(self, record):
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+
+        if getattr(record, 'request_id', None):
+            entry["request_id"] = record.request_id
+
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+
+        return json.dumps(entry, default=str, sort_keys=True)
+
+
+class QueueHandler(logging.Handler):
+    """
+    hand records over to a QueueListener, so that logging never waits for a slow stream (e.g. a serial console)
+    """
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+        self._reported = 0
+
+    def emit(self, record):
+        try:
+            # format now: the arguments of the record may change before the listener writes it
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        """
+        report the records dropped since the last report, then close the handler
+
+        :return:
+        """
+
+        dropped, self._reported = self.dropped - self._reported, self.dropped
+        if dropped:
+            record = logging.getLogger(__name__).makeRecord(
+                __name__, logging.WARNING, __file__, 0, "%d log records dropped, the queue was full", (dropped,), None,
+                extra={"dropped": dropped})
+            try:
+                self.queue.put(record, True, 1.0)
+            except Full:
+                pass
+
+        logging.Handler.close(self)
+
+
+class QueueListener(object):
+    """
+    write the queued records with the target handlers, in a background thread
+    """
+
+    def __init__(self, queue, *handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='log-listener')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        """
+        write the pending records and stop the thread
+
+        nothing reads the queue afterwards: the handlers of the root logger feeding it are removed and closed, so that
+        they report the records they dropped
+
+        :param timeout: seconds to wait for the pending records
+        :return:
+        """
+
+        if self._thread is None:
+            return
+
+        root = logging.getLogger()
+        for h in [h for h in root.handlers if isinstance(h, QueueHandler) and h.queue is self.queue]:
+            root.removeHandler(h)
+            h.close()
+
+        self.queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+
+def setup(level=logging.INFO, stream=None, queue_size=QUEUE_SIZE):
+    """
+    log JSON lines to a stream through a background thread, with the correlation id of each record
+
+    :param level: minimum level of the logged records
+    :param stream: the stream, by default stderr
+    :param queue_size: records waiting to be written at most
+    :return: the QueueListener, stop it to write the pending records
+    """
+
+    queue = Queue(queue_size)
+
+    target = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    target.setFormatter(JsonFormatter())
+
+    handler = QueueHandler(queue)
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for h in [h for h in root.handlers if isinstance(h, QueueHandler)]:
+        root.removeHandler(h)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = QueueListener(queue, target)
+    listener.start()
+
+    return listener
+
+
+def elapsed_ms(start):
+    """
+    time elapsed since start
+
+    :param start: start time, from time.time()
+    :return: the milliseconds since start
+    """
+
+    return round((time.time() - start) * 1000, 1)
@@ -0,0 +1,137 @@
+def _add_options(db):
+    """
+    store scheme options, for databases created before they were part of schema.sql
+
+    :param db: sqlite3 database handle
+    :return:
+    """
+
+    if 'options' not in _columns(db, 'networks'):
+        db.execute("ALTER TABLE networks ADD COLUMN options text;")
+
+
+_NOW = "(julianday('now') - 2440587.5) * 86400.0"  # unix time in sqlite
+
+
+def _change(row, op):
+    """
+    build the trigger statements recording the change of a network, replacing its previous change
+
+    :param row: NEW or OLD
+    :param op: 'save' or 'delete'
+    :return: sql statements
+    """
+
+    if op == 'delete':
+        values = "{0}.iface, {0}.ssid, 'delete', NULL, NULL, NULL, NULL".format(row)
+    else:
+        values = "{0}.iface, {0}.ssid, 'save', {0}.passkey, {0}.lat, {0}.lng, {0}.options".format(row)
+
+    return ("DELETE FROM changes WHERE iface={0}.iface AND ssid={0}.ssid; "
+            "INSERT INTO changes (iface, ssid, op, passkey, lat, lng, options, changed) "
+            "VALUES ({1}, {2});").format(row, values, _NOW)
+
+
+# schema/schema.sql creates the baseline tables, each migration brings the database one version further;
+# the current version is stored in PRAGMA user_version, so that every migration runs once per database
+MIGRATIONS = [
+    (1, _add_options),
+    (2, [
+        "CREATE INDEX IF NOT EXISTS networks_ssid ON networks(ssid);",
+    ]),
+    (3, [
+        "ALTER TABLE networks ADD COLUMN last_seen real;",
+        "ALTER TABLE networks ADD COLUMN last_connected real;",
+        "ALTER TABLE networks ADD COLUMN connect_attempts integer NOT NULL DEFAULT 0;",
+        "ALTER TABLE networks ADD COLUMN connect_failures integer NOT NULL DEFAULT 0;",
+    ]),
+    (4, [
+        "CREATE TABLE connections (id integer PRIMARY KEY, iface text, ssid text, started real, duration real, "
+        "attempts integer, success integer, signal integer);",
+        "CREATE INDEX connections_network ON connections(iface, ssid, started);",
+    ]),
+    (5, [
+        # latest change of each network, numbered by a version that only grows (see core.changes)
+        "CREATE TABLE changes (version integer PRIMARY KEY AUTOINCREMENT, iface text, ssid text, op text, "
+        "passkey text, lat real, lng real, options text, changed real);",
+        "CREATE INDEX changes_network ON changes(iface, ssid);",
+        "INSERT INTO changes (iface, ssid, op, passkey, lat, lng, options, changed) "
+        "SELECT iface, ssid, 'save', passkey, lat, lng, options, " + _NOW + " FROM networks;",
+        "CREATE TRIGGER networks_insert AFTER INSERT ON networks BEGIN " + _change('NEW', 'save') + " END;",
+        "CREATE TRIGGER networks_update AFTER UPDATE OF passkey, lat, lng, options ON networks "
+        "WHEN OLD.passkey IS NOT NEW.passkey OR OLD.lat IS NOT NEW.lat OR OLD.lng IS NOT NEW.lng "
+        "OR OLD.options IS NOT NEW.options BEGIN " + _change('NEW', 'save') + " END;",
+        "CREATE TRIGGER networks_delete AFTER DELETE ON networks BEGIN " + _change('OLD', 'delete') + " END;",
+    ]),
+    (6, [
+        # downstream instances of the gateway mode (see gateway.py)
+        "CREATE TABLE devices (name text PRIMARY KEY, url text NOT NULL, api_key text NOT NULL);",
+    ]),
+]
+
+
+def version(db):
+    """
+    get the schema version of a database
+
+    :param db: sqlite3 database handle
+    :return: the schema version
+    """
+
+    return db.execute("PRAGMA user_version;").fetchone()[0]
+
+
+def migrate(db, migrations=None):
+    """
+    apply pending migrations, each one in its own transaction
+
+    :param db: sqlite3 database handle
+    :param migrations: list of (version, step) tuples, where step is a callable or a list of sql statements
+    :return: the schema version after migrating
+    """
+
+    if migrations is None:
+        migrations = MIGRATIONS
+
+    current = version(db)
+    isolation_level = db.isolation_level
+
+    # manage transactions explicitly, sqlite3 would otherwise commit before each ALTER TABLE
+    db.isolation_level = None
+
+    try:
+        for target, step in sorted(migrations, key=lambda m: m[0]):
+            if target <= current:
+                continue
+
+            db.execute("BEGIN;")
+            try:
+                if callable(step):
+                    step(db)
+                else:
+                    for statement in step:
+                        db.execute(statement)
+
+                db.execute("PRAGMA user_version = {:d};".format(target))
+                db.execute("COMMIT;")
+            except Exception:
+                db.execute("ROLLBACK;")
+                raise
+
+            current = target
+    finally:
+        db.isolation_level = isolation_level
+
+    return current
+
+
+def _columns(db, table):
+    """
+    list the columns of a table
+
+    :param db: sqlite3 database handle
+    :param table: table name
+    :return: list of column names
+    """
+
+    return [c[1] for c in db.execute("PRAGMA table_info({});".format(table)).fetchall()]
@@ -0,0 +1,110 @@
+from StringIO import StringIO
+import os
+import pstats
+import re
+import threading
+import time
+
+MAX_PROFILES = 20  # profiles kept in the spool, the oldest are deleted first
+REPORT_LINES = 40  # functions listed in a text report
+
+_NAME_RE = re.compile(r'^[\w.-]+\.prof$')
+
+
+class Spool(object):
+    """
+    directory of the latest request profiles, written with cProfile
+    """
+
+    def __init__(self, path, max_profiles=MAX_PROFILES):
+        self.path = path
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+        self._count = 0
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def save(self, profile, label):
+        """
+        write a profile, deleting the oldest ones beyond max_profiles
+
+        :param profile: the cProfile.Profile object, disabled
+        :param label: description of the profiled request, e.g. method and path
+        :return: the profile name
+        """
+
+        with self._lock:
+            self._count += 1
+            count = self._count
+
+        label = re.sub(r'[^\w.-]+', '_', label).strip('_')[:60]
+        name = '{}-{:06d}-{}.prof'.format(int(time.time() * 1000), count % 1000000, label)
+        path = os.path.join(self.path, name)
+
+        # write aside and rename, so that a profile is never listed half written
+        profile.dump_stats(path + '.tmp')
+        os.rename(path + '.tmp', path)
+
+        with self._lock:
+            for old in self.list()[self.max_profiles:]:
+                try:
+                    os.unlink(os.path.join(self.path, old["name"]))
+                except OSError:
+                    pass
+
+        return name
+
+    def list(self):
+        """
+        list the profiles, newest first
+
+        :return: list of dictionaries with the name, size and time of each profile
+        """
+
+        res = []
+        for name in os.listdir(self.path):
+            if not _NAME_RE.match(name):
+                continue
+
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except OSError:
+                # deleted in the meantime
+                continue
+
+            res.append({"name": name, "size": st.st_size, "time": st.st_mtime})
+
+        res.sort(key=lambda p: (p["time"], p["name"]), reverse=True)
+
+        return res
+
+    def find(self, name):
+        """
+        return the path of a profile
+
+        :param name: the profile name
+        :return: the path, or None if there is no such profile
+        """
+
+        if not _NAME_RE.match(name):
+            return None
+
+        path = os.path.join(self.path, name)
+
+        return path if os.path.isfile(path) else None
+
+
+def report(path, lines=REPORT_LINES):
+    """
+    format a profile as text, sorted by cumulative time
+
+    :param path: path of the profile
+    :param lines: number of functions listed
+    :return: the report
+    """
+
+    stream = StringIO()
+    pstats.Stats(path, stream=stream).sort_stats('cumulative').print_stats(lines)
+
+    return stream.getvalue()
@@ -1,10 +1,41 @@
+from binascii import hexlify
 from functools import wraps
-from flask import Flask, request, g, jsonify
+from flask import Flask, Response, request, g, jsonify, send_file
+from multiprocessing.pool import ThreadPool
+from urllib import urlencode
+import cProfile
+import command
 import core
+import encoding
+import gateway
+import json
+import limits
+import logging
+import logs
+import migrations
+import os
+import profiling
+import re
 import sqlite3
+import startup
+import supervisor
+import threading
+import time
 
 app = Flask(__name__)
 app.API_KEY = ''
+app.POOLS = limits.pools()
+app.SPOOL = None
+app.GATEWAY = None
+
+BATCH_MAX = 32  # operations in a batch request
+BATCH_WORKERS = 4  # operations of a batch request running at the same time
+_BATCH_POOL = []
+_BATCH_POOL_LOCK = threading.Lock()
+
+_REQUEST_ID_RE = re.compile(r'^[\w.-]{1,64}$')
+
+logger = logging.getLogger(__name__)
 
 
 def require_api_key(route_function):
@@ -25,6 +56,39 @@ def require_api_key(route_function):
     return check_api_key
 
 
+def admit(pool_name):
+    """
+    admission control: limit concurrency and request rate of an expensive endpoint
+
+    :param pool_name: the admission pool of the endpoint, see limits.POOLS
+    :return: the decorator
+    """
+
+    def decorator(route_function):
+        @wraps(route_function)
+        def check_admission(*args, **kwargs):
+            pool = app.POOLS[pool_name]
+            key = (request.headers.get('X-Api-Key'), kwargs.get('iface'))
+
+            try:
+                pool.acquire(key)
+            except limits.Rejected as e:
+                code = 429
+                resp = jsonify(message=e.message, code=code)
+                resp.status_code = code
+                resp.headers['Retry-After'] = limits.retry_after(e.retry_after)
+                return resp
+
+            try:
+                return route_function(*args, **kwargs)
+            finally:
+                pool.release()
+
+        return check_admission
+
+    return decorator
+
+
 def _get_db():
     """
     get a sqlite3 database handle
@@ -42,16 +106,37 @@ def _get_db():
 
 def init_db():
     """
-    initialize database from sqlite3 script file
+    initialize database from sqlite3 script file and apply pending migrations
     
     :return: 
     """
+    core.STORE = app.config.get('STORE', core.STORE_FILE)
+    app.POOLS = limits.pools(app.config.get('LIMITS'))
+
+    app.SPOOL = None
+    if app.config.get('PROFILE_DIR'):
+        app.SPOOL = profiling.Spool(app.config['PROFILE_DIR'], app.config.get('PROFILE_MAX', profiling.MAX_PROFILES))
+
+    app.GATEWAY = None
+    if app.config.get('GATEWAY'):
+        app.GATEWAY = gateway.Gateway(app.config.get('GATEWAY_TIMEOUT', gateway.DEVICE_TIMEOUT))
+
+    if app.config.get('HELPER_SOCKET'):
+        core.use_helper(app.config['HELPER_SOCKET'])
+
     with app.app_context():
         db = _get_db()
         with app.open_resource(app.config['DB_SOURCE'], mode='r') as f:
             db.executescript(f.read())
+
         db.commit()
 
+        migrations.migrate(db)
+
+        if core.STORE == core.STORE_DB:
+            core.adopt(db)
+            core.render(db)
+
 
 @app.teardown_appcontext
 def _close_connection(exception):
@@ -68,9 +153,150 @@ def _close_connection(exception):
         db.close()
 
 
+@app.before_request
+def _start_request():
+    """
+    set the correlation id of the request, from the X-Request-Id header or a new one
+
+    :return:
+    """
+
+    rid = request.headers.get('X-Request-Id', '')
+    if not _REQUEST_ID_RE.match(rid):
+        rid = hexlify(os.urandom(8)).decode()
+
+    logs.set_request_id(rid)
+    g._start = time.time()
+
+
+@app.after_request
+def _log_request(resp):
+    """
+    log the request with its status and duration, and return its correlation id in the X-Request-Id header
+
+    :param resp: the response
+    :return: the response
+    """
+
+    start = getattr(g, '_start', None)
+    if start is not None:
+        elapsed = logs.elapsed_ms(start)
+        logger.info("%s %s: %d in %.1f ms", request.method, request.path, resp.status_code, elapsed,
+                    extra={"method": request.method, "path": request.path, "status": resp.status_code,
+                           "elapsed_ms": elapsed})
+
+    rid = logs.request_id()
+    if rid:
+        resp.headers['X-Request-Id'] = rid
+
+    return resp
+
+
+@app.teardown_request
+def _end_request(exception):
+    """
+    clear the correlation id of the request
+
+    :param exception:
+    :return:
+    """
+
+    logs.set_request_id(None)
+
+
+@app.before_request
+def _start_profile():
+    """
+    profile the request if profiling is enabled and the request asks for it with a valid api key
+
+    :return:
+    """
+
+    if app.SPOOL is None or request.headers.get('X-Profile') != '1':
+        return
+
+    if not request.headers.get('X-Api-Key') or request.headers.get('X-Api-Key') != app.API_KEY:
+        return
+
+    g._profile = cProfile.Profile()
+    g._profile.enable()
+
+
+@app.after_request
+def _save_profile(resp):
+    """
+    write the profile of the request to the spool, and name it in the X-Profile-Id header
+
+    :param resp: the response
+    :return: the response
+    """
+
+    profile = getattr(g, '_profile', None)
+
+    if profile is not None:
+        profile.disable()
+        g._profile = None
+        resp.headers['X-Profile-Id'] = app.SPOOL.save(profile, '{} {}'.format(request.method, request.path))
+
+    return resp
+
+
+@app.teardown_request
+def _stop_profile(exception):
+    """
+    stop profiling a request that failed before its response
+
+    :param exception:
+    :return:
+    """
+
+    profile = getattr(g, '_profile', None)
+
+    if profile is not None:
+        profile.disable()
+        g._profile = None
+
+
+@app.after_request
+def _encode_response(resp):
+    """
+    encode JSON responses with the compact encoding the client asked for in the Accept header, if any
+
+    :param resp: the response
+    :return: the response
+    """
+
+    mimetype = encoding.negotiate(request.accept_mimetypes)
+
+    if mimetype != encoding.JSON and resp.mimetype == encoding.JSON and not resp.is_streamed:
+        resp.set_data(encoding.encode(json.loads(resp.get_data()), mimetype))
+        resp.mimetype = mimetype
+
+    resp.vary.add('Accept')
+
+    return resp
+
+
+def _layout(rows):
+    """
+    apply the layout requested with the `layout` query parameter to a list of rows
+
+    :param rows: list of dictionaries
+    :return: the rows, in columnar layout if `layout=columns`
+    """
+
+    if request.args.get('layout') == 'columns':
+        return encoding.columns(rows)
+
+    return rows
+
+
 @app.errorhandler(core.WifiException)
 def handle_wifi_exception(e):
-    resp = jsonify(message=e.message, code=e.code)
+    if e.stderr:
+        resp = jsonify(message=e.message, code=e.code, stderr=e.stderr)
+    else:
+        resp = jsonify(message=e.message, code=e.code)
     resp.status_code = e.code
     return resp
 
@@ -99,9 +325,65 @@ def network_list(gps=''):
     if gps:
         stored = core.db_all(_get_db())
     else:
-        stored = core.scheme_all()
+        stored = core.scheme_all(_get_db())
+
+    return jsonify(message=_layout(stored), code=200)
+
+
+@app.route('/networks/changes')
+@require_api_key
+def network_changes():
+    """
+    stream the changes of the stored networks after a version, one JSON object per line
+
+    :return: NDJSON response, with the latest version in the X-Changes-Version header
+    """
+
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        raise core.WifiException("since must be a number", 400)
+
+    version = core.changes_version(_get_db())
+    path = app.config['DB_INSTANCE']
+
+    def generate():
+        # the request database handle is closed before the response is streamed
+        db = sqlite3.connect(path)
+        try:
+            for change in core.changes(db, since):
+                yield json.dumps(change) + '\n'
+        finally:
+            db.close()
+
+    return Response(generate(), mimetype='application/x-ndjson', headers={'X-Changes-Version': str(version)})
+
+
+@app.route('/networks/import', methods=['POST'])
+@require_api_key
+def network_import():
+    """
+    apply changes of stored networks, as streamed by GET /networks/changes, in one transaction
+
+    :return: JSON response
+    """
 
-    return jsonify(message=stored, code=200)
+    data = request.get_data().strip()
+
+    try:
+        if data.startswith('['):
+            entries = json.loads(data)
+        else:
+            entries = [json.loads(line) for line in data.splitlines() if line.strip()]
+    except ValueError:
+        raise core.WifiException("import: expected NDJSON or a JSON list of changes", 400)
+
+    if not isinstance(entries, list):
+        raise core.WifiException("import: expected NDJSON or a JSON list of changes", 400)
+
+    res = core.import_changes(_get_db(), entries)
+
+    return jsonify(message=res, code=200)
 
 
 @app.route('/ifaces')
@@ -120,8 +402,25 @@ def iface_list(addresses=''):
     return jsonify(message=ifaces, code=200)
 
 
+@app.route('/scan')
+@require_api_key
+@admit('scan')
+def network_scan_all():
+    """
+    return all wifi networks available on all wireless network interfaces, scanned in parallel
+
+    :return: JSON response
+    """
+
+    res = core.scan_all()
+    res['cells'] = _layout(res['cells'])
+
+    return jsonify(message=res, code=200)
+
+
 @app.route('/scan/<iface>')
 @require_api_key
+@admit('scan')
 def network_scan(iface):
     """
     return all wifi networks available on a network interface
@@ -132,7 +431,35 @@ def network_scan(iface):
 
     cells = core.cell_all(iface)
 
-    return jsonify(message=cells, code=200)
+    if request.args.get('group') == 'ssid':
+        cells = core.cell_groups(iface, cells)
+
+    return jsonify(message=_layout(cells), code=200)
+
+
+@app.route('/scan/<iface>/delta')
+@require_api_key
+@admit('scan')
+def network_scan_delta(iface):
+    """
+    scan a network interface and return the wifi networks added, changed and removed since an earlier scan
+
+    :param iface: network interface
+    :return: JSON response
+    """
+
+    try:
+        since = int(request.args.get('since', 0))
+        threshold = request.args.get('threshold')
+        threshold = float(threshold) if threshold is not None else None
+    except ValueError:
+        raise core.WifiException("since and threshold must be numbers", 400)
+
+    res = core.cell_delta(iface, since, threshold)
+    res['added'] = _layout(res['added'])
+    res['changed'] = _layout(res['changed'])
+
+    return jsonify(message=res, code=200)
 
 
 @app.route('/status/<iface>')
@@ -152,6 +479,7 @@ def network_status(iface):
 
 @app.route('/available/<iface>')
 @require_api_key
+@admit('scan')
 def network_available(iface):
     """
     return the best Wi-Fi network available, if any
@@ -159,11 +487,106 @@ def network_available(iface):
     :return: JSON response
     """
 
-    avail = core.available(iface)
+    avail = core.available(iface, _get_db())
 
     return jsonify(message=avail, code=200)
 
 
+@app.route('/signal/<iface>/<bssid>')
+@require_api_key
+def network_signal(iface, bssid):
+    """
+    return the recent signal samples of a BSSID and its smoothed signal
+
+    :param iface: network interface
+    :param bssid: the BSSID (cell address)
+    :return: JSON response
+    """
+
+    res = core.SIGNALS.get(iface, bssid)
+
+    if res is None:
+        raise core.WifiException("bssid {}: not found".format(bssid), 404)
+
+    return jsonify(message=res, code=200)
+
+
+@app.route('/stats')
+@app.route('/stats/<iface>')
+@require_api_key
+def network_stats(iface=None):
+    """
+    return connection statistics of stored networks
+
+    :param iface: if set, restrict to this network interface
+    :return: JSON response
+    """
+
+    res = core.network_stats(_get_db(), iface)
+
+    return jsonify(message=res, code=200)
+
+
+@app.route('/commands')
+@require_api_key
+def command_list():
+    """
+    return the number of runs and timeouts of each external command
+
+    :return: JSON response
+    """
+
+    return jsonify(message=command.counters(), code=200)
+
+
+@app.route('/startup')
+@require_api_key
+def startup_timings():
+    """
+    return the time taken by the startup phases and by the lazy imports of the radio libraries
+
+    :return: JSON response
+    """
+
+    return jsonify(message=startup.timings(), code=200)
+
+
+@app.route('/profiles')
+@require_api_key
+def profile_list():
+    """
+    list the request profiles, newest first
+
+    :return: JSON response
+    """
+
+    if app.SPOOL is None:
+        raise core.WifiException("profiling: disabled", 404)
+
+    return jsonify(message=app.SPOOL.list(), code=200)
+
+
+@app.route('/profiles/<name>')
+@require_api_key
+def profile_get(name):
+    """
+    download a request profile, in pstats format or as text report with ?format=text
+
+    :param name: the profile name
+    :return: the profile
+    """
+
+    path = app.SPOOL.find(name) if app.SPOOL is not None else None
+
+    if path is None:
+        raise core.WifiException("profile {}: not found".format(name), 404)
+
+    if request.args.get('format') == 'text':
+        return profiling.report(path), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True, attachment_filename=name)
+
+
 @app.route('/location/<ssid>')
 @require_api_key
 def network_location(ssid):
@@ -181,6 +604,7 @@ def network_location(ssid):
 
 @app.route('/enable/<iface>', methods=['POST'])
 @require_api_key
+@admit('radio')
 def network_enable(iface):
     """
     enable a network interface
@@ -189,13 +613,14 @@ def network_enable(iface):
     :return: JSON response
     """
 
-    core.enable(iface)
+    core.enable(iface, request.args.get('force') == '1')
 
     return jsonify(message='enabled {}'.format(iface), code=200)
 
 
 @app.route('/disable/<iface>', methods=['POST'])
 @require_api_key
+@admit('radio')
 def network_disable(iface):
     """
     disable a network interface
@@ -204,7 +629,7 @@ def network_disable(iface):
     :return: JSON response
     """
 
-    core.disable(iface)
+    core.disable(iface, request.args.get('force') == '1')
 
     return jsonify(message='disabled {}'.format(iface), code=200)
 
@@ -212,6 +637,7 @@ def network_disable(iface):
 @app.route('/networks/<iface>:<ssid>:<lat>:<lng>', methods=['POST'])
 @app.route('/networks/<iface>:<ssid>:<lat>:<lng>:<passkey>', methods=['POST'])
 @require_api_key
+@admit('radio')
 def network_save(iface, ssid, lat, lng, passkey=None):
     """
     store new network scheme in /etc/network/interfaces
@@ -235,11 +661,12 @@ def network_save(iface, ssid, lat, lng, passkey=None):
 @app.route('/connect/<iface>:<ssid>:<lat>:<lng>', methods=['POST'])
 @app.route('/connect/<iface>:<ssid>:<lat>:<lng>:<passkey>', methods=['POST'])
 @require_api_key
+@admit('radio')
 def network_connect(iface, ssid, lat, lng, passkey=None):
     """
     connect to a network
 
-    :param iface: network interface
+    :param iface: network interface, or comma separated network interfaces to connect on whichever is first
     :param ssid: network name
     :param lat: latitude
     :param lng: longitude
@@ -247,7 +674,12 @@ def network_connect(iface, ssid, lat, lng, passkey=None):
     :return: JSON response
     """
 
-    core.connect(iface, ssid, passkey, _get_db(), float(lat), float(lng))
+    force = request.args.get('force') == '1'
+
+    if ',' in iface:
+        iface = core.connect_any(iface.split(','), ssid, passkey, _get_db(), float(lat), float(lng), force)
+    else:
+        core.connect(iface, ssid, passkey, _get_db(), float(lat), float(lng), request.args.get('bssid'), force)
 
     return jsonify(message='connected {}:{}'.format(iface, ssid), code=200)
 
@@ -284,3 +716,372 @@ def network_delete_all(test=''):
     total, deleted = core.delete_all(_get_db(), db_only=bool(test))
 
     return jsonify(message='deleted {}/{} schemes'.format(total, deleted), code=200)
+
+
+@app.route('/supervisor')
+@require_api_key
+def supervisor_list():
+    """
+    list the network interfaces kept connected by a supervisor
+
+    :return: JSON response
+    """
+
+    return jsonify(message=supervisor.running(), code=200)
+
+
+@app.route('/supervisor/<iface>', methods=['POST'])
+@require_api_key
+def supervisor_start(iface):
+    """
+    keep a network interface connected to the best stored network
+
+    :param iface: network interface
+    :return: JSON response
+    """
+
+    supervisor.start(str(iface), app.config['DB_INSTANCE'], pools=app.POOLS)
+
+    return jsonify(message='supervising {}'.format(iface), code=200)
+
+
+@app.route('/supervisor/<iface>', methods=['DELETE'])
+@require_api_key
+def supervisor_stop(iface):
+    """
+    stop supervising a network interface
+
+    :param iface: network interface
+    :return: JSON response
+    """
+
+    if not supervisor.stop(iface):
+        raise core.WifiException("supervisor {}: not found".format(iface), 404)
+
+    return jsonify(message='stopped supervising {}'.format(iface), code=200)
+
+
+@app.route('/gateway/devices')
+@require_api_key
+def gateway_device_list():
+    """
+    list the downstream instances of the gateway, without their api keys
+
+    :return: JSON response
+    """
+
+    _gateway()
+    devices = [{"name": d["name"], "url": d["url"]} for d in gateway.device_all(_get_db())]
+
+    return jsonify(message=devices, code=200)
+
+
+@app.route('/gateway/devices/<name>', methods=['POST'])
+@require_api_key
+def gateway_device_save(name):
+    """
+    register a downstream instance, the body is a JSON object with its url and api_key
+
+    :param name: device name
+    :return: JSON response
+    """
+
+    gw = _gateway()
+    device = request.get_json(force=True, silent=True)
+
+    if not isinstance(device, dict) or not device.get('url') or not device.get('api_key'):
+        raise core.WifiException("device {}: expected url and api_key".format(name), 400)
+
+    if not device['url'].startswith(('http://', 'https://')):
+        raise core.WifiException("device {}: url must start with http:// or https://".format(name), 400)
+
+    gateway.device_save(_get_db(), name, device['url'], device['api_key'])
+    gw.forget(name)
+
+    code = 201
+    resp = jsonify(message='saved device {}'.format(name), code=code)
+    resp.status_code = code
+    return resp
+
+
+@app.route('/gateway/devices/<name>', methods=['DELETE'])
+@require_api_key
+def gateway_device_delete(name):
+    """
+    unregister a downstream instance
+
+    :param name: device name
+    :return: JSON response
+    """
+
+    gw = _gateway()
+
+    if not gateway.device_delete(_get_db(), name):
+        raise core.WifiException("device {}: not found".format(name), 404)
+
+    gw.forget(name)
+
+    return jsonify(message='deleted device {}'.format(name), code=200)
+
+
+@app.route('/gateway/fanout/<path:path>', methods=['GET', 'POST', 'DELETE'])
+@require_api_key
+def gateway_fanout(path):
+    """
+    send a request to the downstream instances in parallel, e.g. GET /gateway/fanout/status/wlan0 or
+    POST /gateway/fanout/networks/import; ?devices=a,b restricts the devices, ?timeout= sets the seconds each
+    device has to answer, the other query parameters and the body are forwarded
+
+    :param path: path of the request on the downstream instances
+    :return: JSON response, with the result of each device by name and the number of devices that succeeded
+        and failed
+    """
+
+    gw = _gateway()
+
+    names = request.args.get('devices')
+    if names is not None:
+        names = set(n for n in names.split(',') if n)
+
+    try:
+        timeout = float(request.args.get('timeout', gw.timeout))
+    except ValueError:
+        raise core.WifiException("timeout must be a number", 400)
+
+    devices = gateway.device_all(_get_db(), names)
+    if names is not None and len(devices) < len(names):
+        missing = names - set(d["name"] for d in devices)
+        raise core.WifiException("devices {}: not found".format(', '.join(sorted(missing))), 404)
+
+    query = [(k, v) for k, v in request.args.items(multi=True) if k not in ('devices', 'timeout')]
+    target = '/' + path
+    if query:
+        target += '?' + urlencode([(k, v.encode('utf-8')) for k, v in query])
+
+    res = gw.fanout(devices, request.method, target, request.get_data() or None, request.headers.get('Content-Type'),
+                    timeout)
+
+    return jsonify(message=res, code=200)
+
+
+def _gateway():
+    """
+    get the gateway
+
+    :return: the gateway.Gateway
+    """
+
+    if app.GATEWAY is None:
+        raise core.WifiException("gateway: disabled", 404)
+
+    return app.GATEWAY
+
+
+def _batch_enable(db, p):
+    core.enable(p['iface'], bool(p.get('force')))
+
+    return 'enabled {}'.format(p['iface']), 200
+
+
+def _batch_disable(db, p):
+    core.disable(p['iface'], bool(p.get('force')))
+
+    return 'disabled {}'.format(p['iface']), 200
+
+
+def _batch_save(db, p):
+    core.save(p['iface'], p['ssid'], p.get('passkey'), db, float(p.get('lat', core.GPS_INF)),
+              float(p.get('lng', core.GPS_INF)))
+
+    return 'created {}:{}'.format(p['iface'], p['ssid']), 201
+
+
+def _batch_connect(db, p):
+    iface = p['iface']
+    lat = float(p.get('lat', core.GPS_INF))
+    lng = float(p.get('lng', core.GPS_INF))
+
+    force = bool(p.get('force'))
+
+    if ',' in iface:
+        iface = core.connect_any(iface.split(','), p['ssid'], p.get('passkey'), db, lat, lng, force)
+    else:
+        core.connect(iface, p['ssid'], p.get('passkey'), db, lat, lng, p.get('bssid'), force)
+
+    return 'connected {}:{}'.format(iface, p['ssid']), 200
+
+
+def _batch_delete(db, p):
+    core.delete(p['iface'], p['ssid'], db, db_only=bool(p.get('test')))
+
+    return 'deleted {}:{}'.format(p['iface'], p['ssid']), 200
+
+
+# batch operations by name: function of a database handle and the operation parameters returning the
+# response message and code, admission pool, and whether the operation can run in parallel with others
+_BATCH_OPS = {
+    'networks': (lambda db, p: (core.db_all(db) if p.get('gps') else core.scheme_all(db), 200), None, True),
+    'ifaces': (lambda db, p: (core.interfaces(bool(p.get('addresses'))), 200), None, True),
+    'scan': (lambda db, p: (core.cell_all(p['iface']) if 'iface' in p else core.scan_all(), 200), 'scan', True),
+    'status': (lambda db, p: (core.status(str(p['iface'])), 200), None, True),
+    'available': (lambda db, p: (core.available(p['iface'], db), 200), 'scan', True),
+    'stats': (lambda db, p: (core.network_stats(db, p.get('iface')), 200), None, True),
+    'commands': (lambda db, p: (command.counters(), 200), None, True),
+    'location': (lambda db, p: ('{},{}'.format(*core.get_last_location(p['ssid'], db)), 200), None, True),
+    'enable': (_batch_enable, 'radio', False),
+    'disable': (_batch_disable, 'radio', False),
+    'save': (_batch_save, 'radio', False),
+    'connect': (_batch_connect, 'radio', False),
+    'delete': (_batch_delete, None, False)
+}
+
+
+# types of the batch operation parameters, the others are read as booleans; lat and lng may be numbers as strings
+_BATCH_PARAMS = {
+    'iface': basestring,
+    'ssid': basestring,
+    'passkey': (basestring, type(None)),
+    'bssid': (basestring, type(None)),
+    'lat': (int, float, basestring),
+    'lng': (int, float, basestring)
+}
+
+
+@app.route('/batch', methods=['POST'])
+@require_api_key
+def batch():
+    """
+    run several operations in one request
+
+    The body is a JSON list of operations, {"op": <name>, <parameter>: <value>, ...}, named after the single
+    requests (networks, ifaces, scan, status, available, stats, commands, location, enable, disable, save,
+    connect, delete). Consecutive read-only operations run in parallel, operations that change the state of
+    an interface or of the stored networks run alone, in order.
+
+    :return: JSON response, with the list of results of the operations ({"message": ..., "code": ...})
+    """
+
+    operations = request.get_json(force=True, silent=True)
+
+    if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+        raise core.WifiException("batch: expected a list of operations", 400)
+
+    if len(operations) > BATCH_MAX:
+        raise core.WifiException("batch: at most {} operations".format(BATCH_MAX), 400)
+
+    api_key = request.headers.get('X-Api-Key')
+    rid = logs.request_id()
+    results = []
+    parallel = []
+
+    def run_parallel():
+        if parallel:
+            results.extend(_batch_pool().map(lambda op: _batch_run(op, api_key, rid), parallel))
+            del parallel[:]
+
+    for op in operations:
+        entry = _BATCH_OPS.get(op.get('op'))
+        if entry is not None and entry[2]:
+            parallel.append(op)
+            continue
+
+        run_parallel()
+        results.append(_batch_run(op, api_key, rid))
+
+    run_parallel()
+
+    return jsonify(message=results, code=200)
+
+
+def _batch_run(op, api_key, rid=None):
+    """
+    run a batch operation with its own database handle
+
+    :param op: the operation as dictionary
+    :param api_key: api key of the request, for admission control
+    :param rid: correlation id of the request, for the operations running in the thread pool
+    :return: dictionary with the response message and code
+    """
+
+    if rid is not None:
+        logs.set_request_id(rid)
+
+    entry = _BATCH_OPS.get(op.get('op'))
+    if entry is None:
+        return {"message": "unknown operation {}".format(op.get('op')), "code": 400}
+
+    error = _batch_check(op)
+    if error is not None:
+        return {"message": error, "code": 400}
+
+    function, pool_name, _ = entry
+    pool = app.POOLS[pool_name] if pool_name else None
+
+    if pool is not None:
+        try:
+            pool.acquire((api_key, op.get('iface')))
+        except limits.Rejected as e:
+            return {"message": e.message, "code": 429, "retry_after": limits.retry_after(e.retry_after)}
+
+    db = sqlite3.connect(app.config['DB_INSTANCE'])
+    try:
+        message, code = function(db, op)
+        return {"message": message, "code": code}
+    except KeyError as e:
+        return {"message": "{}: missing parameter {}".format(op['op'], e.args[0]), "code": 400}
+    except core.WifiException as e:
+        res = {"message": e.message, "code": e.code}
+        if e.stderr:
+            res["stderr"] = e.stderr
+        return res
+    except sqlite3.Error as e:
+        return {"message": e.message, "code": 500}
+    except (ValueError, TypeError) as e:
+        return {"message": "{}: {}".format(op['op'], e), "code": 400}
+    except (IOError, OSError) as e:
+        # e.g. a wireless request on an interface that is not wireless
+        return {"message": "{}: {}".format(op['op'], e.strerror or e), "code": 500}
+    except Exception as e:
+        # unexpected: fail the operation only, the others keep their results
+        logger.exception("batch %s: failed", op['op'])
+        return {"message": "{}: {}".format(op['op'], e), "code": 500}
+    finally:
+        db.close()
+        if pool is not None:
+            pool.release()
+
+
+def _batch_check(op):
+    """
+    check the types of the parameters of a batch operation
+
+    :param op: the operation as dictionary
+    :return: the error message, or None if the parameters are valid
+    """
+
+    for name, value in op.items():
+        types = _BATCH_PARAMS.get(name)
+        if types is not None and (not isinstance(value, types) or isinstance(value, bool)):
+            return "{}: invalid parameter {}".format(op['op'], name)
+
+        if name in ('lat', 'lng'):
+            try:
+                float(value)
+            except ValueError:
+                return "{}: {} must be a number".format(op['op'], name)
+
+    return None
+
+
+def _batch_pool():
+    """
+    get the thread pool running batch operations, creating it on first use
+
+    :return: the thread pool
+    """
+
+    with _BATCH_POOL_LOCK:
+        if not _BATCH_POOL:
+            _BATCH_POOL.append(ThreadPool(BATCH_WORKERS))
+
+    return _BATCH_POOL[0]
@@ -4,5 +4,6 @@ CREATE TABLE IF NOT EXISTS networks (
   passkey text,
   lat real,
   lng real,
+  options text,
   PRIMARY KEY (iface, ssid)
 );
\ No newline at end of file
@@ -0,0 +1,145 @@
+from collections import OrderedDict
+import array
+import threading
+import time
+
+SAMPLES = 64  # samples kept per BSSID
+MAX_BSSIDS = 512  # BSSIDs tracked at most, the least recently seen are forgotten first
+EWMA_ALPHA = 0.3  # weight of the latest sample in the smoothed signal
+
+
+class SignalRing(object):
+    """
+    fixed-size history of the (time, signal, quality) samples of a BSSID, with the smoothed signal
+    """
+
+    __slots__ = ('times', 'signals', 'qualities', 'next', 'count', 'ewma')
+
+    def __init__(self, size):
+        self.times = array.array('d', [0.0] * size)
+        self.signals = array.array('h', [0] * size)
+        self.qualities = array.array('h', [0] * size)
+        self.next = 0
+        self.count = 0
+        self.ewma = None
+
+    def add(self, t, signal, quality, alpha):
+        size = len(self.times)
+
+        self.times[self.next] = t
+        self.signals[self.next] = signal
+        self.qualities[self.next] = quality
+        self.next = (self.next + 1) % size
+        self.count = min(self.count + 1, size)
+
+        self.ewma = signal if self.ewma is None else alpha * signal + (1 - alpha) * self.ewma
+
+    def samples(self):
+        """
+        return the samples, oldest first
+
+        :return: list of (time, signal, quality) tuples
+        """
+
+        size = len(self.times)
+        start = (self.next - self.count) % size
+
+        return [(self.times[i % size], self.signals[i % size], self.qualities[i % size])
+                for i in range(start, start + self.count)]
+
+
+class SignalHistory(object):
+    """
+    signal samples of every BSSID seen in scans, with memory bounded by MAX_BSSIDS * SAMPLES samples
+    """
+
+    def __init__(self, size=SAMPLES, max_bssids=MAX_BSSIDS, alpha=EWMA_ALPHA):
+        self.size = size
+        self.max_bssids = max_bssids
+        self.alpha = alpha
+
+        self._lock = threading.Lock()
+        self._rings = OrderedDict()
+
+    def add(self, iface, cells, t=None):
+        """
+        record the cells of a scan
+
+        :param iface: network interface
+        :param cells: list of cells as dictionaries
+        :param t: time of the scan, by default now
+        :return:
+        """
+
+        if t is None:
+            t = time.time()
+
+        with self._lock:
+            for c in cells:
+                if c.get('signal') is None:
+                    continue
+
+                key = (iface, c['address'].lower())
+
+                # move to the end, the least recently seen BSSIDs come first
+                ring = self._rings.pop(key, None)
+                if ring is None:
+                    ring = SignalRing(self.size)
+                self._rings[key] = ring
+
+                ring.add(t, c['signal'], _quality(c.get('quality')), self.alpha)
+
+            while len(self._rings) > self.max_bssids:
+                self._rings.popitem(last=False)
+
+    def smoothed(self, iface, bssid):
+        """
+        return the smoothed signal of a BSSID
+
+        :param iface: network interface
+        :param bssid: the BSSID (cell address)
+        :return: the signal in dBm, or None if the BSSID was never seen
+        """
+
+        with self._lock:
+            ring = self._rings.get((iface, bssid.lower()))
+            return ring.ewma if ring is not None else None
+
+    def get(self, iface, bssid):
+        """
+        return the signal history of a BSSID
+
+        :param iface: network interface
+        :param bssid: the BSSID (cell address)
+        :return: dictionary with the smoothed signal and the samples, oldest first, or None if the BSSID was
+            never seen
+        """
+
+        with self._lock:
+            ring = self._rings.get((iface, bssid.lower()))
+            if ring is None:
+                return None
+
+            samples = ring.samples()
+            ewma = ring.ewma
+
+        return {
+            "iface": iface,
+            "bssid": bssid,
+            "smoothed": round(ewma, 1),
+            "samples": [{"time": t, "signal": s, "quality": q} for t, s, q in samples]
+        }
+
+
+def _quality(quality):
+    """
+    parse a cell quality, e.g. "54/70"
+
+    :param quality: the quality as reported by iwlist
+    :return: the quality as number, 0 if unknown
+    """
+
+    try:
+        return int(str(quality).split('/')[0])
+    except ValueError:
+        return 0
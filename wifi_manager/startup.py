@@ -0,0 +1,123 @@
+from contextlib import contextmanager
+import importlib
+import logging
+import sys
+import threading
+import time
+
+# time spent in lazy imports and startup phases, in ms, see GET /startup
+TIMINGS = {"imports": {}, "phases": {}}
+_LOCK = threading.RLock()
+
+logger = logging.getLogger(__name__)
+
+
+class LazyModule(object):
+    """
+    a module imported on first attribute access, so that importing the modules that use it stays fast
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def _load(self):
+        if self._module is None:
+            self._module = load(self._name)
+
+        return self._module
+
+
+class LazyAttribute(object):
+    """
+    a class or object of a lazily imported module; calls and attribute accesses are forwarded to it
+
+    Not usable in except clauses: catch the exceptions of a lazy module through the module, e.g.
+    except exceptions.ConnectionError.
+    """
+
+    def __init__(self, module, name):
+        self._lazy_module = module
+        self._lazy_name = name
+
+    def __call__(self, *args, **kwargs):
+        return getattr(self._lazy_module, self._lazy_name)(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(getattr(self._lazy_module, self._lazy_name), attr)
+
+
+def load(name):
+    """
+    import a module, recording the time taken if it was not imported yet
+
+    :param name: the module name
+    :return: the module
+    """
+
+    with _LOCK:
+        if sys.modules.get(name) is not None:
+            return sys.modules[name]
+
+        start = time.time()
+        module = importlib.import_module(name)
+        TIMINGS["imports"][name] = round((time.time() - start) * 1000, 1)
+
+    return module
+
+
+@contextmanager
+def timed(phase):
+    """
+    record the time taken by a startup phase
+
+    :param phase: the phase name
+    :return:
+    """
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        elapsed = round((time.time() - start) * 1000, 1)
+        TIMINGS["phases"][phase] = elapsed
+        logger.info("startup: %s in %.1f ms", phase, elapsed, extra={"phase": phase, "elapsed_ms": elapsed})
+
+
+def warm_up(steps):
+    """
+    run warm-up steps in a background thread, so that the server accepts requests in the meantime; a failed step
+    is logged and doesn't prevent the next ones
+
+    :param steps: list of (phase name, function) tuples
+    :return: the thread
+    """
+
+    def run():
+        with timed('warm_up'):
+            for phase, function in steps:
+                try:
+                    with timed(phase):
+                        function()
+                except Exception as e:
+                    logger.warning("startup: %s failed: %s", phase, e)
+
+    t = threading.Thread(target=run, name='warm-up')
+    t.daemon = True
+    t.start()
+
+    return t
+
+
+def timings():
+    """
+    return the recorded timings
+
+    :return: dictionary with the time of each lazy import and startup phase, in ms
+    """
+
+    with _LOCK:
+        return {"imports": dict(TIMINGS["imports"]), "phases": dict(TIMINGS["phases"])}
@@ -0,0 +1,161 @@
+import sqlite3
+import threading
+import time
+
+FLUSH_SIZE = 20  # buffered attempts
+FLUSH_INTERVAL = 30  # seconds
+HISTORY = 50  # most recent attempts kept and considered per network, older ones are deleted
+
+
+class StatsRecorder(object):
+    """
+    buffer connection attempts in memory and write them to the connections table in batches, keeping the HISTORY
+    most recent attempts of each network
+    """
+
+    def __init__(self, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._last_flush = time.time()
+
+    def record(self, db, iface, ssid, started, duration, attempts, success, signal=None):
+        """
+        record a connection attempt, flushing the buffer when it is full or old enough
+
+        :param db: sqlite3 database handle
+        :param iface: network interface
+        :param ssid: network name
+        :param started: start time of the attempt
+        :param duration: time spent connecting, in seconds
+        :param attempts: number of activations tried
+        :param success: whether the connection succeeded
+        :param signal: signal level of the network when the attempt started
+        :return:
+        """
+
+        with self._lock:
+            self._buffer.append((iface, ssid, started, duration, attempts, int(bool(success)), signal))
+            due = len(self._buffer) >= self.flush_size or time.time() - self._last_flush >= self.flush_interval
+
+        if due:
+            self.flush(db)
+
+    def flush(self, db):
+        """
+        write buffered attempts in a single transaction
+
+        :param db: sqlite3 database handle
+        :return: the number of attempts written
+        """
+
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            self._last_flush = time.time()
+
+        if not rows:
+            return 0
+
+        try:
+            query = "INSERT INTO connections(iface, ssid, started, duration, attempts, success, signal) " \
+                    "VALUES (?, ?, ?, ?, ?, ?, ?);"
+            db.executemany(query, rows)
+
+            query = "UPDATE networks SET connect_attempts=connect_attempts+1, " \
+                    "connect_failures=connect_failures+? WHERE iface=? AND ssid=?;"
+            db.executemany(query, [(1 - r[5], r[0], r[1]) for r in rows])
+
+            query = "DELETE FROM connections WHERE iface=? AND ssid=? AND id NOT IN " \
+                    "(SELECT id FROM connections WHERE iface=? AND ssid=? ORDER BY started DESC LIMIT ?);"
+            db.executemany(query, [(i, s, i, s, HISTORY) for i, s in set((r[0], r[1]) for r in rows)])
+
+            db.commit()
+        except Exception:
+            db.rollback()
+            # keep the attempts for the next flush
+            with self._lock:
+                self._buffer = rows + self._buffer
+            raise
+
+        return len(rows)
+
+    def close(self, path):
+        """
+        write the buffered attempts to a database file, e.g. at exit, when no request database handle is left
+
+        :param path: path of the sqlite3 database
+        :return: the number of attempts written
+        """
+
+        with self._lock:
+            if not self._buffer:
+                return 0
+
+        db = sqlite3.connect(path)
+        try:
+            return self.flush(db)
+        finally:
+            db.close()
+
+    def summary(self, db, iface=None, ssid=None):
+        """
+        aggregate the most recent attempts of each network
+
+        :param db: sqlite3 database handle
+        :param iface: if set, restrict to this network interface
+        :param ssid: if set, restrict to this network name
+        :return: dictionary keyed by (iface, ssid), with attempts, success rate and median time to connect
+        """
+
+        self.flush(db)
+
+        query = "SELECT iface, ssid, duration, success FROM connections"
+        conditions = []
+        params = []
+        if iface is not None:
+            conditions.append("iface=?")
+            params.append(iface)
+        if ssid is not None:
+            conditions.append("ssid=?")
+            params.append(ssid)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY started DESC;"
+
+        history = {}
+        for m in db.execute(query, params):
+            attempts = history.setdefault((m[0], m[1]), [])
+            if len(attempts) < HISTORY:
+                attempts.append((m[2], m[3]))
+
+        res = {}
+        for key, attempts in history.items():
+            durations = [d for d, success in attempts if success]
+            res[key] = {
+                "attempts": len(attempts),
+                "success_rate": float(len(durations)) / len(attempts),
+                "median_time": _median(durations)
+            }
+
+        return res
+
+
+def _median(values):
+    """
+    compute the median of a list of numbers
+
+    :param values: list of numbers
+    :return: the median, or None if the list is empty
+    """
+
+    if not values:
+        return None
+
+    values = sorted(values)
+    mid = len(values) // 2
+
+    if len(values) % 2:
+        return values[mid]
+
+    return (values[mid - 1] + values[mid]) / 2.0
@@ -0,0 +1,252 @@
+from contextlib import contextmanager
+import core
+import limits
+import logging
+import sqlite3
+import threading
+import time
+
+CHECK_INTERVAL = 5  # seconds between two checks of the connection
+SCAN_MAX_AGE = 30  # seconds a scan is reused before scanning again
+ROAM_MARGIN = 10  # dBm a stored network must be better than the current one to roam to it
+ROAM_HOLD = 3  # consecutive checks the better network must stay better before roaming
+RETRY_BACKOFF = 30  # seconds to wait after a failed reconnection
+
+SUPERVISORS = {}
+_LOCK = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+class Supervisor(threading.Thread):
+    """
+    keep a network interface connected to the best stored network
+
+    The supervisor reconnects as soon as the connection is lost, and roams to another stored network only
+    when it stays better than the current one by ROAM_MARGIN for ROAM_HOLD consecutive checks, so that
+    noisy scans do not make the interface flap between networks.
+
+    Scans and connections take a slot of the same admission pools as the REST endpoints (see limits.POOLS), so
+    that they never run at the same time as a client's radio operations; a check is skipped when no slot frees up.
+    """
+
+    def __init__(self, iface, db_path, interval=CHECK_INTERVAL, scan_max_age=SCAN_MAX_AGE, margin=ROAM_MARGIN,
+                 hold=ROAM_HOLD, backoff=RETRY_BACKOFF, pools=None):
+        super(Supervisor, self).__init__(name='supervisor-{}'.format(iface))
+        self.daemon = True
+
+        self.iface = iface
+        self.db_path = db_path
+        self.interval = interval
+        self.scan_max_age = scan_max_age
+        self.margin = margin
+        self.hold = hold
+        self.backoff = backoff
+        self.pools = pools or {}
+
+        self.current = ''
+        self.reconnects = 0
+        self.last_error = None
+
+        self._stop_event = threading.Event()
+        self._better = None
+        self._better_count = 0
+        self._retry_at = 0
+
+    def stop(self):
+        """
+        stop supervising the interface after the current check
+
+        :return:
+        """
+
+        self._stop_event.set()
+
+    def run(self):
+        db = sqlite3.connect(self.db_path)
+
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    self.check(db)
+                except core.WifiException as e:
+                    self.last_error = e.message
+                    logger.warning("supervisor %s: %s", self.iface, e.message)
+                except limits.Rejected as e:
+                    logger.info("supervisor %s: %s, checking again later", self.iface, e.message)
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.exception("supervisor %s: check failed", self.iface)
+
+                self._stop_event.wait(self.interval)
+        finally:
+            db.close()
+
+    def check(self, db):
+        """
+        check the connection once, reconnecting or roaming if needed
+
+        :param db: sqlite3 database handle
+        :return: the network the interface was connected to, if any
+        """
+
+        self.current = core.status(self.iface)
+
+        if time.time() < self._retry_at:
+            return None
+
+        if not self.current:
+            # connection lost: the freshest scan tells which stored networks are around
+            with self._slot('scan'):
+                cells = core.cached_cells(self.iface, 0)
+            candidates = core.rank(self.iface, cells, db)
+            if candidates:
+                return self._reconnect(candidates, db)
+            return None
+
+        with self._slot('scan'):
+            cells = core.cached_cells(self.iface, self.scan_max_age)
+        candidates = core.rank(self.iface, cells, db)
+        if not candidates:
+            return None
+
+        best = candidates[0]
+        current = None
+        for c in candidates:
+            if c["ssid"] == self.current:
+                current = c
+                break
+
+        if best["ssid"] == self.current or (current is not None and core.smoothed_signal(self.iface, best) <
+                                            core.smoothed_signal(self.iface, current) + self.margin):
+            self._better = None
+            self._better_count = 0
+            return None
+
+        if best["ssid"] != self._better:
+            self._better = best["ssid"]
+            self._better_count = 0
+
+        self._better_count += 1
+        if self._better_count < self.hold:
+            return None
+
+        return self._reconnect(candidates, db)
+
+    def _reconnect(self, candidates, db):
+        """
+        connect to the first stored network that accepts the connection
+
+        :param candidates: the cells of the networks, as dictionaries, best first
+        :param db: sqlite3 database handle
+        :return: the network name
+        """
+
+        errors = []
+        with self._slot('radio'):
+            self._better = None
+            self._better_count = 0
+
+            for cell in candidates:
+                logger.info("supervisor %s: connecting to %s (was %r)", self.iface, cell["ssid"], self.current)
+
+                try:
+                    core.reconnect(self.iface, cell["ssid"], db, cell["signal"])
+                except core.WifiException as e:
+                    errors.append(e)
+                    continue
+
+                self.current = cell["ssid"]
+                self.reconnects += 1
+                self.last_error = None
+
+                return cell["ssid"]
+
+        # none of them: wait before trying again
+        self._retry_at = time.time() + self.backoff
+
+        codes = set(e.code for e in errors)
+        raise core.WifiException("; ".join(e.message for e in errors), codes.pop() if len(codes) == 1 else 500)
+
+    @contextmanager
+    def _slot(self, pool_name):
+        """
+        hold a slot of an admission pool, if the supervisor shares them with the REST endpoints
+
+        :param pool_name: the admission pool, see limits.POOLS
+        :return:
+        """
+
+        pool = self.pools.get(pool_name)
+        if pool is None:
+            yield
+            return
+
+        pool.acquire(None)
+        try:
+            yield
+        finally:
+            pool.release()
+
+    def to_dict(self):
+        """
+        describe the supervisor state
+
+        :return: the state as dictionary
+        """
+
+        return {
+            "iface": self.iface,
+            "current": self.current,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error
+        }
+
+
+def start(iface, db_path, **kwargs):
+    """
+    start supervising a network interface, unless it is supervised already
+
+    :param iface: network interface
+    :param db_path: path of the sqlite3 database
+    :return: the supervisor
+    """
+
+    with _LOCK:
+        supervisor = SUPERVISORS.get(iface)
+        if supervisor is None or not supervisor.is_alive():
+            supervisor = SUPERVISORS[iface] = Supervisor(iface, db_path, **kwargs)
+            supervisor.start()
+
+    return supervisor
+
+
+def stop(iface):
+    """
+    stop supervising a network interface
+
+    :param iface: network interface
+    :return: True if the interface was supervised
+    """
+
+    with _LOCK:
+        supervisor = SUPERVISORS.pop(iface, None)
+
+    if supervisor is None:
+        return False
+
+    supervisor.stop()
+    return True
+
+
+def running():
+    """
+    describe all running supervisors
+
+    :return: list of supervisor states
+    """
+
+    with _LOCK:
+        supervisors = list(SUPERVISORS.values())
+
+    return [s.to_dict() for s in supervisors]
@@ -0,0 +1,369 @@
+from collections import namedtuple
+import os
+import re
+import startup
+import tempfile
+import threading
+import time
+
+COALESCE_WINDOW = 0.05  # seconds
+INTERFACES = '/etc/network/interfaces'  # same as wifi.Scheme.interfaces
+
+# scheme options that may be written to the file: those of wifi.scheme.configuration and of a pinned access point;
+# any other option, e.g. an up or pre-up hook, would run as root when the scheme is activated
+OPTION_KEYS = frozenset(['wpa-ssid', 'wpa-psk', 'wpa-bssid', 'wireless-essid', 'wireless-key', 'wireless-channel',
+                         'wireless-ap'])
+
+# plain network interface names, as accepted by check_scheme and by the privileged helper
+IFACE_RE = re.compile(r'^\w[\w.:-]*$')
+
+# a scheme as written to the file, for callers without wifi.Scheme objects (e.g. the privileged helper)
+Stanza = namedtuple('Stanza', 'interface name options')
+
+# imported on first parse, not when the service starts
+_wifi = startup.LazyModule('wifi')
+_scheme = startup.LazyModule('wifi.scheme')
+
+
+class _Batch(object):
+    """
+    a group of edits flushed to disk with a single write
+    """
+
+    def __init__(self):
+        self.ops = []
+        self.error = None
+        self.done = threading.Event()
+
+
+class InterfacesWriter(object):
+    """
+    serialize edits to /etc/network/interfaces
+
+    Edits submitted by concurrent callers within the coalescing window are applied together with one
+    temp-file + fsync + rename, so readers never see a partially written file. The writer keeps a
+    parsed index of the schemes in the file, reloaded only when the file changes on disk. With remote set
+    (e.g. HelperClient.apply), the edits are sent to it and the file is only read.
+    """
+
+    def __init__(self, path=None, window=COALESCE_WINDOW, replace=None, remote=None):
+        self.path = path or INTERFACES
+        self.window = window
+        self.replace = replace or atomic_write
+        self.remote = remote
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._batch = None
+        self._index = None
+        self._stat = None
+
+    def all(self):
+        """
+        return all schemes stored in the file
+
+        :return: list of scheme objects
+        """
+
+        with self._io_lock:
+            return list(self._load().values())
+
+    def find(self, iface, ssid):
+        """
+        look up a scheme by network interface and name
+
+        :param iface: network interface
+        :param ssid: network name
+        :return: the matching scheme or None
+        """
+
+        with self._io_lock:
+            return self._load().get((iface, ssid))
+
+    def save(self, scheme):
+        """
+        add a scheme to the file, replacing any scheme with the same interface and name
+
+        :param scheme: the scheme object
+        :return:
+        """
+
+        self.apply([('save', scheme)])
+
+    def delete(self, iface, ssid):
+        """
+        remove a scheme from the file
+
+        :param iface: network interface
+        :param ssid: network name
+        :return:
+        """
+
+        self.apply([('delete', (iface, ssid))])
+
+    def sync(self, schemes):
+        """
+        make the file contain exactly the given schemes, rewriting only the stanzas that differ
+
+        :param schemes: list of scheme objects
+        :return: the number of stanzas added, replaced or removed
+        """
+
+        desired = dict(((s.interface, s.name), s) for s in schemes)
+
+        with self._io_lock:
+            index = self._load()
+            ops = [('delete', key) for key in index if key not in desired]
+            ops += [('save', s) for key, s in desired.items() if key not in index or index[key].options != s.options]
+
+        if ops:
+            self.apply(ops)
+
+        return len(ops)
+
+    def apply(self, ops):
+        """
+        apply a list of edits and wait until they are on disk
+
+        :param ops: list of ('save', scheme) or ('delete', (iface, ssid)) tuples
+        :return:
+        """
+
+        with self._cond:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Batch()
+            batch.ops.extend(ops)
+
+        if leader:
+            # give concurrent callers a chance to join this batch
+            if self.window > 0:
+                time.sleep(self.window)
+
+            with self._cond:
+                self._batch = None
+
+            with self._io_lock:
+                try:
+                    self._flush(batch.ops)
+                except Exception as e:
+                    batch.error = e
+
+            batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+
+    def _load(self):
+        """
+        parse the file into the index, unless it is unchanged since the last parse
+
+        :return: dictionary of schemes keyed by (interface, name)
+        """
+
+        try:
+            st = os.stat(self.path)
+            stat = (st.st_ino, st.st_size, st.st_mtime)
+        except OSError:
+            stat = None
+
+        if self._index is None or stat != self._stat:
+            content = self._read()
+            self._index = self._parse(content)
+            self._stat = stat
+
+        return self._index
+
+    def _read(self):
+        """
+        read the file content
+
+        :return: the content, or the empty string if the file does not exist
+        """
+
+        try:
+            with open(self.path, 'r') as f:
+                return f.read()
+        except IOError:
+            return ''
+
+    def _parse(self, content):
+        """
+        build the scheme index from file content
+
+        :param content: file content
+        :return: dictionary of schemes keyed by (interface, name)
+        """
+
+        index = {}
+        for s in _scheme.extract_schemes(content, scheme_class=_wifi.Scheme):
+            index[(s.interface, s.name)] = s
+
+        return index
+
+    def _flush(self, ops):
+        """
+        apply edits to the file content and atomically replace the file
+
+        :param ops: list of edits
+        :return:
+        """
+
+        if self.remote is not None:
+            # the privileged helper edits the file
+            self.remote(ops)
+            new_content = self._read()
+        else:
+            content = self._read()
+            new_content = edit(content, ops)
+            if new_content != content:
+                self._replace(new_content)
+
+        self._index = self._parse(new_content)
+        try:
+            st = os.stat(self.path)
+            self._stat = (st.st_ino, st.st_size, st.st_mtime)
+        except OSError:
+            self._stat = None
+
+    def _replace(self, content):
+        """
+        replace the file content
+
+        :param content: new file content
+        :return:
+        """
+
+        self.replace(self.path, content)
+
+
+def edit(content, ops):
+    """
+    apply edits to file content
+
+    :param content: file content
+    :param ops: list of ('save', scheme) or ('delete', (iface, ssid)) tuples; schemes are wifi.Scheme or Stanza
+    :return: the new content
+    """
+
+    for op, arg in ops:
+        if op == 'save':
+            content = _remove_stanza(content, arg.interface, arg.name)
+            if content:
+                content = content.rstrip('\n') + '\n\n'
+            content += _stanza(arg)
+        elif op == 'delete':
+            content = _remove_stanza(content, arg[0], arg[1])
+        else:
+            raise ValueError("unknown operation {}".format(op))
+
+    return content
+
+
+def check_scheme(iface, ssid, options):
+    """
+    make sure a scheme is written to the file as a single stanza with allowed options only
+
+    :param iface: network interface
+    :param ssid: network name
+    :param options: the scheme options as dictionary
+    :raises ValueError: if the scheme can't be written safely
+    :return:
+    """
+
+    if not isinstance(iface, basestring) or not IFACE_RE.match(iface):
+        raise ValueError("invalid interface name {!r}".format(iface))
+
+    if not isinstance(ssid, basestring) or not ssid or any(c.isspace() for c in ssid):
+        raise ValueError("invalid network name {!r}".format(ssid))
+
+    if not isinstance(options, dict):
+        raise ValueError("options must be a dictionary")
+
+    for key, value in options.items():
+        if key not in OPTION_KEYS:
+            raise ValueError("option {!r} not allowed".format(key))
+
+        if not isinstance(value, basestring) or not value.strip() or '\n' in value or '\r' in value:
+            raise ValueError("invalid value of option {}".format(key))
+
+
+def atomic_write(path, content):
+    """
+    write content to a temporary file, fsync it and rename it over the file
+
+    :param path: path of the file
+    :param content: new file content
+    :return:
+    """
+
+    dir_name = os.path.dirname(os.path.abspath(path))
+    fd, tmp_name = tempfile.mkstemp(prefix='.interfaces.', dir=dir_name)
+
+    try:
+        try:
+            os.fchmod(fd, os.stat(path).st_mode & 0o7777)
+        except OSError:
+            os.fchmod(fd, 0o644)
+
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.rename(tmp_name, path)
+    except Exception:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+    # persist the rename itself
+    dir_fd = os.open(dir_name, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def _stanza(scheme):
+    """
+    render the stanza of a scheme, the same way Scheme.__str__ does
+
+    :param scheme: wifi.Scheme or Stanza
+    :return: the stanza
+    """
+
+    options = ''.join("\n    {} {}".format(k, v) for k, v in scheme.options.items())
+
+    return "iface {}-{} inet dhcp".format(scheme.interface, scheme.name) + options + '\n'
+
+
+def _remove_stanza(content, iface, ssid):
+    """
+    remove the stanza of a scheme from file content, the same way Scheme.delete does
+
+    :param content: file content
+    :param iface: network interface
+    :param ssid: network name
+    :return: the content without the stanza
+    """
+
+    header = "iface {}-{} inet dhcp".format(iface, ssid)
+    res = []
+    skip = False
+
+    for line in content.splitlines(True):
+        if not line.strip():
+            skip = False
+        elif skip and not line[0].isspace():
+            # stanza ended without a blank line
+            skip = False
+
+        if line.strip() == header:
+            skip = True
+        if not skip:
+            res.append(line)
+
+    return ''.join(res)